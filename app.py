@@ -1,26 +1,53 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, Response, g, jsonify
 import os
 import logging
 import csv
 import io
+import base64
+import itertools
+import time
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
-# Import database functions and the new notifications function
+# Import database functions and the notifications queue
+import cache
+import log_config
 import database
-from notifications import send_teams_notification
+import events
+import metrics
+import validation
+import bulk_import
+import records_view
+import search
+import profiles
+import rollups
+from badges import BadgeAllocator, pools_from_env
+from records_view import format_timestamp
+from notifications import queue_teams_notification, start_dispatcher
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure basic logging (do this once)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Structured logging through a background thread (see log_config.py)
+log_config.configure_logging()
+logger = logging.getLogger(__name__)
 
 # Initialize Flask App
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'change_this_in_production') 
 
+# Per-route latency and in-flight requests for /metrics
+metrics.instrument_app(app)
+
+@app.before_request
+def track_request_writes():
+    # Reads after a write in the same request go to the primary, not the replica
+    database.begin_request()
+
+# Deliver any notifications spooled before the last restart
+start_dispatcher()
+
 VISITOR_TYPES = ['Contractor', 'Family', 'Food Delivery', 'Meeting', 'Vendor']
 BRANCHES = ['Kiln Creek', '1A University']
 DEPARTMENTS = [
@@ -32,6 +59,20 @@ DEPARTMENTS = [
 ]
 BADGE_NUMBERS = [str(i) for i in range(56863, 56873)]
 
+# Per-branch badge pools (BADGE_POOLS), kept in step with database writes
+badge_allocator = BadgeAllocator(pools_from_env(BADGE_NUMBERS), database.get_checked_in_badges, cache.write_version)
+database.add_write_listener(badge_allocator.on_write)
+
+# Live updates for open pages on every worker
+database.add_write_listener(events.bus.publish)
+
+# Typeahead over names, hosts and vendors, kept current from the event log
+search_index = search.SearchIndex(database.get_search_rows, events.bus)
+search_index.start()
+
+# Last-visit details for pre-filling the check-in form
+profile_cache = profiles.ProfileCache(database.get_last_visit, events.bus)
+
 
 @app.context_processor
 def inject_now():
@@ -40,12 +81,44 @@ def inject_now():
 @app.context_processor
 def inject_visitor_count():
     """Inject the current visitor count into all templates."""
+    if 'desk_snapshot' in g:
+        # Already loaded by the route, no need for another query
+        return {'current_visitor_count': g.desk_snapshot['count']}
     count, error = database.get_current_visitor_count()
     if error:
-        logging.error(f"Error getting visitor count: {error}")
+        logger.error("Error getting visitor count: %s", error)
         count = 0
     return {'current_visitor_count': count}
 
+EMPTY_SNAPSHOT = {'checked_in': [], 'recent': [], 'recent_next': None, 'pending': [], 'badges_in_use': [], 'count': 0}
+
+def load_desk_snapshot():
+    """Loads the front desk snapshot once per request (empty on error)."""
+    if 'desk_snapshot' not in g:
+        snapshot, error = database.get_desk_snapshot()
+        if error:
+            logger.error("Error retrieving desk snapshot: %s", error)
+            flash(f"Error retrieving records: {error}", 'danger')
+            snapshot = EMPTY_SNAPSHOT
+        g.desk_snapshot = snapshot
+    return g.desk_snapshot
+
+def encode_page_cursor(key):
+    """Turns a (CheckInTime, VisitorID) page key into an opaque URL-safe token."""
+    if not key:
+        return None
+    check_in_time, visitor_id = key
+    raw = f"{check_in_time.isoformat()}|{visitor_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_page_cursor(token):
+    """Reverses encode_page_cursor; raises ValueError on a malformed token."""
+    try:
+        check_in_time, visitor_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(check_in_time), int(visitor_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page cursor: {token}") from e
+
 # --- Routes ---
 
 @app.route('/')
@@ -57,34 +130,29 @@ def index():
 def visitor_form():
     form_data_on_error = {} # Store submitted data if validation fails
     
-    # Get available badges (filter out badges that are already checked in)
-    checked_in_badges, error = database.get_checked_in_badges()
-    if error:
-        logging.error(f"Error getting checked-in badges: {error}")
-        checked_in_badges = []
+    # Pending visitors come from one snapshot query
+    snapshot = load_desk_snapshot()
     
-    # Filter out badges that are already in use
-    available_badges = [badge for badge in BADGE_NUMBERS if badge not in checked_in_badges]
+    # Free badges from the allocator's bitmaps, plus which branch each belongs to
+    available_badges = badge_allocator.available()
+    badge_branches = {badge: badge_allocator.branch_of(badge) for badge in available_badges}
     
-    # Get pending visitors for the pre-registered visitors modal
-    pending_visitors, pending_error = database.get_pending_visitors()
-    if pending_error:
-        logging.error(f"Error retrieving pending visitors: {pending_error}")
-        flash(f"Error retrieving pending visitors: {pending_error}", 'danger')
-        pending_visitors = [] # Show empty list on error
+    # Pending visitors for the pre-registered visitors modal
+    pending_visitors = snapshot['pending']
     
     # Check if a pending_id was provided in the URL
     pending_id = request.args.get('pending_id')
     visitor = {}
     
     # If pending_id is provided, get the visitor details to pre-populate the form
-    if pending_id:
-        for pending_visitor in pending_visitors:
-            if str(pending_visitor['VisitorID']) == str(pending_id):
-                visitor = pending_visitor
-                # Set the check-in type to immediate
-                visitor['check_in_type'] = 'immediate'
-                break
+    if pending_id and pending_id.isdigit():
+        pending_visitor, error = database.get_visitor_by_id(int(pending_id))
+        if error:
+            logger.error("Error retrieving pending visitor %s: %s", pending_id, error)
+        elif pending_visitor and pending_visitor['Status'] == 'Pending':
+            visitor = dict(pending_visitor)
+            # Set the check-in type to immediate
+            visitor['check_in_type'] = 'immediate'
     
     if request.method == 'POST':
         # Determine if this is an immediate check-in or advanced check-in
@@ -119,113 +187,146 @@ def visitor_form():
         form_data_on_error = visitor_details # Keep data for re-rendering form on error
 
         # Basic Server-Side Validation - different required fields based on check-in type
-        if is_advanced:
-            required_fields = [
-                'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 
-                'DepartmentVisited', 'HostEmployeeName', 'ColleagueFirstName', 
-                'ColleagueLastName', 'AdvanceCheckInTime'
-            ]
-        else:
-            required_fields = [
-                'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 
-                'DepartmentVisited', 'BadgeNumber', 'HostEmployeeName'
-            ]
-            
-        missing_fields = [field for field in required_fields if not visitor_details.get(field)]
+        required_fields = validation.ADVANCED_REQUIRED_FIELDS if is_advanced else validation.IMMEDIATE_REQUIRED_FIELDS
+        missing = validation.missing_fields(visitor_details, required_fields)
 
-        if missing_fields:
-            flash(f"Error: Missing required fields: {', '.join(missing_fields)}", 'danger')
+        if missing:
+            flash(f"Error: Missing required fields: {', '.join(missing)}", 'danger')
             # Re-render form with submitted data and errors
             return render_template('visitor_form.html',
                                    visitor_types=VISITOR_TYPES, branches=BRANCHES,
                                    departments=DEPARTMENTS, badge_numbers=available_badges,
+                                   badge_branches=badge_branches,
                                    visitor=form_data_on_error, # Pass back entered data
                                    pending_visitors=pending_visitors) # Pass pending visitors for the modal
 
         # --- Add to Database ---
         if is_advanced:
-            logging.info(f"Attempting to add advanced check-in visitor: {visitor_details.get('GuestLastName')}")
+            logger.info("Attempting to add advanced check-in visitor: %s", visitor_details.get('GuestLastName'))
             success, db_message = database.add_advanced_visitor(visitor_details)
             
             if success:
-                logging.info(f"Successfully added advanced check-in visitor: {visitor_details.get('GuestLastName')}")
+                logger.info("Successfully added advanced check-in visitor: %s", visitor_details.get('GuestLastName'))
                 flash('Visitor pre-registered successfully!', 'success')
                 return redirect(url_for('index'))
         else:
-            logging.info(f"Attempting to add visitor: {visitor_details.get('GuestLastName')}")
-            success, db_message = database.add_visitor(visitor_details)
+            # Reserve the badge in this worker first; the database insert then
+            # confirms no other kiosk has it
+            badge_number = visitor_details['BadgeNumber']
+            success, db_message = badge_allocator.claim(badge_number, visitor_details['Branch'])
+            if success:
+                logger.info("Attempting to add visitor: %s", visitor_details.get('GuestLastName'))
+                success, db_message = database.add_visitor(visitor_details)
+                if not success:
+                    badge_allocator.release(badge_number)
             
             if success:
-                logging.info(f"Successfully added visitor: {visitor_details.get('GuestLastName')}")
+                logger.info("Successfully added visitor: %s", visitor_details.get('GuestLastName'))
                 flash('Visitor checked in successfully!', 'success')
 
-                # --- Attempt to Send Teams Notification (after successful DB insert) ---
-                logging.info(f"Attempting to send Teams notification for {visitor_details.get('GuestLastName')}")
+                # --- Queue Teams Notification (sent by a background thread) ---
+                # Don't let notification failure break the user flow
                 try:
-                    # Don't let notification failure break the user flow
-                    notification_sent = send_teams_notification(visitor_details)
-                    if not notification_sent:
-                         # Optionally flash a less severe message if notification fails
-                         # flash('Visitor checked in, but notification could not be sent.', 'warning')
-                         pass # Already logged in the notification function
+                    queue_teams_notification(visitor_details)
                 except Exception as e:
-                    # Catch any unexpected errors from the notification function itself
-                    logging.error(f"Error calling send_teams_notification function: {e}", exc_info=True)
-                    # flash('Visitor checked in, but an error occurred sending the notification.', 'warning')
+                    # Catch any unexpected errors from the notification queue itself
+                    logger.error("Error queueing Teams notification: %s", e, exc_info=True)
 
                 # --- Redirect after DB success, regardless of notification outcome ---
                 return redirect(url_for('view_records'))
 
         # If we get here, there was a database error
         if not success:
-            logging.error(f"Database error adding visitor: {db_message}")
+            logger.error("Database error adding visitor: %s", db_message)
             flash(f'Error adding visitor: {db_message}', 'danger')
             # Re-render form with existing data
             return render_template('visitor_form.html',
                                    visitor_types=VISITOR_TYPES, branches=BRANCHES,
                                    departments=DEPARTMENTS, badge_numbers=available_badges,
+                                   badge_branches=badge_branches,
                                    visitor=form_data_on_error, # Pass back entered data
                                    pending_visitors=pending_visitors) # Pass pending visitors for the modal
 
-    # GET request: Show the blank form
+    # GET request: Show the form, blank or pre-filled from pending_id
     return render_template('visitor_form.html',
                            visitor_types=VISITOR_TYPES, branches=BRANCHES,
                            departments=DEPARTMENTS, badge_numbers=available_badges,
-                           visitor=form_data_on_error, # Pass empty dict or prior data if error reload
+                           badge_branches=badge_branches,
+                           visitor=visitor,
                            pending_visitors=pending_visitors) # Pass pending visitors for the modal
 
 @app.route('/records')
 def view_records():
     """Displays the list of visitor records and pending visitors."""
-    logging.info("Fetching visitor records")
-    visitors, error = database.get_all_visitors()
-    pending_visitors, pending_error = database.get_pending_visitors()
+    logger.info("Fetching visitor records")
+    snapshot = load_desk_snapshot()
+
+    # Rows are split per tab, formatted and rendered (or taken from the row cache) in records_view
+    view = records_view.build(snapshot, datetime.utcnow())
+    return render_template('records.html', view=view,
+                          recent_next=encode_page_cursor(snapshot['recent_next']),
+                          visitor_types=VISITOR_TYPES, branches=BRANCHES,
+                          departments=DEPARTMENTS,
+                          sse_busy_retry_seconds=events.SSE_BUSY_RETRY_SECONDS)
+
+@app.route('/records/history')
+def visitor_history():
+    """Returns a page of visitor history as JSON for the Recent Visitors tab.
 
+    Accepts the filters in database.HISTORY_FILTERS (dates as YYYY-MM-DD) and a
+    `cursor` token from the previous page.
+    """
+    filters = {name: request.args.get(name) for name in database.HISTORY_FILTERS}
+    try:
+        if filters['date_from']:
+            filters['date_from'] = datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        if filters['date_to']:
+            # Include the entire end date
+            filters['date_to'] = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        after = decode_page_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    page, error = database.get_visitor_page(filters, after=after)
     if error:
-        logging.error(f"Error retrieving records: {error}")
-        flash(f"Error retrieving records: {error}", 'danger')
-        visitors = [] # Show empty list on error
-        
-    if pending_error:
-        logging.error(f"Error retrieving pending visitors: {pending_error}")
-        flash(f"Error retrieving pending visitors: {pending_error}", 'danger')
-        pending_visitors = [] # Show empty list on error
-
-    # Get available badges (filter out badges that are already checked in)
-    checked_in_badges, badge_error = database.get_checked_in_badges()
-    if badge_error:
-        logging.error(f"Error getting checked-in badges: {badge_error}")
-        checked_in_badges = []
-    
-    # Filter out badges that are already in use
-    available_badges = [badge for badge in BADGE_NUMBERS if badge not in checked_in_badges]
-    available_badges.insert(0, "No Badge")  # Add "No Badge" option
+        logger.error("Error retrieving visitor history: %s", error)
+        return jsonify({'error': error}), 500
+
+    visitors = [
+        {
+            'VisitorID': visitor['VisitorID'],
+            'GuestFirstName': visitor['GuestFirstName'],
+            'GuestLastName': visitor['GuestLastName'],
+            'VisitorType': visitor['VisitorType'],
+            'HostEmployeeName': visitor['HostEmployeeName'],
+            'DepartmentVisited': visitor['DepartmentVisited'],
+            'Branch': visitor['Branch'],
+            'BadgeNumber': visitor['BadgeNumber'],
+            'CheckInTime': format_timestamp(visitor['CheckInTime']),
+            'CheckOutTime': format_timestamp(visitor['CheckOutTime']),
+            'Status': visitor['Status'],
+        }
+        for visitor in page['visitors']
+    ]
+    return jsonify({'visitors': visitors, 'next_cursor': encode_page_cursor(page['next'])})
 
-    # No need to format dates here if Jinja does it... maybe
-    return render_template('records.html', 
-                          visitors=visitors, 
-                          pending_visitors=pending_visitors,
-                          badge_numbers=available_badges)
+@app.route('/records/import', methods=['POST'])
+def import_visitors():
+    """Bulk pre-registration from an uploaded CSV or JSON file (field `file`) or a JSON body.
+
+    Returns a JSON report of inserted rows and per-row errors. Add ?dry_run=1 to only validate.
+    """
+    upload = request.files.get('file')
+    try:
+        if upload:
+            rows = bulk_import.read_rows(upload.read(), upload.filename or '')
+        else:
+            rows = bulk_import.read_rows(request.get_data())
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f"Could not read import file: {e}"}), 400
+
+    report = bulk_import.import_rows(rows, submitter=request.remote_addr, dry_run=bool(request.args.get('dry_run')))
+    return jsonify(report), 200 if not report['errors'] else 207
 
 @app.route('/checkin-pending/<int:visitor_id>', methods=['POST'])
 def checkin_pending(visitor_id):
@@ -236,14 +337,23 @@ def checkin_pending(visitor_id):
         flash('Please select a badge number', 'warning')
         return redirect(url_for('view_records'))
     
-    logging.info(f"Attempting to check in pending visitor ID: {visitor_id} with badge: {badge_number}")
-    success, message = database.checkin_pending_visitor(visitor_id, badge_number)
+    logger.info("Attempting to check in pending visitor ID: %s with badge: %s", visitor_id, badge_number)
+    # The badge must come from the pool of the branch the visitor registered for
+    visitor, message = database.get_visitor_by_id(visitor_id)
+    if visitor is None:
+        success, message = False, message or f"Visitor {visitor_id} was not found."
+    else:
+        success, message = badge_allocator.claim(badge_number, visitor['Branch'])
+    if success:
+        success, message = database.checkin_pending_visitor(visitor_id, badge_number)
+        if not success:
+            badge_allocator.release(badge_number)
 
     if success:
-        logging.info(f"Successfully checked in pending visitor ID: {visitor_id}")
+        logger.info("Successfully checked in pending visitor ID: %s", visitor_id)
         flash(message, 'success')
     else:
-        logging.warning(f"Failed to check in pending visitor ID {visitor_id}: {message}")
+        logger.warning("Failed to check in pending visitor ID %s: %s", visitor_id, message)
         flash(f'Error checking in: {message}', 'warning')
 
     return redirect(url_for('view_records'))
@@ -251,19 +361,55 @@ def checkin_pending(visitor_id):
 @app.route('/checkout/<int:visitor_id>', methods=['POST'])
 def checkout(visitor_id):
     """Handles the checkout action."""
-    logging.info(f"Attempting to check out visitor ID: {visitor_id}")
+    logger.info("Attempting to check out visitor ID: %s", visitor_id)
     success, message = database.checkout_visitor(visitor_id)
 
     if success:
-        logging.info(f"Successfully checked out visitor ID: {visitor_id}")
+        logger.info("Successfully checked out visitor ID: %s", visitor_id)
         flash(message, 'success')
     else:
         # Log specific message (could be 'not found' or 'db error')
-        logging.warning(f"Failed to checkout visitor ID {visitor_id}: {message}")
+        logger.warning("Failed to checkout visitor ID %s: %s", visitor_id, message)
         flash(f'Error checking out: {message}', 'warning') # Use warning as it might not be a critical db error
 
     return redirect(url_for('view_records')) # Redirect back to the records page
 
+@app.route('/checkout', methods=['POST'])
+def checkout_selected():
+    """Checks out several visitors at once.
+
+    Takes `visitor_ids` from the records page form, or a JSON body like
+    {"visitor_ids": [1, 2]} (answered with JSON listing who was checked out).
+    """
+    if request.is_json:
+        visitor_ids = (request.get_json(silent=True) or {}).get('visitor_ids')
+    else:
+        visitor_ids = request.form.getlist('visitor_ids')
+    try:
+        visitor_ids = [int(visitor_id) for visitor_id in visitor_ids or []]
+    except (TypeError, ValueError):
+        visitor_ids = None
+
+    if request.is_json:
+        if visitor_ids is None:
+            return jsonify({'error': 'visitor_ids must be a list of visitor IDs'}), 400
+        checked_out, error = database.checkout_visitors(visitor_ids)
+        if error:
+            return jsonify({'error': error}), 500
+        return jsonify({'checked_out': [visitor['VisitorID'] for visitor in checked_out]})
+
+    if not visitor_ids:
+        flash('Select at least one visitor to check out.', 'warning')
+        return redirect(url_for('view_records'))
+    checked_out, error = database.checkout_visitors(visitor_ids)
+    if error:
+        flash(f'Error checking out: {error}', 'warning')
+    elif len(checked_out) < len(visitor_ids):
+        flash(f'Checked out {len(checked_out)} of {len(visitor_ids)} visitors; the others were already checked out.', 'warning')
+    else:
+        flash(f'Checked out {len(checked_out)} visitor(s).', 'success')
+    return redirect(url_for('view_records'))
+
 # Advanced check-in functionality has been integrated into the visitor_form route
 
 @app.route('/vendor-portal', methods=['GET', 'POST'])
@@ -289,32 +435,28 @@ def vendor_portal():
         }
 
         # Basic Server-Side Validation
-        required_fields = [
-            'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 
-            'DepartmentVisited', 'HostEmployeeName', 'VendorName', 'AdvanceCheckInTime'
-        ]
-        missing_fields = [field for field in required_fields if not visitor_details.get(field)]
-
-        if missing_fields:
-            flash(f"Error: Missing required fields: {', '.join(missing_fields)}", 'danger')
+        missing = validation.missing_fields(visitor_details, validation.VENDOR_REQUIRED_FIELDS)
+
+        if missing:
+            flash(f"Error: Missing required fields: {', '.join(missing)}", 'danger')
             # Re-render form with error
             return render_template('vendor_portal.html',
                                   visitor_types=VISITOR_TYPES, branches=BRANCHES,
                                   departments=DEPARTMENTS)
 
         # Add to Database
-        logging.info(f"Attempting to add vendor pre-registration: {visitor_details.get('GuestLastName')}")
+        logger.info("Attempting to add vendor pre-registration: %s", visitor_details.get('GuestLastName'))
         success, db_message = database.add_advanced_visitor(visitor_details)
 
         if success:
-            logging.info(f"Successfully added vendor pre-registration: {visitor_details.get('GuestLastName')}")
+            logger.info("Successfully added vendor pre-registration: %s", visitor_details.get('GuestLastName'))
             # Show success message
             return render_template('vendor_success.html', 
                                   visitor=visitor_details,
                                   scheduled_time=datetime.fromisoformat(visitor_details.get('AdvanceCheckInTime').replace('Z', '+00:00')))
         else:
             # Database add failed
-            logging.error(f"Database error adding vendor pre-registration: {db_message}")
+            logger.error("Database error adding vendor pre-registration: %s", db_message)
             flash(f'Error registering visit: {db_message}', 'danger')
             # Re-render form with error
             return render_template('vendor_portal.html',
@@ -326,6 +468,57 @@ def vendor_portal():
                           visitor_types=VISITOR_TYPES, branches=BRANCHES,
                           departments=DEPARTMENTS)
 
+EXPORT_HEADER = [
+    'Visitor ID', 'First Name', 'Last Name', 'Type', 'Host', 
+    'Department', 'Branch', 'Badge', 'Check-In Time', 
+    'Check-Out Time', 'Status', 'Vendor Name', 'Comments',
+    'Registered By First Name', 'Registered By Last Name', 
+    'Expected Check-In Time', 'Submission Time', 'Is Pre-registered', 'Submitter IP',
+    'Check-Out Reason'
+]
+EXPORT_ROWS_PER_CHUNK = 200 # CSV rows formatted before a chunk is sent to the client
+
+def export_row(visitor):
+    """Formats one visitor record as a CSV row matching EXPORT_HEADER."""
+    return [
+        visitor['VisitorID'],
+        visitor['GuestFirstName'],
+        visitor['GuestLastName'],
+        visitor['VisitorType'],
+        visitor['HostEmployeeName'],
+        visitor['DepartmentVisited'],
+        visitor['Branch'],
+        visitor['BadgeNumber'],
+        format_timestamp(visitor['CheckInTime']),
+        format_timestamp(visitor['CheckOutTime']),
+        'Checked In' if visitor['Status'] == 'CheckedIn' else 'Checked Out' if visitor['Status'] == 'CheckedOut' else visitor['Status'],
+        visitor['VendorName'] or 'N/A',
+        visitor['Comments'] or 'N/A',
+        visitor.get('ColleagueFirstName') or 'N/A',
+        visitor.get('ColleagueLastName') or 'N/A',
+        format_timestamp(visitor.get('AdvanceCheckInTime')),
+        format_timestamp(visitor.get('SubmissionTime')),
+        'Yes' if visitor.get('IsAdvanceCheckIn') else 'No',
+        visitor.get('SubmitterIPAddress') or 'N/A',
+        visitor.get('CheckOutReason') or 'N/A'
+    ]
+
+def generate_csv(visitors):
+    """Yields the CSV file in chunks as rows are formatted, so memory use stays flat."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    pending_rows = 0
+    for visitor in visitors:
+        writer.writerow(export_row(visitor))
+        pending_rows += 1
+        if pending_rows >= EXPORT_ROWS_PER_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending_rows = 0
+    yield buffer.getvalue()
+
 @app.route('/export-csv', methods=['POST'])
 def export_csv():
     """Exports visitor records to CSV based on date range."""
@@ -344,77 +537,195 @@ def export_csv():
         # Add one day to end_date to include the entire end date
         end_date = end_date + timedelta(days=1)
         
-        # Get records within date range
-        visitors, error = database.get_visitors_by_date_range(start_date, end_date)
+        # Open a streaming cursor over the date range
+        visitors, error = database.stream_visitors_by_date_range(start_date, end_date)
         
         if error:
-            logging.error(f"Error retrieving records for export: {error}")
+            logger.error("Error retrieving records for export: %s", error)
             flash(f"Error retrieving records: {error}", 'danger')
             return redirect(url_for('view_records'))
         
-        if not visitors:
+        # Peek at the first row so an empty range can still redirect with a message
+        first_visitor = next(visitors, None)
+        if first_visitor is None:
             flash("No records found in the selected date range", 'warning')
             return redirect(url_for('view_records'))
         
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header row
-        header = [
-            'Visitor ID', 'First Name', 'Last Name', 'Type', 'Host', 
-            'Department', 'Branch', 'Badge', 'Check-In Time', 
-            'Check-Out Time', 'Status', 'Vendor Name', 'Comments',
-            'Registered By First Name', 'Registered By Last Name', 
-            'Expected Check-In Time', 'Submission Time', 'Is Pre-registered', 'Submitter IP'
-        ]
-        writer.writerow(header)
-        
-        # Write data rows
-        for visitor in visitors:
-            check_in_time = visitor['CheckInTime'].strftime('%m/%d/%Y %I:%M %p') if visitor['CheckInTime'] else 'N/A'
-            check_out_time = visitor['CheckOutTime'].strftime('%m/%d/%Y %I:%M %p') if visitor['CheckOutTime'] else 'N/A'
-            advance_checkin_time = visitor['AdvanceCheckInTime'].strftime('%m/%d/%Y %I:%M %p') if visitor.get('AdvanceCheckInTime') else 'N/A'
-            submission_time = visitor['SubmissionTime'].strftime('%m/%d/%Y %I:%M %p') if visitor.get('SubmissionTime') else 'N/A'
-            
-            row = [
-                visitor['VisitorID'],
-                visitor['GuestFirstName'],
-                visitor['GuestLastName'],
-                visitor['VisitorType'],
-                visitor['HostEmployeeName'],
-                visitor['DepartmentVisited'],
-                visitor['Branch'],
-                visitor['BadgeNumber'],
-                check_in_time,
-                check_out_time,
-                'Checked In' if visitor['Status'] == 'CheckedIn' else 'Checked Out' if visitor['Status'] == 'CheckedOut' else visitor['Status'],
-                visitor['VendorName'] or 'N/A',
-                visitor['Comments'] or 'N/A',
-                visitor.get('ColleagueFirstName') or 'N/A',
-                visitor.get('ColleagueLastName') or 'N/A',
-                advance_checkin_time,
-                submission_time,
-                'Yes' if visitor.get('IsAdvanceCheckIn') else 'No',
-                visitor.get('SubmitterIPAddress') or 'N/A'
-            ]
-            writer.writerow(row)
-        
-        # Prepare response
-        output.seek(0)
         filename = f"visitor_records_{start_date.strftime('%Y%m%d')}_to_{(end_date - timedelta(days=1)).strftime('%Y%m%d')}.csv"
         
+        # Rows are formatted and sent while the database cursor is still being read
         return Response(
-            output.getvalue(),
+            generate_csv(itertools.chain([first_visitor], visitors)),
             mimetype="text/csv",
             headers={"Content-Disposition": f"attachment;filename={filename}"}
         )
         
     except Exception as e:
-        logging.error(f"Error exporting CSV: {str(e)}")
+        logger.error("Error exporting CSV: %s", e)
         flash(f"Error exporting CSV: {str(e)}", 'danger')
         return redirect(url_for('view_records'))
 
+@app.route('/events')
+def event_stream():
+    """Server-Sent Events feed of check-ins, check-outs and pre-registrations.
+
+    At most SSE_MAX_STREAMS per worker; beyond that the page gets a 503 and
+    tries again after SSE_BUSY_RETRY_SECONDS, so streams never take every thread.
+    """
+    if not events.stream_slots.acquire():
+        retry_ms = int(events.SSE_BUSY_RETRY_SECONDS * 1000)
+        return Response(f"retry: {retry_ms}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(int(events.SSE_BUSY_RETRY_SECONDS)), 'Cache-Control': 'no-cache'})
+    last_id = request.headers.get('Last-Event-ID', '')
+    last_id = int(last_id) if last_id.isdigit() else None
+    response = Response(
+        events.stream(last_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, # no proxy buffering
+    )
+    response.call_on_close(events.stream_slots.release)  # runs even if the stream never started
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, covering every gunicorn worker."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+# --- JSON API ---
+# Lobby displays poll these. Each response carries an ETag built from the
+# shared write version, so a poll with an unchanged If-None-Match gets a 304
+# without touching the database or the cache. archive.py and auto_checkout.py
+# write through database.py and bump the same version; the TTL bucket in the
+# tag makes direct database edits visible within CACHE_TTL seconds.
+
+def api_etag(resource):
+    bucket = int(time.time() // cache.CACHE_TTL) if cache.CACHE_TTL > 0 else 0
+    return f"{resource}-{cache.write_version.get()}-{bucket}"
+
+def to_json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def conditional_json(resource, build):
+    """Returns 304 if the client's ETag is current, otherwise the JSON from build()."""
+    etag = api_etag(resource)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body, error = build()
+        if error:
+            logger.error("Error building %s API response: %s", resource, error)
+            return jsonify({'error': error}), 500
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate; the 304 is cheap
+    return response
+
+def visitor_list_json(key):
+    snapshot, error = database.get_desk_snapshot()
+    if error:
+        return None, error
+    visitors = [{name: to_json_value(value) for name, value in visitor.items()} for visitor in snapshot[key]]
+    return {'count': len(visitors), 'visitors': visitors}, None
+
+@app.route('/api/visitors/current')
+def api_current_visitors():
+    """Checked-in visitors as JSON."""
+    return conditional_json('current', lambda: visitor_list_json('checked_in'))
+
+@app.route('/api/visitors/pending')
+def api_pending_visitors():
+    """Pre-registered visitors who have not arrived yet, as JSON."""
+    return conditional_json('pending', lambda: visitor_list_json('pending'))
+
+@app.route('/api/badges/available')
+def api_available_badges():
+    """Free badges, optionally for one ?branch=, as JSON."""
+    branch = request.args.get('branch') or None
+    return conditional_json(
+        f"badges-{branch or 'all'}",
+        lambda: ({'branch': branch, 'badges': badge_allocator.available(branch)}, None))
+
+@app.route('/api/returning-visitor')
+def api_returning_visitor():
+    """Details from a guest's last visit (?first_name=&last_name=, optional &vendor_name=), as JSON."""
+    profile, error = profile_cache.lookup(
+        request.args.get('first_name', ''), request.args.get('last_name', ''), request.args.get('vendor_name'))
+    if error:
+        logger.error("Error looking up returning visitor: %s", error)
+        return jsonify({'error': error}), 500
+    return jsonify({'profile': profile})
+
+@app.route('/api/search')
+def api_search():
+    """Typeahead: visitors, hosts and vendors matching ?q= (word prefixes), as JSON."""
+    query = request.args.get('q', '')
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    results = search_index.search(query, limit)
+    results['query'] = query
+    return jsonify(results)
+
+# --- Visit Reports ---
+# Read only the rollup tables (see rollups.py), never the visitor table
+
+REPORT_DEFAULT_DAYS = 7
+
+def visit_report(args):
+    """Builds the visit report for ?from=&to= (YYYY-MM-DD, inclusive), ?grain=hour|day and
+    ?group_by= (comma-separated names from rollups.GROUP_COLUMNS). Returns (report, error);
+    raises ValueError for invalid parameters.
+    """
+    today = datetime.now().date()
+    end = datetime.strptime(args['to'], '%Y-%m-%d').date() if args.get('to') else today
+    start = (datetime.strptime(args['from'], '%Y-%m-%d').date() if args.get('from')
+             else end - timedelta(days=REPORT_DEFAULT_DAYS - 1))
+    if start > end:
+        raise ValueError("'from' must not be after 'to'")
+    grain = args.get('grain') or 'day'
+    if grain not in rollups.GRAINS:
+        raise ValueError(f"grain must be one of: {', '.join(rollups.GRAINS)}")
+    group_by = [name.strip() for name in (args.get('group_by') or 'branch').split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in rollups.GROUP_COLUMNS]
+    if unknown or not group_by:
+        raise ValueError(f"group_by must be a list of: {', '.join(rollups.GROUP_COLUMNS)}")
+
+    rows, error = database.get_visit_rollups(
+        rollups.GRAINS[grain], datetime.combine(start, datetime.min.time()),
+        datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    if error:
+        return None, error
+    report = rollups.summarize(rows, group_by)
+    report.update({'from': start.isoformat(), 'to': end.isoformat(), 'grain': grain, 'group_by': group_by})
+    return report, None
+
+@app.route('/api/reports/visits')
+def api_visit_report():
+    """Visit counts, average time on site and peak occupancy from the rollups, as JSON."""
+    try:
+        report, error = visit_report(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if error:
+        logger.error("Error building the visit report: %s", error)
+        return jsonify({'error': error}), 500
+    return jsonify(report)
+
+@app.route('/reports')
+def view_reports():
+    """Visit report dashboard."""
+    try:
+        report, error = visit_report(request.args)
+    except ValueError as e:
+        flash(f"Invalid report parameters: {e}", 'warning')
+        report, error = visit_report({})
+    if error:
+        logger.error("Error building the visit report: %s", error)
+        flash(f"Error loading the report: {error}", 'danger')
+    return render_template('reports.html', report=report, group_columns=rollups.GROUP_COLUMNS)
+
 # --- Run the App ---
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,82 @@
+# archive.py
+"""Moves closed visits out of the visitor table into its archive table.
+
+Usage:
+    python archive.py            # archive visits older than ARCHIVE_AFTER_DAYS
+    python archive.py --dry-run  # only show the cutoff
+
+Run nightly by visitor_tracker_archive.timer. Checked-out visits that
+checked in more than ARCHIVE_AFTER_DAYS ago are moved ARCHIVE_BATCH_SIZE at
+a time, each batch in its own short transaction, with a pause of
+ARCHIVE_BATCH_PAUSE seconds between batches so kiosk check-ins are never
+kept waiting. Checked-in and pending visitors are never archived.
+
+The date-range export and the visit report backfill read both tables; the
+desk pages, history tab and search only see the visitor table.
+"""
+import os
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+import log_config
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))  # visits per transaction (at most 1000)
+ARCHIVE_BATCH_PAUSE = float(os.getenv('ARCHIVE_BATCH_PAUSE', '0.5'))  # seconds between batches
+ARCHIVE_MAX_MINUTES = float(os.getenv('ARCHIVE_MAX_MINUTES', '30'))  # stop and continue on the next run
+
+
+def cutoff(now=None):
+    """Visits that checked in before this moment are archived."""
+    return (now or datetime.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+def run(dry_run=False):
+    """Archives closed visits batch by batch; returns (total moved, error or None)."""
+    checked_in_before = cutoff()
+    if dry_run:
+        print(f"Would archive checked-out visits that checked in before {checked_in_before:%Y-%m-%d %H:%M}")
+        return 0, None
+
+    import database  # imported here so --dry-run works without a database
+    import events
+
+    # Let open pages and every worker's search index drop the archived visits
+    database.add_write_listener(events.bus.publish)
+
+    deadline = time.monotonic() + ARCHIVE_MAX_MINUTES * 60
+    total = 0
+    while True:
+        moved, error = database.archive_closed_visitors(checked_in_before, ARCHIVE_BATCH_SIZE)
+        if error:
+            logger.error("Archiving stopped after %s visits: %s", total, error)
+            return total, error
+        total += moved
+        if moved < min(ARCHIVE_BATCH_SIZE, database.ARCHIVE_MAX_BATCH):
+            break
+        if time.monotonic() > deadline:
+            logger.warning("Archiving paused after %s minutes; the next run continues", ARCHIVE_MAX_MINUTES)
+            break
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+    print(f"Archived {total} visit(s) that checked in before {checked_in_before:%Y-%m-%d %H:%M}")
+    return total, None
+
+
+def main(argv):
+    if any(arg not in ('--dry-run',) for arg in argv[1:]):
+        print(__doc__)
+        return 2
+    _, error = run(dry_run='--dry-run' in argv)
+    return 1 if error else 0
+
+
+if __name__ == '__main__':
+    log_config.configure_logging(default_format='text')
+    sys.exit(main(sys.argv))
@@ -0,0 +1,96 @@
+# auto_checkout.py
+"""Checks out visitors who were never checked out after their branch closed.
+
+Usage:
+    python auto_checkout.py            # check out stale visitors
+    python auto_checkout.py --dry-run  # only show each branch's cutoff
+
+Run every 15 minutes by visitor_tracker_autocheckout.timer. Anyone still
+checked in who arrived before their branch's most recent closing time is
+checked out with CheckOutReason 'Auto checkout', one UPDATE per branch.
+Their CheckOutTime is that closing time, so visit lengths stay realistic.
+"""
+import os
+import sys
+import logging
+from datetime import datetime, timedelta, time
+from dotenv import load_dotenv
+
+import log_config
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Closing time for branches not listed in AUTO_CHECKOUT_BRANCH_TIMES
+AUTO_CHECKOUT_TIME = os.getenv('AUTO_CHECKOUT_TIME', '23:00')
+# Per-branch closing times, e.g. 'Kiln Creek=18:00;1A University=20:00'
+AUTO_CHECKOUT_BRANCH_TIMES = os.getenv('AUTO_CHECKOUT_BRANCH_TIMES', '')
+AUTO_CHECKOUT_REASON = 'Auto checkout'
+
+
+def _parse_time(value):
+    return time.fromisoformat(value.strip())
+
+def branch_times_from_env():
+    """Returns {branch: closing time} from AUTO_CHECKOUT_BRANCH_TIMES."""
+    times = {}
+    for entry in AUTO_CHECKOUT_BRANCH_TIMES.split(';'):
+        if not entry.strip():
+            continue
+        branch, closing = entry.split('=', 1)
+        times[branch.strip()] = _parse_time(closing)
+    return times
+
+def last_closing(closing, now):
+    """The most recent moment the branch closed: today's closing time if passed, else yesterday's."""
+    cutoff = datetime.combine(now.date(), closing)
+    return cutoff if cutoff <= now else cutoff - timedelta(days=1)
+
+def cutoffs(now=None):
+    """Returns [(branch or None for all other branches, checked-in-before cutoff)]."""
+    now = now or datetime.now()
+    branch_times = branch_times_from_env()
+    result = [(branch, last_closing(closing, now)) for branch, closing in branch_times.items()]
+    result.append((None, last_closing(_parse_time(AUTO_CHECKOUT_TIME), now)))
+    return result
+
+def run(dry_run=False):
+    """Checks out stale visitors branch by branch; returns (total checked out, errors)."""
+    import database  # imported here so the schedule helpers work without a database
+    import events
+
+    # Let pages open on the app see these checkouts too
+    database.add_write_listener(events.bus.publish)
+
+    configured = list(branch_times_from_env())
+    total, errors = 0, []
+    for branch, cutoff in cutoffs():
+        label = branch or 'all other branches'
+        if dry_run:
+            print(f"{label}: would check out visitors who checked in before {cutoff:%Y-%m-%d %H:%M}")
+            continue
+        checked_out, error = database.checkout_stale_visitors(
+            cutoff, branch=branch, other_than_branches=configured, reason=AUTO_CHECKOUT_REASON,
+            checkout_time=cutoff)
+        if error:
+            logger.error("Auto checkout failed for %s: %s", label, error)
+            errors.append(error)
+            continue
+        total += len(checked_out)
+        print(f"{label}: checked out {len(checked_out)} visitor(s) who checked in before {cutoff:%Y-%m-%d %H:%M}")
+    return total, errors
+
+
+def main(argv):
+    if any(arg not in ('--dry-run',) for arg in argv[1:]):
+        print(__doc__)
+        return 2
+    _, errors = run(dry_run='--dry-run' in argv)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    log_config.configure_logging(default_format='text')
+    sys.exit(main(sys.argv))
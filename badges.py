@@ -0,0 +1,171 @@
+# badges.py
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+NO_BADGE = 'No Badge'  # escorted visitors; never reserved
+
+
+class BadgePool:
+    """Fixed set of badges tracked as a bitmap (bit set = badge free).
+
+    claim() and release() are O(1): a badge maps straight to its bit.
+    """
+
+    def __init__(self, badges):
+        self.badges = list(badges)
+        self._index = {badge: i for i, badge in enumerate(self.badges)}
+        self._all_free = (1 << len(self.badges)) - 1
+        self._free = self._all_free
+
+    def __contains__(self, badge):
+        return badge in self._index
+
+    def claim(self, badge):
+        """Marks a specific badge as in use; returns False if it already was."""
+        bit = 1 << self._index[badge]
+        if not self._free & bit:
+            return False
+        self._free ^= bit
+        return True
+
+    def release(self, badge):
+        self._free |= 1 << self._index[badge]
+
+    def reset(self, in_use):
+        self._free = self._all_free
+        for badge in in_use:
+            if badge in self._index:
+                self._free &= ~(1 << self._index[badge])
+
+    def available(self):
+        return [badge for i, badge in enumerate(self.badges) if self._free >> i & 1]
+
+
+class BadgeAllocator:
+    """Per-branch badge pools shared by the threads of one worker.
+
+    The in-process bitmaps stop two kiosks on the same worker from picking the
+    same badge and answer "which badges are free" without a query. The database
+    write (see database.add_visitor) is the authority across workers: it only
+    succeeds if no checked-in visitor holds the badge.
+
+    The pools follow database writes through on_write(). If a write happened
+    somewhere this allocator did not see (another worker, another site), the
+    shared write version moves on and the pools are rebuilt from `loader`.
+    """
+
+    def __init__(self, pools, loader, version):
+        self._pools = pools  # branch name (or None for the shared pool) -> BadgePool
+        self._by_badge = {badge: pool for pool in pools.values() for badge in pool.badges}
+        self._loader = loader
+        self._version = version
+        self._synced_version = None
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        """Rebuilds the bitmaps if a write happened that this allocator has not applied."""
+        current = self._version.get()
+        if current == self._synced_version:
+            return
+        in_use, error = self._loader()
+        if error:
+            logger.error("Error loading checked-in badges for allocator: %s", error)
+            return
+        for pool in self._pools.values():
+            pool.reset(in_use)
+        self._synced_version = current
+
+    def pool_for(self, branch):
+        return self._pools.get(branch) or self._pools.get(None)
+
+    def branch_of(self, badge):
+        """Returns the branch whose pool holds `badge` (None for the shared pool)."""
+        for branch, pool in self._pools.items():
+            if badge in pool:
+                return branch
+        return None
+
+    def available(self, branch=None):
+        """Free badges for one branch, or for every pool if branch is None."""
+        with self._lock:
+            self._sync()
+            if branch is not None:
+                pool = self.pool_for(branch)
+                return pool.available() if pool else []
+            return [badge for pool in self._pools.values() for badge in pool.available()]
+
+    def claim(self, badge, branch=None):
+        """Reserves a specific badge in this worker before it is written to the database.
+
+        Returns (success, message). 'No Badge' always succeeds.
+        """
+        if badge == NO_BADGE:
+            return True, None
+        with self._lock:
+            self._sync()
+            pool = self._by_badge.get(badge)
+            if pool is None:
+                return False, f"Badge {badge} is not a known badge number."
+            if branch is not None and self.pool_for(branch) is not pool:
+                return False, f"Badge {badge} does not belong to {branch}."
+            if not pool.claim(badge):
+                return False, f"Badge {badge} is already in use."
+            return True, None
+
+    def release(self, badge):
+        if badge == NO_BADGE:
+            return
+        with self._lock:
+            pool = self._by_badge.get(badge)
+            if pool is not None:
+                pool.release(badge)
+
+    def on_write(self, event, data, version):
+        """Database write listener: applies badge changes without reloading."""
+        with self._lock:
+            if self._synced_version is None or version != self._synced_version + 1:
+                return  # missed a write somewhere; _sync() will reload on next use
+            if event == 'checkin':
+                badge = data.get('BadgeNumber')
+                if badge in self._by_badge:
+                    self._by_badge[badge].claim(badge)  # no-op if the request already claimed it
+            elif event == 'checkout':
+                for visitor in data.get('visitors', ()):
+                    badge = visitor.get('BadgeNumber')
+                    if badge in self._by_badge:
+                        self._by_badge[badge].release(badge)
+            self._synced_version = version
+
+
+def _parse_badge_range(spec):
+    """'56863-56867,56870' -> ['56863', ..., '56867', '56870']"""
+    badges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            badges.extend(str(i) for i in range(int(start), int(end) + 1))
+        elif part:
+            badges.append(part)
+    return badges
+
+def pools_from_env(default_badges):
+    """Builds the badge pools from BADGE_POOLS.
+
+    BADGE_POOLS looks like 'Kiln Creek=56863-56867;1A University=56868-56872'.
+    When it is not set, every branch shares one pool of `default_badges`.
+    """
+    spec = os.getenv('BADGE_POOLS', '').strip()
+    if not spec:
+        return {None: BadgePool(default_badges)}
+    pools = {}
+    for entry in spec.split(';'):
+        if not entry.strip():
+            continue
+        branch, badges = entry.split('=', 1)
+        pools[branch.strip()] = BadgePool(_parse_badge_range(badges))
+    return pools
@@ -0,0 +1,305 @@
+# benchmarks.py
+"""Micro-benchmarks for database.py, the CSV export and Teams notification cards.
+
+Usage:
+    python benchmarks.py                 # run everything, compare with history, save the run
+    python benchmarks.py --quick         # fewer repeats and iterations
+    python benchmarks.py --filter csv    # only benchmarks whose name contains 'csv'
+    python benchmarks.py --no-save       # do not add this run to the history
+
+Runs offline: database.py uses a throwaway SQLite database (DB_BACKEND=sqlite)
+seeded with a year of history, caching is off so every call reaches the
+database, and no notification is sent. Benchmarks:
+    db.<function>     each data-access function in database.py
+    record_rows_100k  visitor_record.from_rows over 100,000 fetched rows
+    csv_export_100k   app.generate_csv over 100,000 visitor records
+    teams_card        notifications.build_card_payload (and its JSON encoding)
+
+Each benchmark is timed --repeat times and the fastest round's time per
+call is kept, as slower rounds mostly measure other activity on the machine.
+Runs are appended to --history (JSON lines). A benchmark regresses when
+its time is more than --tolerance (a fraction) slower than the median of
+the last --window passing runs on the same host and Python version; any
+regression makes the run exit 1 and keeps it out of later comparisons.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import shutil
+from datetime import datetime, timedelta
+
+from loadtest import BRANCHES, DEPARTMENTS, NAMES, VISITOR_TYPES, seed_database
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BULK_ROWS = 100_000
+SEED_DAYS = 365
+
+
+class Benchmark:
+    """A function timed `number` calls at a time.
+
+    `setup(number)`, if given, returns the argument tuple of each call and is
+    not timed (for example, visitors to check out).
+    """
+
+    def __init__(self, name, func, number, setup=None):
+        self.name = name
+        self.func = func
+        self.number = number
+        self.setup = setup
+
+    def time_once(self, number):
+        calls = self.setup(number) if self.setup else [()] * number
+        start = time.perf_counter()
+        for args in calls:
+            self.func(*args)
+        return (time.perf_counter() - start) / number
+
+
+def offline_env(workdir):
+    """Environment for database.py and app.py that only touches `workdir`."""
+    return {
+        'DB_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(workdir, 'benchmarks.db'),
+        'CACHE_TTL': '0',
+        'CACHE_VERSION_FILE': os.path.join(workdir, 'cache.version'),
+        'EVENTS_FILE': os.path.join(workdir, 'events.log'),
+        'NOTIFICATION_SPOOL_DIR': os.path.join(workdir, 'notification_spool'),
+        'TEAMS_WEBHOOK_URL': '',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    }
+
+
+def _visitor(rng, **extra):
+    return dict({
+        'GuestFirstName': rng.choice(NAMES),
+        'GuestLastName': f"Bench{rng.randrange(100000)}",
+        'VisitorType': rng.choice(VISITOR_TYPES),
+        'Branch': rng.choice(BRANCHES),
+        'DepartmentVisited': rng.choice(DEPARTMENTS),
+        'VendorName': 'Acme Supply',
+        'BadgeNumber': 'No Badge',
+        'HostEmployeeName': rng.choice(NAMES) + ' Host',
+        'Comments': 'Delivering parts for the lobby printer',
+    }, **extra)
+
+def _advanced_visitor(rng):
+    when = datetime.now() + timedelta(days=1, minutes=rng.randrange(600))
+    return _visitor(rng, ColleagueFirstName='Desk', ColleagueLastName='Bench',
+                    AdvanceCheckInTime=when.strftime('%Y-%m-%dT%H:%M'), IsAdvanceCheckIn=True,
+                    SubmitterIPAddress='127.0.0.1')
+
+def bulk_rows(count, seed=0):
+    """`count` raw rows with every column of database.VISITOR_COLUMNS, as a cursor would return them."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, 8)
+    rows = []
+    for i in range(count):
+        check_in = start + timedelta(minutes=7 * i)
+        rows.append((
+            i + 1, rng.choice(NAMES), f"Bulk{i}", rng.choice(VISITOR_TYPES), rng.choice(BRANCHES),
+            rng.choice(DEPARTMENTS), 'Acme Supply' if i % 3 == 0 else None, str(56863 + i % 10),
+            rng.choice(NAMES) + ' Host', 'Quarterly inspection' if i % 5 == 0 else None,
+            check_in, check_in + timedelta(minutes=45), 'CheckedOut', 'Desk', 'Bench',
+            check_in if i % 4 == 0 else None, check_in - timedelta(days=1), i % 4 == 0, '127.0.0.1', 'Manual',
+        ))
+    return rows
+
+
+def build_benchmarks():
+    """Imports the app against the offline database and returns the benchmarks."""
+    import database
+    import notifications
+    import visitor_record
+    from app import generate_csv
+
+    rng = random.Random(1)
+    now = datetime.now()
+    month_ago = now - timedelta(days=30)
+
+    def newest_ids(status, count):
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        top, limit = database.backend.limit(count)
+        cursor.execute(f"SELECT {top} VisitorID FROM {database.DB_TABLE} WHERE Status = ? ORDER BY VisitorID DESC {limit}",
+                       (status,))
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        return ids
+
+    def checked_in(number, per_call=1):
+        for _ in range(number * per_call):
+            database.add_visitor(_visitor(rng))
+        ids = newest_ids('CheckedIn', number * per_call)
+        return [(ids[i:i + per_call],) if per_call > 1 else (ids[i],) for i in range(0, len(ids), per_call)]
+
+    def pending(number):
+        database.add_advanced_visitors([_advanced_visitor(rng) for _ in range(number)])
+        return [(visitor_id, 'No Badge') for visitor_id in newest_ids('Pending', number)]
+
+    def stream(start, end):
+        rows, _ = database.stream_visitors_by_date_range(start, end)
+        for _ in rows:
+            pass
+
+    columns = [column.strip() for column in database.VISITOR_COLUMNS.split(',')]
+    raw_rows = bulk_rows(BULK_ROWS)
+    records = visitor_record.from_rows(columns, raw_rows)
+    card_visitor = _visitor(rng, BadgeNumber='56863')
+
+    def export_csv():
+        for _ in generate_csv(records):
+            pass
+
+    def teams_card():
+        json.dumps(notifications.build_card_payload(card_visitor, now))
+
+    return [
+        Benchmark('db.add_visitor', lambda: database.add_visitor(_visitor(rng)), 100),
+        Benchmark('db.add_advanced_visitor', lambda: database.add_advanced_visitor(_advanced_visitor(rng)), 100),
+        Benchmark('db.add_advanced_visitors_100', lambda: database.add_advanced_visitors(
+            [_advanced_visitor(rng) for _ in range(100)]), 5),
+        Benchmark('db.checkin_pending_visitor', database.checkin_pending_visitor, 50, setup=pending),
+        Benchmark('db.checkout_visitor', database.checkout_visitor, 50, setup=checked_in),
+        Benchmark('db.checkout_visitors_25', database.checkout_visitors, 5,
+                  setup=lambda number: checked_in(number, per_call=25)),
+        Benchmark('db.checkout_stale_visitors', lambda: database.checkout_stale_visitors(now - timedelta(days=3650)), 50),
+        Benchmark('db.get_current_visitor_count', database.get_current_visitor_count, 200),
+        Benchmark('db.get_checked_in_badges', database.get_checked_in_badges, 200),
+        Benchmark('db.get_all_visitors', database.get_all_visitors, 10),
+        Benchmark('db.get_visitor_page', database.get_visitor_page, 100),
+        Benchmark('db.get_visitor_page_filtered', lambda: database.get_visitor_page(
+            {'branch': BRANCHES[0], 'date_from': month_ago}), 100),
+        Benchmark('db.get_visitors_by_date_range_30d', lambda: database.get_visitors_by_date_range(month_ago, now), 20),
+        Benchmark('db.stream_visitors_by_date_range_30d', lambda: stream(month_ago, now), 20),
+        Benchmark('db.get_pending_visitors', database.get_pending_visitors, 100),
+        Benchmark('db.get_visitor_by_id', lambda: database.get_visitor_by_id(rng.randrange(1, 1000)), 200),
+        Benchmark('db.get_last_visit', lambda: database.get_last_visit(rng.choice(NAMES), 'Bench1'), 200),
+        Benchmark('db.get_search_rows', lambda: database.get_search_rows(now - timedelta(days=365)), 5),
+        Benchmark('db.get_desk_snapshot', database.get_desk_snapshot, 100),
+        Benchmark('db.get_visit_rollups_30d', lambda: database.get_visit_rollups('D', month_ago, now), 100),
+        Benchmark('db.backfill_rollups_7d', lambda: database.backfill_rollups(
+            (now - timedelta(days=7)).date(), now.date()), 3),
+        Benchmark('record_rows_100k', lambda: visitor_record.from_rows(columns, raw_rows), 1),
+        Benchmark('csv_export_100k', export_csv, 1),
+        Benchmark('teams_card', teams_card, 10000),
+    ]
+
+
+# --- History ---
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def baselines(history, window):
+    """Median seconds per call of each benchmark over the last `window` passing runs on this machine."""
+    runs = [run for run in history
+            if run.get('host') == socket.gethostname() and run.get('python') == platform.python_version()
+            and not run.get('regressions')][-window:]
+    samples = {}
+    for run in runs:
+        for name, seconds in run['results'].items():
+            samples.setdefault(name, []).append(seconds)
+    return {name: statistics.median(values) for name, values in samples.items()}, len(runs)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the visitor tracker.", epilog=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="timed rounds per benchmark (default 5)")
+    parser.add_argument('--quick', action='store_true', help="3 rounds of a fifth of the calls")
+    parser.add_argument('--history', default=os.path.join(HERE, 'benchmark_history.jsonl'),
+                        help="JSON lines file of earlier runs (default benchmark_history.jsonl)")
+    parser.add_argument('--window', type=int, default=5, help="passing runs the baseline is taken from (default 5)")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="allowed slowdown before a regression (default 0.3)")
+    parser.add_argument('--no-save', action='store_true', help="do not append this run to the history")
+    args = parser.parse_args(argv[1:])
+    repeat = 3 if args.quick else max(1, args.repeat)
+
+    workdir = tempfile.mkdtemp(prefix='visitor_tracker_bench_')
+    env = offline_env(workdir)
+    os.environ.update(env)
+    try:
+        seeded = seed_database(env, SEED_DAYS)
+        print(f"Seeded {seeded} visits; building {BULK_ROWS} bulk rows...")
+        benchmarks = [bench for bench in build_benchmarks() if args.filter in bench.name]
+
+        results = {}
+        for bench in benchmarks:
+            number = max(1, bench.number // 5) if args.quick else bench.number
+            bench.time_once(1)  # warm up connections, templates and caches
+            rounds = [bench.time_once(number) for _ in range(repeat)]
+            results[bench.name] = min(rounds)
+            print(f"  {bench.name:<40} {_format_seconds(results[bench.name]):>10}  "
+                  f"(median {_format_seconds(statistics.median(rounds))})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    history = load_history(args.history)
+    baseline, runs = baselines(history, args.window)
+    regressions = []
+    if runs:
+        print(f"\nAgainst the median of {runs} earlier run(s) on this machine (tolerance {args.tolerance:.0%}):")
+        for name, seconds in results.items():
+            before = baseline.get(name)
+            if before is None:
+                print(f"  {name:<40} new")
+                continue
+            change = seconds / before - 1
+            flag = 'REGRESSION' if change > args.tolerance else 'ok'
+            print(f"  {name:<40} {_format_seconds(before):>10} -> {_format_seconds(seconds):>10}  {change:+.0%}  {flag}")
+            if change > args.tolerance:
+                regressions.append(name)
+    else:
+        print("\nNo earlier runs on this machine; this run becomes the baseline.")
+
+    if not args.no_save:
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'host': socket.gethostname(),
+            'python': platform.python_version(),
+            'commit': _git_commit(),
+            'quick': args.quick,
+            'results': results,
+            'regressions': regressions,
+        }
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
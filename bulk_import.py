@@ -0,0 +1,138 @@
+# bulk_import.py
+"""Bulk pre-registration import from a CSV or JSON file.
+
+Usage:
+    python bulk_import.py visitors.csv            # validate and import
+    python bulk_import.py visitors.json --dry-run  # validate only
+
+A CSV file has a header row; a JSON file holds a list of objects (or
+{"visitors": [...]}). Columns may use the database names (GuestFirstName,
+AdvanceCheckInTime, ...) or the form field names (guest_first_name,
+advance_checkin_time, ...). Rows are checked like the pre-registration form:
+every required field must be present and the expected time must be a valid
+ISO 8601 date and time.
+"""
+import io
+import sys
+import csv
+import json
+import logging
+
+import log_config
+import validation
+
+logger = logging.getLogger(__name__)
+
+
+# Form field name -> database column, for files exported from other tools
+FIELD_ALIASES = {
+    'guest_first_name': 'GuestFirstName',
+    'guest_last_name': 'GuestLastName',
+    'visitor_type': 'VisitorType',
+    'branch': 'Branch',
+    'department': 'DepartmentVisited',
+    'vendor_name': 'VendorName',
+    'here_to_see': 'HostEmployeeName',
+    'comments': 'Comments',
+    'colleague_first_name': 'ColleagueFirstName',
+    'colleague_last_name': 'ColleagueLastName',
+    'advance_checkin_time': 'AdvanceCheckInTime',
+}
+COLUMNS = set(FIELD_ALIASES.values())
+
+
+def read_rows(data, filename=''):
+    """Parses an uploaded file into a list of dicts; raises ValueError if it cannot be read."""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or data.lstrip().startswith(('[', '{')):
+        rows = json.loads(data)
+        if isinstance(rows, dict):
+            rows = rows.get('visitors')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("JSON must be a list of visitor objects")
+        return rows
+    return list(csv.DictReader(io.StringIO(data)))
+
+def normalize_row(row, submitter):
+    """Maps a file row onto database columns, the way the pre-registration form fills them in."""
+    visitor = {}
+    for name, value in row.items():
+        column = FIELD_ALIASES.get(name, name)
+        if column in COLUMNS:
+            visitor[column] = value.strip() if isinstance(value, str) else value
+    visitor.update({
+        'BadgeNumber': 'No Badge',  # No badge for advanced check-in
+        'IsAdvanceCheckIn': True,
+        'SubmitterIPAddress': submitter,
+    })
+    return visitor
+
+def validate_rows(rows, submitter=None):
+    """Returns (valid visitors, errors). Errors are {'row': n, 'error': message}, rows counted from 1."""
+    visitors, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        visitor = normalize_row(row, submitter)
+        missing = validation.missing_fields(visitor, validation.ADVANCED_REQUIRED_FIELDS)
+        if missing:
+            errors.append({'row': number, 'error': f"Missing required fields: {', '.join(missing)}"})
+            continue
+        try:
+            visitor['AdvanceCheckInTime'] = validation.parse_advance_time(visitor['AdvanceCheckInTime'])
+        except ValueError as e:
+            errors.append({'row': number, 'error': f"Invalid advance check-in time format: {e}"})
+            continue
+        visitor['_row'] = number
+        visitors.append(visitor)
+    return visitors, errors
+
+def import_rows(rows, submitter=None, batch_size=None, dry_run=False):
+    """Validates and inserts pre-registrations in batches, one transaction each.
+
+    Returns a report: {'total', 'inserted', 'valid', 'errors'}. A row that fails
+    validation is skipped; a batch the database rejects is rolled back and
+    each of its rows is reported with the database error.
+    """
+    import database  # imported here so the file helpers work without a database
+
+    batch_size = batch_size or database.IMPORT_BATCH_SIZE
+    visitors, errors = validate_rows(rows, submitter)
+    inserted = 0
+    if not dry_run:
+        for start in range(0, len(visitors), batch_size):
+            batch = visitors[start:start + batch_size]
+            count, error = database.add_advanced_visitors(batch)
+            if error:
+                errors.extend({'row': visitor['_row'], 'error': error} for visitor in batch)
+            inserted += count
+    errors.sort(key=lambda error: error['row'])
+    logger.info("Bulk import: %s of %s rows inserted, %s rejected", inserted, len(rows), len(errors))
+    return {'total': len(rows), 'inserted': inserted, 'valid': len(visitors), 'errors': errors}
+
+
+def main(argv):
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    if len(args) != 1:
+        print(__doc__)
+        return 2
+    path = args[0]
+    try:
+        with open(path, 'rb') as f:
+            rows = read_rows(f.read(), path)
+    except (OSError, ValueError) as e:
+        print(f"Could not read {path}: {e}")
+        return 1
+
+    report = import_rows(rows, submitter='bulk_import', dry_run='--dry-run' in argv)
+    for error in report['errors']:
+        print(f"Row {error['row']}: {error['error']}")
+    if '--dry-run' in argv:
+        print(f"{report['valid']} of {report['total']} rows are valid.")
+    else:
+        print(f"Imported {report['inserted']} of {report['total']} rows.")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    log_config.configure_logging(default_format='text')
+    sys.exit(main(sys.argv))
@@ -0,0 +1,169 @@
+# cache.py
+import os
+import time
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows dev machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))  # seconds; also bounds staleness from writes made outside this app
+CACHE_VERSION_FILE = os.getenv(
+    'CACHE_VERSION_FILE', os.path.join(tempfile.gettempdir(), 'visitor_tracker.version'))
+
+
+class WriteVersion:
+    """A counter shared by every worker on the host, bumped after each database write.
+
+    The value lives in a small memory-mapped file, so reading it is a memory
+    access rather than a database query. Falls back to a per-process counter
+    if the file cannot be used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = 0
+        self._lock = threading.Lock()
+        self._mm = None
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < 8:
+                    os.pwrite(fd, b'\0' * 8, 0)
+                self._mm = mmap.mmap(fd, 8)
+            finally:
+                os.close(fd)
+        except (OSError, ValueError) as e:
+            logger.warning("Shared cache version file %s unavailable, invalidation is per worker only: %s", path, e)
+
+    def get(self):
+        if self._mm is None:
+            return self._local
+        return struct.unpack_from('Q', self._mm)[0]
+
+    def bump(self):
+        """Increments the counter and returns the new value."""
+        with self._lock:
+            if self._mm is None:
+                self._local += 1
+                return self._local
+            if fcntl:
+                with open(self.path, 'rb') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        return self._increment()
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return self._increment()
+
+    def _increment(self):
+        value = struct.unpack_from('Q', self._mm)[0] + 1
+        struct.pack_into('Q', self._mm, 0, value)
+        return value
+
+
+class TTLCache:
+    """Small in-process cache whose entries expire after `ttl` seconds or on any write."""
+
+    def __init__(self, ttl, version):
+        self.ttl = ttl
+        self.version = version
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (hit, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, version, value = entry
+        if time.monotonic() >= expires_at or version != self.version.get():
+            return False, None
+        return True, value
+
+    def set(self, key, value, version):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache:
+    """Thread-safe in-process cache holding the `size` most recently used entries."""
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (hit, value)."""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+write_version = WriteVersion(CACHE_VERSION_FILE)
+_cache = TTLCache(CACHE_TTL, write_version)
+
+
+def cached(key):
+    """Caches a zero-argument `(value, error)` function. Errors are never cached."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper():
+            if CACHE_TTL <= 0:
+                return func()
+            hit, value = _cache.get(key)
+            if hit:
+                return value, None
+            # Take the version before loading so a write that lands mid-query
+            # makes this entry stale immediately
+            version = write_version.get()
+            value, error = func()
+            if error is None:
+                _cache.set(key, value, version)
+            return value, error
+        return wrapper
+    return decorator
+
+
+def invalidate():
+    """Drops cached reads in every worker. Call after committing a write.
+
+    Returns the new write version.
+    """
+    version = write_version.bump()
+    _cache.clear()
+    return version
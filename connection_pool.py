@@ -0,0 +1,165 @@
+# connection_pool.py
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """Wraps a DB-API connection so that close() hands it back to the pool."""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+        self._checked_out = True
+
+    def __getattr__(self, name):
+        # cursor(), commit(), rollback() etc. go straight to the real connection
+        return getattr(self._raw, name)
+
+    def close(self):
+        """Returns the connection to the pool (safe to call more than once)."""
+        if self._checked_out:
+            self._checked_out = False
+            self._pool._release(self)
+
+
+class ConnectionPool:
+    """Thread-safe, per-process pool of database connections.
+
+    - at most `size` connections are open at once; callers wait up to
+      `timeout` seconds for one to be returned
+    - idle connections are pinged with `ping_sql` on checkout if they have
+      been idle longer than `ping_after` seconds (0 = always ping)
+    - connections older than `max_lifetime` seconds are closed and replaced
+    - after a fork (gunicorn workers) the child starts with an empty pool
+      instead of sharing the parent's sockets
+    """
+
+    def __init__(self, factory, size=5, timeout=10, max_lifetime=1800,
+                 ping_after=30, ping_sql='SELECT 1'):
+        self._factory = factory
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.ping_sql = ping_sql
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """(Re)initialises pool state. Called on creation and in forked children."""
+        # Connections inherited from a parent process are deliberately not
+        # closed: closing them would log out the parent's session. Keeping a
+        # reference stops the driver from disconnecting them on garbage collection.
+        inherited = getattr(self, '_idle', None)
+        if inherited:
+            self._inherited = list(inherited)
+        self._pid = os.getpid()
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = deque()
+        self._open = 0
+
+    def acquire(self):
+        """Returns a PooledConnection, or None if no connection could be obtained."""
+        if self._pid != os.getpid():
+            self._reset()
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.error("Timed out after %ss waiting for a pooled database connection", self.timeout)
+                        return None
+                    self._lock.wait(remaining)
+
+                if self._idle:
+                    conn = self._idle.pop()  # LIFO keeps the warmest connections in use
+                else:
+                    conn = None
+                    self._open += 1  # reserve a slot before connecting outside the lock
+
+            if conn is None:
+                return self._connect()
+
+            if self._is_usable(conn):
+                conn._checked_out = True
+                return conn
+            self._discard(conn)
+
+    def _connect(self):
+        try:
+            raw = self._factory()
+        except Exception as e:
+            logger.error("Error creating pooled database connection: %s", e)
+            raw = None
+        if raw is None:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            return None
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _is_usable(self, conn):
+        """Checks lifetime and, if the connection sat idle for a while, pings it."""
+        now = time.monotonic()
+        if self.max_lifetime and now - conn.created_at > self.max_lifetime:
+            return False
+        if now - conn.last_used < self.ping_after:
+            return True
+        try:
+            cursor = conn._raw.cursor()
+            try:
+                cursor.execute(self.ping_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn._raw.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Discarding stale pooled database connection: %s", e)
+            return False
+
+    def _release(self, conn):
+        if self._pid != os.getpid():
+            return  # connection belongs to the parent process
+        try:
+            # End any implicit transaction left open by read-only callers
+            conn._raw.rollback()
+        except Exception as e:
+            logger.warning("Discarding pooled database connection after failed rollback: %s", e)
+            self._discard(conn)
+            return
+
+        if self.max_lifetime and time.monotonic() - conn.created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+
+        conn.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(conn)
+            self._lock.notify()
+
+    def _discard(self, conn):
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._lock.notify()
+
+    def close_all(self):
+        """Closes every idle connection (checked-out ones are closed when returned)."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            self._discard(conn)
@@ -1,8 +1,17 @@
-import pyodbc
 import os
+import time
 import logging
+import contextvars
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import cache
+import metrics
+import migrations
+import rollups
+import visitor_record
+from connection_pool import ConnectionPool
+from db_backends import backend_from_env, replica_backend_from_env
 
 
 load_dotenv()
@@ -11,47 +20,204 @@ DB_SERVER = os.getenv('DB_SERVER')
 DB_NAME = os.getenv('DB_NAME')
 DB_USERNAME = os.getenv('DB_USERNAME')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_TABLE = os.getenv('DB_TABLE') 
 
+# Storage backend: SQL Server (default) or embedded SQLite, see db_backends.py
+backend = backend_from_env()
+DB_TABLE = backend.table_name(os.getenv('DB_TABLE'))
+# Closed visits moved out of DB_TABLE by archive.py; date-range reads cover both
+ARCHIVE_TABLE = migrations.companion_table(DB_TABLE, migrations.ARCHIVE_SUFFIX)
+
+# Connection pool settings (per gunicorn worker)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # recycle connections after this many seconds
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))  # health-check connections idle longer than this
+
+# Optional read replica for history and export queries, see db_backends.replica_backend_from_env
+replica_backend = replica_backend_from_env()
+DB_REPLICA_RETRY_AFTER = float(os.getenv('DB_REPLICA_RETRY_AFTER', '30'))  # seconds to use the primary after the replica fails
+
+
+logger = logging.getLogger(__name__)
+# Row counts from the read functions; sampled by default (LOG_SAMPLE in log_config.py)
+read_logger = logging.getLogger('database.reads')
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+_schema_checked = False
 
 def create_connection():
-    """Creates and returns a connection to the SQL Server database."""
-    conn_str = (
-        r'DRIVER={ODBC Driver 17 for SQL Server};' 
-        r'SERVER=' + DB_SERVER + ';'
-        r'DATABASE=' + DB_NAME + ';'
-        r'UID=' + DB_USERNAME + ';'
-        r'PWD=' + DB_PASSWORD + ';'
-        r'Encrypt=No;' # Yes in production if SSL is configured ???
-        r'TrustServerCertificate=Yes;' # Add if self-signed cert or encryption without full validation ????
-    )
-    logging.info(f"Attempting to connect to database: {DB_SERVER}/{DB_NAME}")
+    """Creates and returns a new connection using the configured backend."""
+    global _schema_checked
+    if not DB_TABLE:
+        logger.error("DB_TABLE is not set; add it to .env (e.g. DB_TABLE=dbo.VisitorInteractions)")
+        return None
+    logger.info("Attempting to connect to database: %s", backend.describe())
+    conn = None
     try:
-        conn = pyodbc.connect(conn_str, autocommit=False) 
-        logging.info("Database connection successful")
+        conn = backend.connect(DB_TABLE)
+        logger.info("Database connection successful")
+        if backend.auto_migrate and not _schema_checked:
+            migrations.upgrade(conn, backend, DB_TABLE)
+            _schema_checked = True
         return conn
     except Exception as e:
-        logging.error(f"Database connection error: {str(e)}")
+        logger.error("Database connection error: %s", e)
+        if conn is not None:
+            try:
+                conn.close()  # a failed migration must not keep the SQLite file locked
+            except Exception:
+                pass
         # Consider how to handle this - maybe raise it or return None
         # For a web app, failing requests might be better than crashing
         return None # Or raise e ?? will figure out later 
 
+_pool = ConnectionPool(
+    create_connection,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    ping_after=DB_POOL_PING_AFTER,
+    ping_sql=backend.ping_sql,
+)
+
+def get_connection():
+    """Borrows a connection from the worker's pool. Calling close() on it returns it to the pool."""
+    start = time.perf_counter()
+    conn = _pool.acquire()
+    metrics.DB_POOL_ACQUIRE.observe(time.perf_counter() - start)
+    if conn is None:
+        metrics.DB_POOL_FAILURES.inc()
+    return conn
+
+def create_replica_connection():
+    """Creates a connection to the read replica (None if it cannot be reached)."""
+    logger.info("Attempting to connect to read replica: %s", replica_backend.describe())
+    try:
+        return replica_backend.connect(DB_TABLE)
+    except Exception as e:
+        logger.error("Read replica connection error: %s", e)
+        return None
+
+_replica_pool = ConnectionPool(
+    create_replica_connection,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    ping_after=DB_POOL_PING_AFTER,
+    ping_sql=replica_backend.ping_sql,
+) if replica_backend else None
+_replica_down_until = 0.0
+
+# Per-request state for read-your-writes; a dict so that writes made on
+# other threads with a copy of the context still mark it
+_request_state = contextvars.ContextVar('request_state', default=None)
+
+def begin_request():
+    """Starts read-your-writes tracking for a request. Call before handling it."""
+    _request_state.set({'wrote': False})
+
+def get_read_connection():
+    """Borrows a connection for a read-only query that may lag slightly behind the primary.
+
+    Uses the replica when one is configured, unless this request has already
+    written (so it sees its own writes) or the replica failed within the last
+    DB_REPLICA_RETRY_AFTER seconds. Falls back to the primary otherwise.
+    """
+    global _replica_down_until
+    state = _request_state.get()
+    if _replica_pool is None or (state and state['wrote']) or time.monotonic() < _replica_down_until:
+        return get_connection()
+    conn = _replica_pool.acquire()
+    if conn is None:
+        logger.warning("Read replica unavailable, using the primary for %ss", DB_REPLICA_RETRY_AFTER)
+        _replica_down_until = time.monotonic() + DB_REPLICA_RETRY_AFTER
+        return get_connection()
+    return conn
+
+def close_pools():
+    """Closes this worker's idle connections; called when a gunicorn worker exits."""
+    _pool.close_all()
+    if _replica_pool is not None:
+        _replica_pool.close_all()
+
+# Hourly/daily analytics, updated in the same transaction as each check-in and check-out
+_rollups = rollups.RollupWriter(backend, DB_TABLE)
+
+def _update_rollups(update, cursor, visitors):
+    """Runs a RollupWriter update inside a savepoint of the caller's transaction.
+
+    A failed update is rolled back on its own and logged, and the check-in or
+    check-out still commits. If the error took the whole transaction with it
+    (a deadlock victim on SQL Server, for example), it is raised so the
+    caller reports the write as failed.
+    """
+    backend.savepoint(cursor, 'rollups')
+    try:
+        update(cursor, visitors)
+        backend.release_savepoint(cursor, 'rollups')
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        if not backend.transaction_usable(cursor):
+            logger.error("Visit rollup update aborted the transaction. SQLSTATE: %s Message: %s", sqlstate, message)
+            raise
+        backend.rollback_to_savepoint(cursor, 'rollups')
+        logger.error("Failed to update visit rollups (repair with `python rollups.py backfill`). SQLSTATE: %s Message: %s",
+                     sqlstate, message)
+
+# Called as listener(event, data, version) after every committed write in this worker.
+# event is 'checkin' or 'preregister' with the affected visitor's columns in data,
+# 'checkout' with {'visitors': [columns of each visitor checked out together]},
+# 'archive' with {'visitors': [{'VisitorID': ...}, ...]} for visits moved to the
+# archive table, or 'import' (a bulk pre-registration batch) with just a row count.
+_write_listeners = []
+
+def add_write_listener(listener):
+    _write_listeners.append(listener)
+
+def _after_write(event, data):
+    """Invalidates cached reads and notifies write listeners."""
+    state = _request_state.get()
+    if state is not None:
+        state['wrote'] = True  # later reads in this request stay on the primary
+    version = cache.invalidate()
+    for listener in _write_listeners:
+        try:
+            listener(event, data, version)
+        except Exception as e:
+            logger.error("Write listener %s failed for %s: %s", listener, event, e, exc_info=True)
+
+def _badge_in_use(cursor, badge_number, other_than=None):
+    """True if a checked-in visitor (other than VisitorID `other_than`) holds the badge."""
+    cursor.execute(
+        f"SELECT 1 FROM {DB_TABLE} WHERE BadgeNumber = ? AND Status = 'CheckedIn' AND VisitorID != ?",
+        (badge_number, other_than if other_than is not None else -1))
+    return cursor.fetchone() is not None
+
+@metrics.timed_db_call
 def add_visitor(visitor_data):
-    """Adds a new visitor record to the database."""
-    conn = create_connection()
+    """Adds a new visitor record to the database.
+
+    The insert only happens if no checked-in visitor holds the same badge
+    ('No Badge' is exempt), so two kiosks cannot hand out one badge.
+    """
+    conn = get_connection()
     if not conn:
         return False, "Database connection failed"
 
     cursor = conn.cursor()
 
+    badge_number = visitor_data.get('BadgeNumber')
     sql = f"""
         INSERT INTO {DB_TABLE} (
             GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
             VendorName, BadgeNumber, HostEmployeeName, Comments, CheckInTime, Status
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), 'CheckedIn')
+        {backend.output_clause('VisitorID', 'CheckInTime')}
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, {backend.now}, 'CheckedIn'
+        WHERE ? = 'No Badge' OR NOT EXISTS (
+            SELECT 1 FROM {DB_TABLE} {backend.lock_hint}
+            WHERE BadgeNumber = ? AND Status = 'CheckedIn'
+        )
+        {backend.returning_clause('VisitorID', 'CheckInTime')}
     """
     params = (
         visitor_data.get('GuestFirstName'),
@@ -60,25 +226,35 @@ def add_visitor(visitor_data):
         visitor_data.get('Branch'),
         visitor_data.get('DepartmentVisited'),
         visitor_data.get('VendorName'),
-        visitor_data.get('BadgeNumber'),
+        badge_number,
         visitor_data.get('HostEmployeeName'), # "Here to see"
-        visitor_data.get('Comments')
+        visitor_data.get('Comments'),
+        badge_number,
+        badge_number
     )
 
     try:
-        logging.info(f"Executing SQL: {sql} with params: {params}")
+        logger.debug("Executing SQL: %s with params: %s", sql, params)
         cursor.execute(sql, params)
+        inserted = cursor.fetchone()
+        if inserted is None:
+            conn.rollback() # Badge reservation failed
+            logger.warning("Badge %s is already checked out to another visitor.", badge_number)
+            return False, f"Badge {badge_number} is already in use."
+
+        visitor = dict(visitor_data, VisitorID=inserted[0], CheckInTime=inserted[1], Status='CheckedIn')
+        _update_rollups(_rollups.checkins, cursor, [visitor])
         conn.commit() # Commit the transaction
-        logging.info("Visitor added successfully.")
+        _after_write('checkin', visitor)
+        logger.info("Visitor added successfully.")
         return True, "Visitor added successfully."
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to add visitor. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to add visitor. SQLSTATE: %s Message: %s", sqlstate, message)
         conn.rollback() # Rollback on error
         return False, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred: {str(e)}")
+        logger.error("An unexpected error occurred: %s", e)
         conn.rollback()
         return False, f"An unexpected error occurred: {str(e)}"
     finally:
@@ -87,9 +263,11 @@ def add_visitor(visitor_data):
         if conn:
             conn.close()
             
+@cache.cached('get_current_visitor_count')
+@metrics.timed_db_call
 def get_current_visitor_count():
     """Returns the count of visitors currently checked in."""
-    conn = create_connection()
+    conn = get_connection()
     if not conn:
         return 0, "Database connection failed"
 
@@ -102,15 +280,14 @@ def get_current_visitor_count():
     try:
         cursor.execute(sql)
         count = cursor.fetchone()[0]
-        logging.info(f"Current visitor count: {count}")
+        read_logger.info("Current visitor count: %s", count)
         return count, None
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to get visitor count. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to get visitor count. SQLSTATE: %s Message: %s", sqlstate, message)
         return 0, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred while getting visitor count: {str(e)}")
+        logger.error("An unexpected error occurred while getting visitor count: %s", e)
         return 0, f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
@@ -118,9 +295,11 @@ def get_current_visitor_count():
         if conn:
             conn.close()
             
+@cache.cached('get_checked_in_badges')
+@metrics.timed_db_call
 def get_checked_in_badges():
     """Returns a list of badge numbers that are currently checked in."""
-    conn = create_connection()
+    conn = get_connection()
     if not conn:
         return [], "Database connection failed"
 
@@ -133,15 +312,14 @@ def get_checked_in_badges():
     try:
         cursor.execute(sql)
         badges = [row[0] for row in cursor.fetchall()]
-        logging.info(f"Retrieved {len(badges)} checked-in badges")
+        read_logger.info("Retrieved %s checked-in badges", len(badges))
         return badges, None
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to get checked-in badges. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to get checked-in badges. SQLSTATE: %s Message: %s", sqlstate, message)
         return [], f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred while getting checked-in badges: {str(e)}")
+        logger.error("An unexpected error occurred while getting checked-in badges: %s", e)
         return [], f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
@@ -150,9 +328,10 @@ def get_checked_in_badges():
             conn.close()
 
 
+@metrics.timed_db_call
 def get_all_visitors():
     """Retrieves all visitor records (excluding pending visitors), ordered by CheckInTime descending."""
-    conn = create_connection()
+    conn = get_read_connection()
     if not conn:
         return None, "Database connection failed"
 
@@ -169,19 +348,16 @@ def get_all_visitors():
     """
     try:
         cursor.execute(sql)
-        # Get column names from cursor description
-        columns = [column[0] for column in cursor.description]
-        # Fetch rows and convert to list of dictionaries
-        visitors = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        logging.info(f"Retrieved {len(visitors)} visitor records.")
+        # Slotted records rather than one dict per row, see visitor_record.py
+        visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        read_logger.info("Retrieved %s visitor records.", len(visitors))
         return visitors, None
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to retrieve visitors. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve visitors. SQLSTATE: %s Message: %s", sqlstate, message)
         return None, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred while fetching visitors: {str(e)}")
+        logger.error("An unexpected error occurred while fetching visitors: %s", e)
         return None, f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
@@ -190,41 +366,122 @@ def get_all_visitors():
             conn.close()
 
 
-def get_visitors_by_date_range(start_date, end_date):
-    """Retrieves visitor records within a specified date range."""
-    conn = create_connection()
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '25')) # Rows per page of visitor history
+
+# Server-side filters accepted by get_visitor_page, mapped to their SQL condition
+HISTORY_FILTERS = {
+    'branch': "Branch = ?",
+    'department': "DepartmentVisited = ?",
+    'visitor_type': "VisitorType = ?",
+    'status': "Status = ?",
+    'date_from': "CheckInTime >= ?",
+    'date_to': "CheckInTime < ?",
+}
+
+def _split_page(visitors, limit):
+    """Trims a page fetched with limit + 1 rows; returns (visitors, next_key or None)."""
+    if len(visitors) <= limit:
+        return visitors, None
+    visitors = visitors[:limit]
+    last = visitors[-1]
+    return visitors, (last['CheckInTime'], last['VisitorID'])
+
+@metrics.timed_db_call
+def get_visitor_page(filters=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """Retrieves one page of visitor history (excluding pending visitors), newest first.
+
+    Uses keyset pagination on (CheckInTime, VisitorID): `after` is the key of the
+    last row on the previous page, as returned in 'next'. Returns a dict with
+    'visitors' and 'next' (None on the last page).
+    """
+    conn = get_read_connection()
     if not conn:
         return None, "Database connection failed"
 
     cursor = conn.cursor()
-    visitors = []
+    conditions = ["Status != 'Pending'"]
+    params = []
+    for name, value in (filters or {}).items():
+        if value and name in HISTORY_FILTERS:
+            conditions.append(HISTORY_FILTERS[name])
+            params.append(value)
+    if after:
+        after_time, after_id = after
+        conditions.append("(CheckInTime < ? OR (CheckInTime = ? AND VisitorID < ?))")
+        params.extend([after_time, after_time, after_id])
+
+    top, limit_clause = backend.limit(limit + 1) # One extra row tells us if there is a next page
     sql = f"""
-        SELECT
+        SELECT {top}
             VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
             VendorName, BadgeNumber, HostEmployeeName, Comments,
-            CheckInTime, CheckOutTime, Status, ColleagueFirstName, ColleagueLastName,
-            AdvanceCheckInTime, SubmissionTime, IsAdvanceCheckIn, SubmitterIPAddress
+            CheckInTime, CheckOutTime, Status
         FROM {DB_TABLE}
-        WHERE CheckInTime BETWEEN ? AND ?
+        WHERE {' AND '.join(conditions)}
+        ORDER BY CheckInTime DESC, VisitorID DESC
+        {limit_clause}
+    """
+    try:
+        cursor.execute(sql, params)
+        rows = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        visitors, next_key = _split_page(rows, limit)
+        read_logger.info("Retrieved page of %s visitor records.", len(visitors))
+        return {'visitors': visitors, 'next': next_key}, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve visitor page. SQLSTATE: %s Message: %s", sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching visitor page: %s", e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+# Every column of a visit, as stored in both DB_TABLE and ARCHIVE_TABLE
+VISITOR_COLUMNS = (
+    "VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited, "
+    "VendorName, BadgeNumber, HostEmployeeName, Comments, "
+    "CheckInTime, CheckOutTime, Status, ColleagueFirstName, ColleagueLastName, "
+    "AdvanceCheckInTime, SubmissionTime, IsAdvanceCheckIn, SubmitterIPAddress, CheckOutReason"
+)
+
+def _date_range_sql():
+    """Visits with CheckInTime BETWEEN ? AND ? in the visitor table and the archive (parameters twice)."""
+    return f"""
+        SELECT {VISITOR_COLUMNS} FROM {DB_TABLE} WHERE CheckInTime BETWEEN ? AND ?
+        UNION ALL
+        SELECT {VISITOR_COLUMNS} FROM {ARCHIVE_TABLE} WHERE CheckInTime BETWEEN ? AND ?
         ORDER BY CheckInTime DESC
     """
-    params = (start_date, end_date)
+
+@metrics.timed_db_call
+def get_visitors_by_date_range(start_date, end_date):
+    """Retrieves visitor records within a specified date range, including archived visits."""
+    conn = get_read_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    visitors = []
+    sql = _date_range_sql()
+    params = (start_date, end_date) * 2
     
     try:
         cursor.execute(sql, params)
-        # Get column names from cursor description
-        columns = [column[0] for column in cursor.description]
-        # Fetch rows and convert to list of dictionaries
-        visitors = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        logging.info(f"Retrieved {len(visitors)} visitor records between {start_date} and {end_date}.")
+        # Slotted records rather than one dict per row, see visitor_record.py
+        visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        read_logger.info("Retrieved %s visitor records between %s and %s.", len(visitors), start_date, end_date)
         return visitors, None
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to retrieve visitors by date range. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve visitors by date range. SQLSTATE: %s Message: %s", sqlstate, message)
         return None, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred while fetching visitors by date range: {str(e)}")
+        logger.error("An unexpected error occurred while fetching visitors by date range: %s", e)
         return None, f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
@@ -232,51 +489,222 @@ def get_visitors_by_date_range(start_date, end_date):
         if conn:
             conn.close()
 
-def checkout_visitor(visitor_id):
-    """Updates a visitor's status to 'CheckedOut' and sets the CheckOutTime."""
-    conn = create_connection()
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500')) # Rows fetched per round-trip when streaming
+
+@metrics.timed_db_call
+def stream_visitors_by_date_range(start_date, end_date, batch_size=EXPORT_BATCH_SIZE):
+    """Like get_visitors_by_date_range, but returns an iterator instead of a list.
+
+    Rows are fetched `batch_size` at a time with fetchmany, so memory use does not
+    grow with the size of the range. The pooled connection is held until the
+    iterator is exhausted or closed.
+    """
+    conn = get_read_connection()
     if not conn:
-        return False, "Database connection failed"
+        return None, "Database connection failed"
 
     cursor = conn.cursor()
+    sql = _date_range_sql()
+    params = (start_date, end_date) * 2
+
+    try:
+        cursor.execute(sql, params)
+        record = visitor_record.record_type(visitor_record.columns_of(cursor))
+        first_batch = cursor.fetchmany(batch_size)
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to stream visitors by date range. SQLSTATE: %s Message: %s", sqlstate, message)
+        cursor.close()
+        conn.close()
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while streaming visitors by date range: %s", e)
+        cursor.close()
+        conn.close()
+        return None, f"An unexpected error occurred: {str(e)}"
+
+    def rows():
+        batch = first_batch
+        total = 0
+        try:
+            while batch:
+                for row in batch:
+                    yield record(*row)
+                total += len(batch)
+                batch = cursor.fetchmany(batch_size)
+            read_logger.info("Streamed %s visitor records between %s and %s.", total, start_date, end_date)
+        except backend.Error as ex:
+            sqlstate, message = backend.error_details(ex)
+            logger.error("Failed while streaming visitors after %s rows. SQLSTATE: %s Message: %s", total, sqlstate, message)
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    return rows(), None
+
+ARCHIVE_MAX_BATCH = 1000  # visitor IDs per batch; SQL Server allows about 2100 parameters
+
+@metrics.timed_db_call
+def archive_closed_visitors(checked_in_before, batch_size=500):
+    """Moves up to `batch_size` checked-out visits that checked in before `checked_in_before`
+    from the visitor table to the archive table, in one short transaction.
+
+    Returns (number of visits moved, error); fewer than `batch_size` means none are left.
+    """
+    batch_size = max(1, min(batch_size, ARCHIVE_MAX_BATCH))
+    conn = get_connection()
+    if not conn:
+        return 0, "Database connection failed"
+
+    cursor = conn.cursor()
+    top, limit = backend.limit(batch_size)
+    try:
+        # Oldest first, along the CheckInTime index
+        cursor.execute(f"""
+            SELECT {top} VisitorID FROM {DB_TABLE}
+            WHERE CheckInTime < ? AND Status = 'CheckedOut'
+            ORDER BY CheckInTime, VisitorID
+            {limit}
+        """, (checked_in_before,))
+        visitor_ids = [row[0] for row in cursor.fetchall()]
+        if not visitor_ids:
+            conn.rollback()
+            return 0, None
+        where = f"VisitorID IN ({', '.join('?' for _ in visitor_ids)}) AND Status = 'CheckedOut'"
+        cursor.execute(f"""
+            INSERT INTO {ARCHIVE_TABLE} ({VISITOR_COLUMNS})
+            SELECT {VISITOR_COLUMNS} FROM {DB_TABLE} WHERE {where}
+        """, visitor_ids)
+        cursor.execute(f"DELETE FROM {DB_TABLE} WHERE {where}", visitor_ids)
+        conn.commit()
+        # The history tab's first page and the search index may hold some of them
+        _after_write('archive', {'visitors': [{'VisitorID': visitor_id} for visitor_id in visitor_ids]})
+        logger.info("Archived %s visits (VisitorID %s to %s).", len(visitor_ids), min(visitor_ids), max(visitor_ids))
+        return len(visitor_ids), None
+    except backend.Error as ex:
+        conn.rollback()
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to archive visits. SQLSTATE: %s Message: %s", sqlstate, message)
+        return 0, f"Database error: {message}"
+    except Exception as e:
+        conn.rollback()
+        logger.error("An unexpected error occurred while archiving visits: %s", e)
+        return 0, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+CHECKOUT_COLUMNS = (
+    'VisitorID', 'BadgeNumber', 'Branch', 'DepartmentVisited', 'VisitorType',
+    'CheckInTime', 'CheckOutTime', 'CheckOutReason',
+)
+CHECKOUT_CHUNK_SIZE = 1000  # visitor IDs per UPDATE; SQL Server allows about 2100 parameters
+
+def _checkout(cursor, where, params, reason, checkout_time=None):
+    """Runs one set-based checkout UPDATE; returns the checked-out rows as dicts.
+
+    CheckOutTime is `checkout_time` if given, else the current time.
+    """
     sql = f"""
         UPDATE {DB_TABLE}
-        SET Status = 'CheckedOut', CheckOutTime = GETDATE()
-        WHERE VisitorID = ? AND Status = 'CheckedIn'
+        SET Status = 'CheckedOut', CheckOutTime = {backend.now if checkout_time is None else '?'}, CheckOutReason = ?
+        {backend.output_clause(*CHECKOUT_COLUMNS)}
+        WHERE Status = 'CheckedIn' AND {where}
+        {backend.returning_clause(*CHECKOUT_COLUMNS)}
     """
-    params = (visitor_id,)
+    time_params = () if checkout_time is None else (checkout_time,)
+    cursor.execute(sql, time_params + (reason,) + tuple(params))
+    return [dict(zip(CHECKOUT_COLUMNS, row), Status='CheckedOut') for row in cursor.fetchall()]
 
-    try:
-        logging.info(f"Checking out visitor ID: {visitor_id}")
-        cursor.execute(sql, params)
-        # Check if any row was actually updated
-        if cursor.rowcount == 0:
-            conn.rollback() # Rollback if no rows affected (already checked out or invalid ID)
-            logging.warning(f"Visitor ID {visitor_id} not found or already checked out.")
-            return False, "Visitor not found or already checked out."
+def _run_checkout(batches, reason, description, checkout_time=None):
+    """Checks out the rows matched by each (where, params) in one transaction.
 
-        conn.commit() # Commit the transaction
-        logging.info(f"Visitor ID {visitor_id} checked out successfully.")
-        return True, "Visitor checked out successfully."
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to check out visitor ID {visitor_id}. SQLSTATE: {sqlstate} Message: {message}")
+    Listeners get one 'checkout' event for the whole set, so a large batch
+    does not flood the event streams. Returns (checked-out rows, error).
+    """
+    conn = get_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    try:
+        checked_out = []
+        for where, params in batches:
+            checked_out.extend(_checkout(cursor, where, params, reason, checkout_time))
+        _update_rollups(_rollups.checkouts, cursor, checked_out)
+        conn.commit()
+        if checked_out:
+            _after_write('checkout', {'visitors': checked_out})
+        logger.info("Checked out %s visitor(s): %s", len(checked_out), description)
+        return checked_out, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to check out visitors (%s). SQLSTATE: %s Message: %s", description, sqlstate, message)
         conn.rollback() # Rollback on error
-        return False, f"Database error: {message}"
+        return None, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred during checkout: {str(e)}")
+        logger.error("An unexpected error occurred during checkout: %s", e)
         conn.rollback()
-        return False, f"An unexpected error occurred: {str(e)}"
+        return None, f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
 
+@metrics.timed_db_call
+def checkout_visitors(visitor_ids, reason='Manual'):
+    """Checks out several visitors with one UPDATE (per 1000 IDs) in one transaction.
+
+    IDs that are not checked in are skipped. Returns (checked-out rows, error).
+    """
+    visitor_ids = [int(visitor_id) for visitor_id in visitor_ids]
+    if not visitor_ids:
+        return [], None
+    batches = []
+    for start in range(0, len(visitor_ids), CHECKOUT_CHUNK_SIZE):
+        chunk = visitor_ids[start:start + CHECKOUT_CHUNK_SIZE]
+        batches.append((f"VisitorID IN ({', '.join('?' * len(chunk))})", chunk))
+    return _run_checkout(batches, reason, f"{len(visitor_ids)} requested ID(s)")
+
+@metrics.timed_db_call
+def checkout_visitor(visitor_id):
+    """Updates a visitor's status to 'CheckedOut' and sets the CheckOutTime."""
+    checked_out, error = checkout_visitors([visitor_id])
+    if error:
+        return False, error
+    if not checked_out:
+        logger.warning("Visitor ID %s not found or already checked out.", visitor_id)
+        return False, "Visitor not found or already checked out."
+    return True, "Visitor checked out successfully."
+
+@metrics.timed_db_call
+def checkout_stale_visitors(checked_in_before, branch=None, other_than_branches=(), reason='Auto checkout',
+                            checkout_time=None):
+    """Checks out everyone at `branch` who checked in before `checked_in_before`, with one UPDATE.
+
+    With branch=None it covers every branch not in `other_than_branches`
+    instead. CheckOutTime is `checkout_time` (e.g. the branch's closing time)
+    if given, else now. Returns (checked-out rows, error).
+    """
+    if branch is not None:
+        where, params = "Branch = ? AND CheckInTime < ?", [branch, checked_in_before]
+    elif other_than_branches:
+        placeholders = ', '.join('?' * len(other_than_branches))
+        where = f"(Branch IS NULL OR Branch NOT IN ({placeholders})) AND CheckInTime < ?"
+        params = list(other_than_branches) + [checked_in_before]
+    else:
+        where, params = "CheckInTime < ?", [checked_in_before]
+    return _run_checkout([(where, params)], reason, f"{branch or 'other branches'} before {checked_in_before}",
+                         checkout_time)
+
+@metrics.timed_db_call
 def add_advanced_visitor(visitor_data):
     """Adds a new advanced check-in visitor record to the database."""
-    conn = create_connection()
+    conn = get_connection()
     if not conn:
         return False, "Database connection failed"
 
@@ -286,7 +714,9 @@ def add_advanced_visitor(visitor_data):
     try:
         advance_checkin_time = datetime.fromisoformat(visitor_data.get('AdvanceCheckInTime').replace('Z', '+00:00'))
     except (ValueError, AttributeError) as e:
-        logging.error(f"Invalid advance check-in time format: {e}")
+        logger.error("Invalid advance check-in time format: %s", e)
+        cursor.close()
+        conn.close() # Hand the connection back to the pool
         return False, f"Invalid advance check-in time format: {e}"
 
     sql = f"""
@@ -296,7 +726,9 @@ def add_advanced_visitor(visitor_data):
             ColleagueFirstName, ColleagueLastName, AdvanceCheckInTime,
             SubmissionTime, IsAdvanceCheckIn, SubmitterIPAddress, Status
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), ?, ?, 'Pending')
+        {backend.output_clause('VisitorID')}
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {backend.now}, ?, ?, 'Pending')
+        {backend.returning_clause('VisitorID')}
     """
     params = (
         visitor_data.get('GuestFirstName'),
@@ -316,19 +748,20 @@ def add_advanced_visitor(visitor_data):
     )
 
     try:
-        logging.info(f"Executing SQL for advanced check-in: {sql} with params: {params}")
+        logger.debug("Executing SQL for advanced check-in: %s with params: %s", sql, params)
         cursor.execute(sql, params)
+        visitor_id = cursor.fetchone()[0]
         conn.commit() # Commit the transaction
-        logging.info("Advanced check-in visitor added successfully.")
+        _after_write('preregister', dict(visitor_data, VisitorID=visitor_id, AdvanceCheckInTime=advance_checkin_time, Status='Pending'))
+        logger.info("Advanced check-in visitor added successfully.")
         return True, "Advanced check-in visitor added successfully."
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to add advanced check-in visitor. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to add advanced check-in visitor. SQLSTATE: %s Message: %s", sqlstate, message)
         conn.rollback() # Rollback on error
         return False, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred: {str(e)}")
+        logger.error("An unexpected error occurred: %s", e)
         conn.rollback()
         return False, f"An unexpected error occurred: {str(e)}"
     finally:
@@ -337,9 +770,78 @@ def add_advanced_visitor(visitor_data):
         if conn:
             conn.close()
 
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))  # rows per transaction in bulk imports
+
+@metrics.timed_db_call
+def add_advanced_visitors(visitors):
+    """Inserts a batch of pre-registrations in one transaction.
+
+    Each visitor is a dict like add_advanced_visitor takes, with AdvanceCheckInTime
+    already parsed to a datetime. Returns (rows inserted, error); on error nothing
+    from the batch is kept.
+    """
+    if not visitors:
+        return 0, None
+    conn = get_connection()
+    if not conn:
+        return 0, "Database connection failed"
+
+    cursor = conn.cursor()
+    sql = f"""
+        INSERT INTO {DB_TABLE} (
+            GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+            VendorName, BadgeNumber, HostEmployeeName, Comments,
+            ColleagueFirstName, ColleagueLastName, AdvanceCheckInTime,
+            SubmissionTime, IsAdvanceCheckIn, SubmitterIPAddress, Status
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {backend.now}, ?, ?, 'Pending')
+    """
+    rows = [
+        (
+            visitor.get('GuestFirstName'),
+            visitor.get('GuestLastName'),
+            visitor.get('VisitorType'),
+            visitor.get('Branch'),
+            visitor.get('DepartmentVisited'),
+            visitor.get('VendorName'),
+            visitor.get('BadgeNumber', 'No Badge'),
+            visitor.get('HostEmployeeName'),
+            visitor.get('Comments'),
+            visitor.get('ColleagueFirstName'),
+            visitor.get('ColleagueLastName'),
+            visitor['AdvanceCheckInTime'],
+            visitor.get('IsAdvanceCheckIn', True),
+            visitor.get('SubmitterIPAddress'),
+        )
+        for visitor in visitors
+    ]
+
+    try:
+        logger.info("Bulk inserting %s pre-registered visitors", len(rows))
+        backend.executemany(cursor, sql, rows)
+        conn.commit()
+        _after_write('import', {'count': len(rows)})
+        return len(rows), None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to bulk insert pre-registered visitors. SQLSTATE: %s Message: %s", sqlstate, message)
+        conn.rollback()
+        return 0, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred during bulk insert: %s", e)
+        conn.rollback()
+        return 0, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@cache.cached('get_pending_visitors')
+@metrics.timed_db_call
 def get_pending_visitors():
     """Retrieves all pending (pre-registered) visitor records, ordered by AdvanceCheckInTime."""
-    conn = create_connection()
+    conn = get_connection()
     if not conn:
         return None, "Database connection failed"
 
@@ -356,19 +858,102 @@ def get_pending_visitors():
     """
     try:
         cursor.execute(sql)
-        # Get column names from cursor description
-        columns = [column[0] for column in cursor.description]
-        # Fetch rows and convert to list of dictionaries
-        visitors = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        logging.info(f"Retrieved {len(visitors)} pending visitor records.")
+        # Slotted records rather than one dict per row, see visitor_record.py
+        visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        read_logger.info("Retrieved %s pending visitor records.", len(visitors))
         return visitors, None
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to retrieve pending visitors. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve pending visitors. SQLSTATE: %s Message: %s", sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching pending visitors: %s", e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@metrics.timed_db_call
+def get_visitor_by_id(visitor_id):
+    """Retrieves one visitor record by primary key, from the archive if it was moved there.
+
+    Returns (record or None if not found, error).
+    """
+    conn = get_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    try:
+        for table in (DB_TABLE, ARCHIVE_TABLE):
+            cursor.execute(f"""
+                SELECT
+                    VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+                    VendorName, BadgeNumber, HostEmployeeName, Comments, CheckInTime, CheckOutTime, Status,
+                    AdvanceCheckInTime, SubmissionTime, ColleagueFirstName, ColleagueLastName
+                FROM {table}
+                WHERE VisitorID = ?
+            """, (visitor_id,))
+            visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+            if visitors:
+                return visitors[0], None
+        return None, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve visitor %s. SQLSTATE: %s Message: %s", visitor_id, sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching visitor %s: %s", visitor_id, e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@metrics.timed_db_call
+def get_last_visit(first_name, last_name, vendor_name=None):
+    """Retrieves the most recent visit by a guest (names compared case-insensitively).
+
+    With `vendor_name`, only visits for that vendor count. The archive is only
+    searched for guests with no visit left in the visitor table, since every
+    archived visit is older. Returns (record or None if the guest has not
+    visited before, error).
+    """
+    conn = get_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    top, limit = backend.limit(1)
+    params = [last_name, first_name]
+    vendor_filter = ''
+    if vendor_name:
+        vendor_filter = f"AND VendorName{backend.nocase} = ?"
+        params.append(vendor_name)
+    try:
+        for table in (DB_TABLE, ARCHIVE_TABLE):
+            cursor.execute(f"""
+                SELECT {top}
+                    VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+                    VendorName, HostEmployeeName, CheckInTime, AdvanceCheckInTime
+                FROM {table}
+                WHERE GuestLastName{backend.nocase} = ? AND GuestFirstName{backend.nocase} = ? {vendor_filter}
+                ORDER BY VisitorID DESC
+                {limit}
+            """, params)
+            visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+            if visitors:
+                return visitors[0], None
+        return None, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to look up previous visits. SQLSTATE: %s Message: %s", sqlstate, message)
         return None, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred while fetching pending visitors: {str(e)}")
+        logger.error("An unexpected error occurred while looking up previous visits: %s", e)
         return None, f"An unexpected error occurred: {str(e)}"
     finally:
         if cursor:
@@ -376,40 +961,261 @@ def get_pending_visitors():
         if conn:
             conn.close()
 
+@metrics.timed_db_call
+def get_search_rows(since):
+    """Retrieves the searchable columns of every visitor not yet checked out or checked in since `since`.
+
+    Loads the search index (see search.py) in one pass.
+    """
+    conn = get_read_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    sql = f"""
+        SELECT
+            VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+            VendorName, BadgeNumber, HostEmployeeName, CheckInTime, AdvanceCheckInTime, Status
+        FROM {DB_TABLE}
+        WHERE Status != 'CheckedOut' OR CheckInTime >= ?
+    """
+    try:
+        cursor.execute(sql, (since,))
+        visitors = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        read_logger.info("Retrieved %s visitor records for the search index.", len(visitors))
+        return visitors, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve search rows. SQLSTATE: %s Message: %s", sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching search rows: %s", e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@metrics.timed_db_call
+def get_visit_rollups(grain, start, end):
+    """Retrieves the rollup rows of one grain ('H' or 'D', see rollups.py) with PeriodStart in [start, end).
+
+    Returns ({'visits': [...], 'occupancy': [...]}, error); never scans the visitor table.
+    """
+    conn = get_read_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    params = (grain, start, end)
+    try:
+        cursor.execute(f"""
+            SELECT PeriodStart, Branch, DepartmentVisited, VisitorType, CheckIns, CompletedVisits, DwellSeconds
+            FROM {_rollups.visit_table}
+            WHERE Grain = ? AND PeriodStart >= ? AND PeriodStart < ?
+        """, params)
+        visits = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        cursor.execute(f"""
+            SELECT PeriodStart, Branch, PeakOccupancy
+            FROM {_rollups.occupancy_table}
+            WHERE Grain = ? AND PeriodStart >= ? AND PeriodStart < ?
+        """, params)
+        occupancy = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+        read_logger.info("Retrieved %s visit and %s occupancy rollup rows.", len(visits), len(occupancy))
+        return {'visits': visits, 'occupancy': occupancy}, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve visit rollups. SQLSTATE: %s Message: %s", sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching visit rollups: %s", e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@metrics.timed_db_call
+def backfill_rollups(first=None, last=None):
+    """Recomputes the rollups of every day from `first` (default: the first visit) to `last` (default: today).
+
+    Commits once per day so a long backfill does not hold locks on the
+    rollup tables. Returns (days rebuilt, error).
+    """
+    conn = get_connection()
+    if not conn:
+        return 0, "Database connection failed"
+
+    cursor = conn.cursor()
+    days = 0
+    try:
+        last = last or datetime.now().date()
+        if first is None:
+            top, limit = backend.limit(1)
+            earliest = []
+            for table in (DB_TABLE, ARCHIVE_TABLE):
+                cursor.execute(f"""
+                    SELECT {top} CheckInTime FROM {table}
+                    WHERE CheckInTime IS NOT NULL
+                    ORDER BY CheckInTime
+                    {limit}
+                """)
+                earliest.extend(row[0] for row in cursor.fetchall())
+            if not earliest:
+                return 0, None
+            first = min(earliest).date()
+        day = first
+        while day <= last:
+            check_ins = _rollups.rebuild_day(cursor, day)
+            conn.commit()
+            logger.info("Rebuilt rollups for %s (%s check-ins).", day, check_ins)
+            days += 1
+            day += timedelta(days=1)
+        return days, None
+    except backend.Error as ex:
+        conn.rollback()
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Rollup backfill stopped after %s day(s). SQLSTATE: %s Message: %s", days, sqlstate, message)
+        return days, f"Database error: {message}"
+    except Exception as e:
+        conn.rollback()
+        logger.error("An unexpected error occurred during the rollup backfill: %s", e)
+        return days, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@cache.cached('get_desk_snapshot')
+@metrics.timed_db_call
+def get_desk_snapshot():
+    """Returns everything the front desk pages need in a single round-trip.
+
+    The result is a dict with 'checked_in', 'recent' (the first unfiltered page of
+    history, see get_visitor_page) and 'pending' visitor lists, 'recent_next' for
+    fetching the following page, plus 'badges_in_use' and 'count', which are
+    derived from the checked-in rows.
+    """
+    conn = get_connection()
+    if not conn:
+        return None, "Database connection failed"
+
+    cursor = conn.cursor()
+    top, limit = backend.limit(HISTORY_PAGE_SIZE + 1)
+    statements = [
+        f"""
+        SELECT
+            VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+            VendorName, BadgeNumber, HostEmployeeName, Comments,
+            CheckInTime, CheckOutTime, Status
+        FROM {DB_TABLE}
+        WHERE Status = 'CheckedIn'
+        ORDER BY CheckInTime DESC
+        """,
+        f"""
+        SELECT {top}
+            VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+            VendorName, BadgeNumber, HostEmployeeName, Comments,
+            CheckInTime, CheckOutTime, Status
+        FROM {DB_TABLE}
+        WHERE Status != 'Pending'
+        ORDER BY CheckInTime DESC, VisitorID DESC
+        {limit}
+        """,
+        f"""
+        SELECT
+            VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited,
+            VendorName, BadgeNumber, HostEmployeeName, Comments,
+            AdvanceCheckInTime, SubmissionTime, ColleagueFirstName, ColleagueLastName, Status
+        FROM {DB_TABLE}
+        WHERE Status = 'Pending'
+        ORDER BY AdvanceCheckInTime ASC
+        """,
+    ]
+    try:
+        checked_in, recent, pending = [
+            visitor_record.from_rows(columns, rows)
+            for columns, rows in backend.execute_batch(cursor, statements)
+        ]
+        recent, recent_next = _split_page(recent, HISTORY_PAGE_SIZE)
+        snapshot = {
+            'checked_in': checked_in,
+            'recent': recent,
+            'recent_next': recent_next,
+            'pending': pending,
+            'badges_in_use': [visitor['BadgeNumber'] for visitor in checked_in],
+            'count': len(checked_in),
+        }
+        read_logger.info("Retrieved desk snapshot: %s checked in, %s pending.", len(checked_in), len(pending))
+        return snapshot, None
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to retrieve desk snapshot. SQLSTATE: %s Message: %s", sqlstate, message)
+        return None, f"Database error: {message}"
+    except Exception as e:
+        logger.error("An unexpected error occurred while fetching desk snapshot: %s", e)
+        return None, f"An unexpected error occurred: {str(e)}"
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@metrics.timed_db_call
 def checkin_pending_visitor(visitor_id, badge_number):
     """Updates a pending visitor's status to 'CheckedIn', sets the CheckInTime, and assigns a badge."""
-    conn = create_connection()
+    conn = get_connection()
     if not conn:
         return False, "Database connection failed"
 
     cursor = conn.cursor()
+    returned_columns = (
+        'VisitorID', 'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 'DepartmentVisited',
+        'VendorName', 'BadgeNumber', 'HostEmployeeName', 'Comments', 'CheckInTime'
+    )
+    # Same badge reservation rule as add_visitor
     sql = f"""
         UPDATE {DB_TABLE}
-        SET Status = 'CheckedIn', CheckInTime = GETDATE(), BadgeNumber = ?
+        SET Status = 'CheckedIn', CheckInTime = {backend.now}, BadgeNumber = ?
+        {backend.output_clause(*returned_columns)}
         WHERE VisitorID = ? AND Status = 'Pending'
+        AND (? = 'No Badge' OR NOT EXISTS (
+            SELECT 1 FROM {DB_TABLE} {backend.lock_hint}
+            WHERE BadgeNumber = ? AND Status = 'CheckedIn'
+        ))
+        {backend.returning_clause(*returned_columns)}
     """
-    params = (badge_number, visitor_id)
+    params = (badge_number, visitor_id, badge_number, badge_number)
 
     try:
-        logging.info(f"Checking in pending visitor ID: {visitor_id} with badge: {badge_number}")
+        logger.info("Checking in pending visitor ID: %s with badge: %s", visitor_id, badge_number)
         cursor.execute(sql, params)
         # Check if any row was actually updated
-        if cursor.rowcount == 0:
+        updated = cursor.fetchone()
+        if updated is None:
             conn.rollback() # Rollback if no rows affected
-            logging.warning(f"Pending visitor ID {visitor_id} not found or already checked in.")
+            if badge_number != 'No Badge' and _badge_in_use(cursor, badge_number, other_than=visitor_id):
+                logger.warning("Badge %s is already checked out to another visitor.", badge_number)
+                return False, f"Badge {badge_number} is already in use."
+            logger.warning("Pending visitor ID %s not found or already checked in.", visitor_id)
             return False, "Visitor not found or already checked in."
 
+        visitor = dict(zip(returned_columns, updated), Status='CheckedIn')
+        _update_rollups(_rollups.checkins, cursor, [visitor])
         conn.commit() # Commit the transaction
-        logging.info(f"Pending visitor ID {visitor_id} checked in successfully.")
+        _after_write('checkin', visitor)
+        logger.info("Pending visitor ID %s checked in successfully.", visitor_id)
         return True, "Visitor checked in successfully."
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        message = ex.args[1]
-        logging.error(f"Failed to check in pending visitor ID {visitor_id}. SQLSTATE: {sqlstate} Message: {message}")
+    except backend.Error as ex:
+        sqlstate, message = backend.error_details(ex)
+        logger.error("Failed to check in pending visitor ID %s. SQLSTATE: %s Message: %s", visitor_id, sqlstate, message)
         conn.rollback() # Rollback on error
         return False, f"Database error: {message}"
     except Exception as e:
-        logging.error(f"An unexpected error occurred during check-in: {str(e)}")
+        logger.error("An unexpected error occurred during check-in: %s", e)
         conn.rollback()
         return False, f"An unexpected error occurred: {str(e)}"
     finally:
@@ -0,0 +1,286 @@
+# db_backends.py
+import os
+import sqlite3
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class SQLServerBackend:
+    """SQL Server over ODBC (the production database)."""
+
+    name = 'sqlserver'
+    now = 'GETDATE()'
+    nocase = ''  # the default collation already compares case-insensitively
+    ping_sql = 'SELECT 1'
+    auto_migrate = False  # run `python migrations.py upgrade` instead
+
+    def __init__(self, server, database, username, password, conn_str=None, connect_timeout=None):
+        import pyodbc  # only required when this backend is selected
+        self._pyodbc = pyodbc
+        self.Error = pyodbc.Error
+        self.server = server
+        self.database = database
+        self.username = username
+        self.password = password
+        self.conn_str = conn_str  # full ODBC connection string; overrides the parts above
+        self.connect_timeout = connect_timeout  # login timeout in seconds (driver default if None)
+
+    def describe(self):
+        if self.conn_str:
+            # Show SERVER/DATABASE only, never the credentials
+            parts = dict(part.split('=', 1) for part in self.conn_str.split(';') if '=' in part)
+            parts = {key.strip().upper(): value for key, value in parts.items()}
+            return f"{parts.get('SERVER', '?')}/{parts.get('DATABASE', '?')}"
+        return f"{self.server}/{self.database}"
+
+    def table_name(self, table):
+        return table
+
+    def connect(self, table):
+        conn_str = self.conn_str or (
+            r'DRIVER={ODBC Driver 17 for SQL Server};'
+            r'SERVER=' + self.server + ';'
+            r'DATABASE=' + self.database + ';'
+            r'UID=' + self.username + ';'
+            r'PWD=' + self.password + ';'
+            r'Encrypt=No;' # Yes in production if SSL is configured ???
+            r'TrustServerCertificate=Yes;' # Add if self-signed cert or encryption without full validation ????
+        )
+        if self.connect_timeout:
+            return self._pyodbc.connect(conn_str, autocommit=False, timeout=int(self.connect_timeout))
+        return self._pyodbc.connect(conn_str, autocommit=False)
+
+    def error_details(self, ex):
+        """Returns (sqlstate, message) for a driver error."""
+        return ex.args[0], ex.args[1] if len(ex.args) > 1 else str(ex)
+
+    # Hold the range lock on a NOT EXISTS check until commit, so two
+    # transactions cannot both see "no row" and both insert
+    lock_hint = 'WITH (UPDLOCK, HOLDLOCK)'
+
+    def limit(self, n):
+        """Returns (prefix, suffix) that cap a SELECT at n rows."""
+        return f"TOP ({int(n)})", ""
+
+    def output_clause(self, *columns):
+        """Clause placed before VALUES/SELECT/WHERE that returns the written rows' columns."""
+        return "OUTPUT " + ", ".join(f"inserted.{column}" for column in columns)
+
+    def returning_clause(self, *columns):
+        """Clause placed at the end of the statement (SQLite's equivalent of OUTPUT)."""
+        return ""
+
+    def execute_batch(self, cursor, statements, params=()):
+        """Runs several SELECTs in one round-trip; returns [(columns, rows), ...]."""
+        sql = "SET NOCOUNT ON;\n" + ";\n".join(statements)
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+        results = []
+        while True:
+            if cursor.description:
+                results.append(([column[0] for column in cursor.description], cursor.fetchall()))
+            if not cursor.nextset():
+                break
+        return results
+
+    def executemany(self, cursor, sql, rows):
+        """Runs one statement for many parameter rows in a single round-trip."""
+        cursor.fast_executemany = True  # bind all rows as arrays instead of one call per row
+        cursor.executemany(sql, rows)
+
+    def upsert_sql(self, table, keys, sums=(), maxes=()):
+        """Inserts a row, or adds `sums` to and raises `maxes` on the existing row with the same keys.
+
+        Parameters are the values of keys, sums and maxes, in that order.
+        """
+        columns = keys + sums + maxes
+        source = ', '.join(f"? AS {column}" for column in columns)
+        match = ' AND '.join(f"t.{column} = s.{column}" for column in keys)
+        updates = [f"t.{column} = t.{column} + s.{column}" for column in sums]
+        updates += [f"t.{column} = CASE WHEN s.{column} > t.{column} THEN s.{column} ELSE t.{column} END" for column in maxes]
+        return f"""
+            MERGE {table} WITH (HOLDLOCK) AS t
+            USING (SELECT {source}) AS s
+            ON {match}
+            WHEN MATCHED THEN UPDATE SET {', '.join(updates)}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join('s.' + column for column in columns)});
+        """
+
+    def savepoint(self, cursor, name):
+        cursor.execute(f"SAVE TRANSACTION {name}")
+
+    def release_savepoint(self, cursor, name):
+        pass  # SQL Server savepoints last until the transaction ends
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TRANSACTION {name}")
+
+    def transaction_usable(self, cursor):
+        """False once an error (a deadlock, for example) has rolled back or doomed the open transaction."""
+        cursor.execute("SELECT XACT_STATE()")
+        return cursor.fetchone()[0] == 1
+
+
+def _adapt_datetime(value):
+    # SQL Server DATETIME columns carry no offset, so store naive local values here too
+    return value.replace(tzinfo=None).isoformat(' ')
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+
+
+class SQLiteBackend:
+    """Embedded SQLite database in WAL mode, for small sites and offline testing."""
+
+    name = 'sqlite'
+    now = "datetime('now', 'localtime')"
+    nocase = ' COLLATE NOCASE'  # appended to a column for case-insensitive comparison
+    ping_sql = 'SELECT 1'
+    Error = sqlite3.Error
+    auto_migrate = True  # embedded databases create and upgrade their own schema
+
+    def __init__(self, path, busy_timeout=5, read_only=False):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.read_only = read_only
+        if read_only:
+            self.auto_migrate = False
+
+    def describe(self):
+        return f"sqlite:{self.path}" + (" (read-only)" if self.read_only else "")
+
+    def table_name(self, table):
+        # SQLite has no dbo schema; 'dbo.VisitorInteractions' becomes 'VisitorInteractions'
+        return (table or 'VisitorInteractions').split('.')[-1]
+
+    def connect(self, table):
+        if self.read_only:
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+                timeout=self.busy_timeout,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False,
+            )
+            return conn
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,  # pooled connections move between request threads
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def error_details(self, ex):
+        """Returns (sqlstate, message) for a driver error."""
+        return getattr(ex, 'sqlite_errorname', type(ex).__name__), str(ex)
+
+    # SQLite serialises writers, so a single INSERT ... WHERE NOT EXISTS is already atomic
+    lock_hint = ''
+
+    def limit(self, n):
+        """Returns (prefix, suffix) that cap a SELECT at n rows."""
+        return "", f"LIMIT {int(n)}"
+
+    def output_clause(self, *columns):
+        """Clause placed before VALUES/SELECT/WHERE that returns the written rows' columns."""
+        return ""
+
+    def returning_clause(self, *columns):
+        """Clause placed at the end of the statement (SQL Server uses OUTPUT instead)."""
+        return "RETURNING " + ", ".join(columns)
+
+    def execute_batch(self, cursor, statements, params=()):
+        """Runs several SELECTs; returns [(columns, rows), ...].
+
+        SQLite has no multi-statement result sets, but it is in-process so
+        there is no round-trip to save. `params` are split across statements
+        in order of their placeholders.
+        """
+        results = []
+        params = list(params)
+        for statement in statements:
+            count = statement.count('?')
+            cursor.execute(statement, params[:count])
+            params = params[count:]
+            results.append(([column[0] for column in cursor.description], cursor.fetchall()))
+        return results
+
+    def executemany(self, cursor, sql, rows):
+        """Runs one statement for many parameter rows."""
+        cursor.executemany(sql, rows)
+
+    def upsert_sql(self, table, keys, sums=(), maxes=()):
+        """Inserts a row, or adds `sums` to and raises `maxes` on the existing row with the same keys.
+
+        Parameters are the values of keys, sums and maxes, in that order.
+        """
+        columns = keys + sums + maxes
+        updates = [f"{column} = {column} + excluded.{column}" for column in sums]
+        updates += [f"{column} = MAX({column}, excluded.{column})" for column in maxes]
+        return f"""
+            INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(updates)}
+        """
+
+    def savepoint(self, cursor, name):
+        cursor.execute(f"SAVEPOINT {name}")
+
+    def release_savepoint(self, cursor, name):
+        cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+    def transaction_usable(self, cursor):
+        """False once an error has rolled back the open transaction."""
+        return cursor.connection.in_transaction
+
+
+def backend_from_env():
+    """Builds the backend selected by DB_BACKEND ('sqlserver' by default, or 'sqlite')."""
+    kind = os.getenv('DB_BACKEND', 'sqlserver').lower()
+    if kind == 'sqlite':
+        return SQLiteBackend(
+            os.getenv('SQLITE_PATH', 'visitor_tracker.db'),
+            busy_timeout=float(os.getenv('SQLITE_BUSY_TIMEOUT', '5')),
+        )
+    if kind != 'sqlserver':
+        logger.warning("Unknown DB_BACKEND '%s', falling back to sqlserver", kind)
+    return SQLServerBackend(
+        os.getenv('DB_SERVER'),
+        os.getenv('DB_NAME'),
+        os.getenv('DB_USERNAME'),
+        os.getenv('DB_PASSWORD'),
+    )
+
+def replica_backend_from_env():
+    """Builds the read replica backend, or returns None if no replica is configured.
+
+    SQL Server: DB_REPLICA_CONNECTION_STRING (a full ODBC connection string).
+    SQLite: SQLITE_REPLICA_PATH, opened read-only.
+    """
+    kind = os.getenv('DB_BACKEND', 'sqlserver').lower()
+    if kind == 'sqlite':
+        path = os.getenv('SQLITE_REPLICA_PATH')
+        if not path:
+            return None
+        return SQLiteBackend(path, busy_timeout=float(os.getenv('SQLITE_BUSY_TIMEOUT', '5')), read_only=True)
+    conn_str = os.getenv('DB_REPLICA_CONNECTION_STRING')
+    if not conn_str:
+        return None
+    return SQLServerBackend(
+        None, None, None, None,
+        conn_str=conn_str,
+        connect_timeout=float(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', '5')),
+    )
@@ -0,0 +1,265 @@
+# events.py
+import os
+import json
+import time
+import queue
+import logging
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime
+
+import cache
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows dev machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+EVENTS_FILE = os.getenv('EVENTS_FILE', os.path.join(tempfile.gettempdir(), 'visitor_tracker.events'))
+EVENTS_MAX_BYTES = int(os.getenv('EVENTS_MAX_BYTES', str(1024 * 1024)))  # rotate the event log past this size
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.5'))  # seconds between checks for new events
+SSE_MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_STREAM_SECONDS', '300'))  # browsers reconnect after this
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+# Streams open at once per worker; each holds a gunicorn thread, the rest stay free for kiosks
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '2'))
+SSE_BUSY_RETRY_SECONDS = float(os.getenv('SSE_BUSY_RETRY_SECONDS', '30'))  # when to try again if the worker is full
+
+# Columns sent to browsers; everything else (comments, submitter IP) stays on the server
+PUBLIC_FIELDS = (
+    'VisitorID', 'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 'DepartmentVisited',
+    'VendorName', 'BadgeNumber', 'HostEmployeeName', 'CheckInTime', 'CheckOutTime', 'CheckOutReason',
+    'AdvanceCheckInTime', 'Status', 'ColleagueFirstName', 'ColleagueLastName'
+)
+
+RESYNC = 'resync'  # tells a page it may have missed events and should reload
+
+
+def _public(data):
+    if 'visitors' in data:  # a checkout batch
+        return {'visitors': [_public(visitor) for visitor in data['visitors']]}
+    return {
+        field: value.isoformat() if isinstance(value, datetime) else value
+        for field, value in data.items() if field in PUBLIC_FIELDS
+    }
+
+
+class Subscription:
+    """One open event stream. The tailer thread fills the queue; the request thread drains it."""
+
+    def __init__(self, size=100):
+        self.queue = queue.Queue(maxsize=size)
+        self.lost = False  # set if the browser fell behind and events were dropped
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lost = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """Fans visitor changes out to every open stream on every worker on the host.
+
+    Each write appends one JSON line to a shared event log. Every worker runs
+    one tailer thread that follows the log and copies new events to that
+    worker's subscribers, so a check-in handled by one worker reaches pages
+    streaming from all of them. The log is rotated (renamed to `.1`) once it
+    passes `max_bytes`; tailers finish the old file before switching.
+    """
+
+    def __init__(self, path, version, max_bytes=1024 * 1024, poll_interval=0.5, backlog=200):
+        self.path = path
+        self._version = version
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._recent = deque(maxlen=backlog)  # replayed to reconnecting browsers
+        self._subscribers = set()
+        self._listeners = []  # in-process consumers such as the search index, kept across forks
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def publish(self, event, data, version):
+        """Write listener: appends the event to the shared log."""
+        line = json.dumps({'id': version, 'event': event, 'data': _public(data)}) + '\n'
+        try:
+            with open(self.path + '.lock', 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                        os.replace(self.path, self.path + '.1')
+                    with open(self.path, 'a') as f:
+                        f.write(line)
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError as e:
+            logger.error("Could not write %s event to %s: %s", event, self.path, e)
+
+    def subscribe(self, last_id=None):
+        """Registers a stream. Events after `last_id` still in the backlog are queued first.
+
+        If writes happened since `last_id` that the backlog no longer holds, the
+        subscription is marked lost so the browser reloads instead.
+        """
+        self._start()
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+            if last_id is not None and last_id < self._version.get():
+                if not self._recent or self._recent[0]['id'] > last_id + 1:
+                    subscription.lost = True
+                for event in self._recent:
+                    if event['id'] > last_id:
+                        subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def add_listener(self, listener):
+        """Calls listener(event) on the tailer thread for every event from any worker.
+
+        Starts this worker's tailer if needed; adding the same listener again is a no-op.
+        """
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+        self._start()
+
+    def _start(self):
+        """Starts this worker's tailer thread (no-op if already running)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._subscribers = set()
+            self._recent.clear()
+            self._pid = os.getpid()
+            threading.Thread(target=self._tail, name='event-tailer', daemon=True).start()
+
+    def _open(self, at_end):
+        try:
+            f = open(self.path, 'a+')
+        except OSError as e:
+            logger.error("Could not open event log %s: %s", self.path, e)
+            return None
+        f.seek(0, os.SEEK_END if at_end else os.SEEK_SET)
+        return f
+
+    def _tail(self):
+        f = self._open(at_end=True)  # only events from now on
+        partial = ''
+        while True:
+            if f is None:
+                time.sleep(self.poll_interval)
+                f = self._open(at_end=True)
+                continue
+            partial = self._read_lines(f, partial)
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(f.fileno()).st_ino
+            except OSError:
+                rotated = True
+            if rotated:
+                partial = self._read_lines(f, partial)  # anything written before the rename
+                f.close()
+                f = self._open(at_end=False)
+                partial = ''
+                continue
+            time.sleep(self.poll_interval)
+
+    def _read_lines(self, f, partial):
+        """Dispatches the complete lines appended since the last read; returns any partial line."""
+        chunk = f.read()
+        if not chunk:
+            return partial
+        lines = (partial + chunk).split('\n')
+        for line in lines[:-1]:
+            if not line:
+                continue
+            try:
+                self._dispatch(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping malformed line in event log %s", self.path)
+        return lines[-1]
+
+    def _dispatch(self, event):
+        with self._lock:
+            self._recent.append(event)
+            for subscription in self._subscribers:
+                subscription.put(event)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error("Event listener %s failed for %s: %s", listener, event.get('event'), e, exc_info=True)
+
+
+class StreamSlots:
+    """Counts this worker's open streams against a limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a slot; False if `limit` streams are already open."""
+        with self._lock:
+            if self._open >= self.limit:
+                return False
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open = max(0, self._open - 1)
+
+
+def format_sse(event):
+    """Formats an event in the text/event-stream wire format."""
+    lines = []
+    if 'id' in event:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event.get('data', {}))}")
+    return '\n'.join(lines) + '\n\n'
+
+def stream(last_id=None, max_seconds=SSE_MAX_STREAM_SECONDS, keepalive=SSE_KEEPALIVE_SECONDS):
+    """Yields one browser's event stream until `max_seconds` pass or events are lost.
+
+    Each open stream holds a gunicorn thread, so streams end after a while and
+    the browser's EventSource reconnects with Last-Event-ID.
+    """
+    subscription = bus.subscribe(last_id)
+    try:
+        yield f"retry: {int(EVENTS_POLL_INTERVAL * 1000) + 1000}\n\n"
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            if subscription.lost:
+                # The page may be missing rows; have it reload rather than patch
+                yield format_sse({'event': RESYNC})
+                break
+            event = subscription.get(timeout=min(keepalive, max(0.0, deadline - time.monotonic())))
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(event)
+    finally:
+        bus.unsubscribe(subscription)
+
+
+stream_slots = StreamSlots(SSE_MAX_STREAMS)
+
+bus = EventBus(EVENTS_FILE, cache.write_version, max_bytes=EVENTS_MAX_BYTES, poll_interval=EVENTS_POLL_INTERVAL)
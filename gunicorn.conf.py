@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+# Server hooks for metrics and database connections; workers, threads and bind address are set in visitor_tracker.service.
+import os
+import shutil
+
+
+def on_starting(server):
+    """Clears metric files left by the previous run, so counters start from zero."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drops a dead worker's live gauges (in-flight requests) from /metrics."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Logs the exiting worker's pooled connections off instead of dropping them."""
+    import sys
+    database = sys.modules.get('database')
+    if database is not None:  # only if the worker got as far as loading the app
+        database.close_pools()
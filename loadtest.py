@@ -0,0 +1,406 @@
+# loadtest.py
+"""Load test: simulated kiosk and front-desk traffic against the app.
+
+Usage:
+    python loadtest.py                                   # 60s, 20 users, 3 workers
+    python loadtest.py --duration 120 --users 50
+    python loadtest.py --save-baseline loadtest_baseline.json
+    python loadtest.py --baseline loadtest_baseline.json # exit 1 on a regression
+    python loadtest.py --url http://127.0.0.1:8080       # an app that is already running
+
+By default the app is started under gunicorn, as in visitor_tracker.service
+(--workers, --threads), against a throwaway SQLite database seeded with
+--seed-days of history, and Teams notifications go to a mock webhook on
+localhost that answers after --webhook-delay seconds. Nothing touches SQL
+Server or Teams. With --url the stand-ins are not used: point it at a test
+deployment only, as the run checks visitors in and out.
+
+Each simulated user repeats a scenario picked by weight (SCENARIOS): a
+kiosk check-in (form, then submit), the records page, a desk checkout, a
+vendor pre-registration or a 30-day CSV export. Redirects are not followed,
+so each request is timed on its own. Requests in the first --warmup seconds
+are not counted. Reported per route: requests, errors, requests/second and
+p50/p95/p99/max latency in milliseconds.
+
+A baseline is a saved report. A route regresses if its p95 or p99 latency
+grows, or its throughput falls, by more than --tolerance (a fraction).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Form values the app accepts (see app.py)
+VISITOR_TYPES = ['Contractor', 'Family', 'Food Delivery', 'Meeting', 'Vendor']
+BRANCHES = ['Kiln Creek', '1A University']
+DEPARTMENTS = ['Retail', 'Technology', 'Facilities', 'Mortgages', 'Human Resources']
+BADGE_NUMBERS = [str(i) for i in range(56863, 56873)]
+NAMES = ['Ann', 'Bob', 'Carla', 'Dev', 'Elena', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jon', 'Kim', 'Lee']
+
+# Scenario name -> weight; each scenario is one or more requests
+SCENARIOS = {
+    'kiosk_checkin': 30,
+    'records': 25,
+    'desk_checkout': 20,
+    'vendor_preregister': 15,
+    'export': 5,
+}
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class Recorder:
+    """Collects request latencies per route, from every user thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(int)
+        self.counting = False
+
+    def record(self, route, seconds, ok):
+        if not self.counting:
+            return
+        with self._lock:
+            self._latencies[route].append(seconds)
+            if not ok:
+                self._errors[route] += 1
+
+    def report(self, elapsed):
+        """Returns {'duration', 'requests', 'throughput', 'routes': {route: figures}}."""
+        routes = {}
+        with self._lock:
+            for route, latencies in sorted(self._latencies.items()):
+                ordered = sorted(latencies)
+                routes[route] = {
+                    'requests': len(ordered),
+                    'errors': self._errors[route],
+                    'throughput': round(len(ordered) / elapsed, 2),
+                    'p50_ms': round(_percentile(ordered, 0.50) * 1000, 1),
+                    'p95_ms': round(_percentile(ordered, 0.95) * 1000, 1),
+                    'p99_ms': round(_percentile(ordered, 0.99) * 1000, 1),
+                    'max_ms': round(ordered[-1] * 1000, 1),
+                }
+        total = sum(route['requests'] for route in routes.values())
+        return {'duration': round(elapsed, 1), 'requests': total,
+                'throughput': round(total / elapsed, 2), 'routes': routes}
+
+
+class User:
+    """One simulated kiosk or desk user with its own HTTP session."""
+
+    def __init__(self, base_url, recorder, rng):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.rng = rng
+        self.session = requests.Session()
+
+    def request(self, method, path, route=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=60, **kwargs)
+            response.content  # streamed exports: time the whole body
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record(f"{method} {route or path}", time.perf_counter() - start, ok)
+        return response
+
+    def _guest(self):
+        return {
+            'guest_first_name': self.rng.choice(NAMES),
+            'guest_last_name': f"Load{self.rng.randrange(100000)}",
+            'visitor_type': self.rng.choice(VISITOR_TYPES),
+            'branch': self.rng.choice(BRANCHES),
+            'department': self.rng.choice(DEPARTMENTS),
+            'here_to_see': self.rng.choice(NAMES) + ' Host',
+            'vendor_name': 'Acme Supply',
+        }
+
+    def kiosk_checkin(self):
+        self.request('GET', '/internal-checkin')
+        # Most kiosk visitors take no badge; the rest contend for the real badge pool
+        badge = self.rng.choice(BADGE_NUMBERS) if self.rng.random() < 0.3 else 'No Badge'
+        self.request('POST', '/internal-checkin', data=dict(self._guest(), check_in_type='immediate', badge_number=badge))
+
+    def records(self):
+        self.request('GET', '/records')
+
+    def desk_checkout(self):
+        response = self.request('GET', '/api/visitors/current')
+        if response is None or response.status_code != 200:
+            return
+        visitors = response.json().get('visitors') or []
+        if visitors:
+            visitor_id = self.rng.choice(visitors)['VisitorID']
+            self.request('POST', f"/checkout/{visitor_id}", route='/checkout/<id>')
+
+    def vendor_preregister(self):
+        self.request('GET', '/vendor-portal')
+        when = datetime.now() + timedelta(days=1, minutes=self.rng.randrange(600))
+        self.request('POST', '/vendor-portal', data=dict(self._guest(), advance_checkin_time=when.strftime('%Y-%m-%dT%H:%M')))
+
+    def export(self):
+        today = datetime.now().date()
+        self.request('POST', '/export-csv', data={
+            'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat()})
+
+    def run(self, stop_at):
+        names, weights = list(SCENARIOS), list(SCENARIOS.values())
+        while time.monotonic() < stop_at:
+            getattr(self, self.rng.choices(names, weights)[0])()
+
+
+# --- Stand-ins: mock webhook, seeded SQLite database and gunicorn ---
+
+class MockWebhook(ThreadingHTTPServer):
+    """Accepts Teams webhook posts on localhost and counts them."""
+
+    daemon_threads = True
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+        super().__init__(('127.0.0.1', 0), _WebhookHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/webhook"
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.delay)
+        self.server.received += 1
+        self.send_response(200)
+        self.send_header('Content-Length', '1')
+        self.end_headers()
+        self.wfile.write(b'1')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def standin_env(workdir, webhook_url):
+    """Environment for an app that only touches `workdir` and the mock webhook."""
+    env = dict(os.environ)
+    env.update({
+        'DB_BACKEND': 'sqlite',
+        'SQLITE_PATH': os.path.join(workdir, 'loadtest.db'),
+        'CACHE_VERSION_FILE': os.path.join(workdir, 'cache.version'),
+        'EVENTS_FILE': os.path.join(workdir, 'events.log'),
+        'NOTIFICATION_SPOOL_DIR': os.path.join(workdir, 'notification_spool'),
+        'TEAMS_WEBHOOK_URL': webhook_url,
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    env.pop('DB_REPLICA_BACKEND', None)
+    env.pop('SQLITE_REPLICA_PATH', None)
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    return env
+
+def seed_database(env, days, visits_per_day=40, seed=0):
+    """Creates the schema and `days` of checked-out history, so the records page and exports have data."""
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        import migrations
+        from db_backends import backend_from_env
+        backend = backend_from_env()
+        table = backend.table_name(os.getenv('DB_TABLE'))
+        conn = backend.connect(table)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    rng = random.Random(seed)
+    try:
+        migrations.upgrade(conn, backend, table)
+        rows = []
+        today = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        for day in range(days, 0, -1):
+            for _ in range(visits_per_day):
+                check_in = today - timedelta(days=day, minutes=-rng.randrange(600))
+                rows.append((
+                    rng.choice(NAMES), f"Seed{rng.randrange(100000)}", rng.choice(VISITOR_TYPES),
+                    rng.choice(BRANCHES), rng.choice(DEPARTMENTS), 'Acme Supply', 'No Badge',
+                    rng.choice(NAMES) + ' Host', check_in, check_in + timedelta(minutes=rng.randrange(5, 240)),
+                    'CheckedOut', 'Manual',
+                ))
+        cursor = conn.cursor()
+        backend.executemany(cursor, f"""
+            INSERT INTO {table} (
+                GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited, VendorName,
+                BadgeNumber, HostEmployeeName, CheckInTime, CheckOutTime, Status, CheckOutReason
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.commit()
+        cursor.close()
+        return len(rows)
+    finally:
+        conn.close()
+
+def start_app(env, workers, threads, log_path):
+    """Starts gunicorn on a free local port; returns (process, base URL)."""
+    port = _free_port()
+    log = open(log_path, 'ab')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--worker-class', 'gthread',
+         '--threads', str(threads), '--config', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{port}", 'wsgi:app'],
+        cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}; see {log_path}")
+        try:
+            requests.get(base_url + '/', timeout=2)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not answer within 30s; see {log_path}")
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# --- Running and reporting ---
+
+def run_load(base_url, users, duration, warmup, seed=0):
+    """Runs `users` threads for warmup + duration seconds; returns the report."""
+    recorder = Recorder()
+    stop_at = time.monotonic() + warmup + duration
+    threads = [
+        threading.Thread(target=User(base_url, recorder, random.Random(seed + i)).run, args=(stop_at,), daemon=True)
+        for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    recorder.counting = True
+    started = time.monotonic()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.monotonic() - started)
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['duration']}s: {report['throughput']} req/s")
+    print(f"{'route':<28} {'reqs':>6} {'errs':>5} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for route, figures in report['routes'].items():
+        print(f"{route:<28} {figures['requests']:>6} {figures['errors']:>5} {figures['throughput']:>7} "
+              f"{figures['p50_ms']:>8} {figures['p95_ms']:>8} {figures['p99_ms']:>8} {figures['max_ms']:>8}")
+
+def compare(report, baseline, tolerance):
+    """Prints each route against the baseline; returns the list of regressions."""
+    regressions = []
+    print(f"\nAgainst baseline from {baseline.get('saved_at', 'unknown')} (tolerance {tolerance:.0%}):")
+    for route, figures in report['routes'].items():
+        before = baseline['routes'].get(route)
+        if not before:
+            print(f"  {route}: new route, no baseline")
+            continue
+        changes = []
+        for key in ('p95_ms', 'p99_ms'):
+            if before[key] and figures[key] > before[key] * (1 + tolerance):
+                changes.append(f"{key} {before[key]} -> {figures[key]}")
+        if before['throughput'] and figures['throughput'] < before['throughput'] * (1 - tolerance):
+            changes.append(f"throughput {before['throughput']} -> {figures['throughput']}")
+        if changes:
+            regressions.append((route, changes))
+            print(f"  REGRESSION {route}: {'; '.join(changes)}")
+        else:
+            print(f"  ok {route}: p95 {before['p95_ms']} -> {figures['p95_ms']} ms, "
+                  f"{before['throughput']} -> {figures['throughput']} req/s")
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load test the visitor tracker.", epilog=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="test a running app instead of starting one with stand-ins")
+    parser.add_argument('--users', type=int, default=20, help="concurrent simulated users (default 20)")
+    parser.add_argument('--duration', type=float, default=60, help="measured seconds (default 60)")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds before measuring (default 5)")
+    parser.add_argument('--workers', type=int, default=3, help="gunicorn workers (default 3)")
+    parser.add_argument('--threads', type=int, default=8, help="threads per worker (default 8)")
+    parser.add_argument('--seed-days', type=int, default=90, help="days of history to seed (default 90)")
+    parser.add_argument('--webhook-delay', type=float, default=0.2, help="mock webhook response time (default 0.2s)")
+    parser.add_argument('--output', help="write the report as JSON")
+    parser.add_argument('--save-baseline', metavar='PATH', help="save the report as the new baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="compare with a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed change before a regression (default 0.25)")
+    args = parser.parse_args(argv[1:])
+
+    workdir = process = webhook = None
+    try:
+        if args.url:
+            base_url = args.url
+        else:
+            workdir = tempfile.mkdtemp(prefix='visitor_tracker_loadtest_')
+            webhook = MockWebhook(args.webhook_delay)
+            threading.Thread(target=webhook.serve_forever, daemon=True).start()
+            env = standin_env(workdir, webhook.url)
+            seeded = seed_database(env, args.seed_days)
+            process, base_url = start_app(env, args.workers, args.threads, os.path.join(workdir, 'gunicorn.log'))
+            print(f"Started {args.workers} worker(s) x {args.threads} thread(s) on {base_url} "
+                  f"with {seeded} seeded visits (work directory {workdir})")
+        print(f"Running {args.users} user(s) for {args.duration}s after a {args.warmup}s warmup...")
+        report = run_load(base_url, args.users, args.duration, args.warmup)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        if webhook:
+            webhook.shutdown()
+
+    report['config'] = {name: getattr(args, name) for name in ('users', 'duration', 'workers', 'threads', 'seed_days')}
+    report['config']['url'] = args.url or 'stand-ins'
+    if webhook:
+        report['webhook_posts'] = webhook.received
+    print_report(report)
+    if webhook:
+        print(f"Mock webhook received {webhook.received} notification(s)")
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(dict(report, saved_at=datetime.now().isoformat(timespec='seconds')), f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    errors = sum(route['errors'] for route in report['routes'].values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
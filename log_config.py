@@ -0,0 +1,137 @@
+# log_config.py
+"""Logging setup shared by the app and the command-line tools.
+
+Request threads only put log records on an in-memory queue; one listener
+thread per process formats them and writes them out. Records are JSON
+objects (one per line) by default, so journald and log shippers can index
+the fields.
+
+Settings:
+    LOG_LEVEL   root level (default INFO)
+    LOG_LEVELS  per-logger levels, e.g. 'database=WARNING,notifications=DEBUG'
+    LOG_SAMPLE  fraction of INFO/DEBUG records kept per logger, e.g. 'database.reads=0.1'
+                (warnings and errors are never dropped)
+    LOG_FORMAT  'json' or 'text'
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+
+# Chatty loggers kept at a sample unless LOG_SAMPLE says otherwise
+DEFAULT_SAMPLE = 'database.reads=0.1'
+
+# LogRecord attributes that are not `extra=` fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+def _parse_pairs(spec):
+    """'a=1,b=2' -> {'a': '1', 'b': '2'}"""
+    pairs = {}
+    for entry in spec.split(','):
+        if '=' in entry:
+            name, value = entry.split('=', 1)
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object, including any `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the INFO and DEBUG records from the configured loggers."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates  # logger name -> fraction kept
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return rate >= 1 or random.random() < rate
+            name = name.rpartition('.')[0]
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them first.
+
+    The stock QueueHandler renders the message on the calling thread so the
+    record can be pickled; this queue never leaves the process, so the
+    %-formatting is left to the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+def configure_logging(default_format='json'):
+    """Routes all logging through a queue to a listener thread. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_format = os.getenv('LOG_FORMAT', default_format).lower()
+    output = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+
+    rates = {name: float(rate) for name, rate in _parse_pairs(os.getenv('LOG_SAMPLE', DEFAULT_SAMPLE)).items()}
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(SamplingFilter(rates))  # dropped records never reach the queue
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in _parse_pairs(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop)
+    # A forked child (e.g. gunicorn --preload) has the queue but not the listener thread
+    os.register_at_fork(after_in_child=_restart)
+
+def _stop():
+    """Flushes queued records; runs at exit."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def _restart():
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
@@ -0,0 +1,103 @@
+# metrics.py
+"""Prometheus metrics for the app, the database layer and notifications.
+
+Under gunicorn each worker records into files in PROMETHEUS_MULTIPROC_DIR
+(set in the systemd unit, cleaned by gunicorn.conf.py) and /metrics adds
+up the files of every worker. Without that variable, as with `flask run`,
+metrics stay in the process.
+"""
+import os
+import time
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+
+
+# Database calls are mostly a few milliseconds, so start the buckets lower than the defaults
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Messages the database functions return when the database itself failed,
+# as opposed to an expected outcome such as "Visitor not found"
+DB_ERROR_PREFIXES = ('Database connection failed', 'Database error', 'An unexpected error')
+
+REQUEST_LATENCY = Histogram(
+    'visitor_tracker_http_request_duration_seconds', 'Time to handle a request, by route',
+    ['method', 'route', 'status'])
+REQUESTS_IN_FLIGHT = Gauge(
+    'visitor_tracker_http_requests_in_flight', 'Requests being handled by each worker',
+    multiprocess_mode='liveall')
+
+DB_LATENCY = Histogram(
+    'visitor_tracker_db_call_duration_seconds', 'Time spent in each database.py function',
+    ['function'], buckets=DB_BUCKETS)
+DB_ERRORS = Counter(
+    'visitor_tracker_db_call_errors_total', 'database.py calls that failed with a database error',
+    ['function'])
+DB_POOL_ACQUIRE = Histogram(
+    'visitor_tracker_db_pool_acquire_duration_seconds', 'Time waiting for a pooled connection',
+    buckets=DB_BUCKETS)
+DB_POOL_FAILURES = Counter(
+    'visitor_tracker_db_pool_acquire_failures_total', 'Requests that got no connection (timeout or connect error)')
+
+NOTIFICATION_LATENCY = Histogram(
+    'visitor_tracker_notification_send_duration_seconds', 'Time to post a card to the Teams webhook')
+NOTIFICATIONS = Counter(
+    'visitor_tracker_notifications_total', 'Teams notification attempts by outcome',
+    ['outcome'])  # sent, retry, failed
+
+
+def timed_db_call(func):
+    """Records the latency of a database.py function and counts calls that return a database error."""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.labels(name).inc()
+            raise
+        finally:
+            DB_LATENCY.labels(name).observe(time.perf_counter() - start)
+        if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], str) \
+                and result[1].startswith(DB_ERROR_PREFIXES):
+            DB_ERRORS.labels(name).inc()
+        return result
+    return wrapper
+
+
+def instrument_app(app):
+    """Adds per-route latency and in-flight tracking to a Flask app."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _record_latency(response):
+        if 'metrics_start' in g:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(
+                time.perf_counter() - g.metrics_start)
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        if g.pop('metrics_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+def render():
+    """Returns (body, content type) for the /metrics endpoint."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,476 @@
+# migrations.py
+"""Versioned schema migrations for the visitor table and its indexes.
+
+Usage:
+    python migrations.py status     # show applied and pending migrations
+    python migrations.py upgrade    # apply pending migrations
+    python migrations.py plans      # show query plans for the hot queries
+
+SQL Server schemas are upgraded by running this script; the embedded SQLite
+backend upgrades itself when the app first connects.
+"""
+import sys
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+
+VERSION_TABLE = 'SchemaVersion'
+
+# Tables stored next to the visitor table, named after it (see companion_table)
+VISIT_ROLLUP_SUFFIX = '_VisitRollup'
+OCCUPANCY_ROLLUP_SUFFIX = '_OccupancyRollup'
+ARCHIVE_SUFFIX = '_Archive'
+
+# Columns the list pages and the desk snapshot read, so their indexes can cover them
+_LIST_COLUMNS = (
+    "VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited, "
+    "VendorName, BadgeNumber, HostEmployeeName, Comments, CheckOutTime"
+)
+_PENDING_COLUMNS = (
+    "VisitorID, GuestFirstName, GuestLastName, VisitorType, Branch, DepartmentVisited, "
+    "VendorName, BadgeNumber, HostEmployeeName, Comments, SubmissionTime, ColleagueFirstName, ColleagueLastName"
+)
+
+# (version, description, {backend name: [statements]}). Statements are formatted
+# with {table} (full table name), {name} (table name without schema, for index
+# names) and the companion tables {visit_rollup}, {occupancy_rollup} and {archive}.
+MIGRATIONS = [
+    (1, "Create visitor table", {
+        'sqlserver': ["""
+            IF OBJECT_ID(N'{table}', N'U') IS NULL
+            CREATE TABLE {table} (
+                VisitorID INT IDENTITY(1,1) NOT NULL PRIMARY KEY,
+                GuestFirstName NVARCHAR(100),
+                GuestLastName NVARCHAR(100),
+                VisitorType NVARCHAR(50),
+                Branch NVARCHAR(100),
+                DepartmentVisited NVARCHAR(100),
+                VendorName NVARCHAR(200),
+                BadgeNumber NVARCHAR(20),
+                HostEmployeeName NVARCHAR(200),
+                Comments NVARCHAR(MAX),
+                CheckInTime DATETIME,
+                CheckOutTime DATETIME,
+                Status NVARCHAR(20),
+                ColleagueFirstName NVARCHAR(100),
+                ColleagueLastName NVARCHAR(100),
+                AdvanceCheckInTime DATETIME,
+                SubmissionTime DATETIME,
+                IsAdvanceCheckIn BIT,
+                SubmitterIPAddress NVARCHAR(45)
+            )
+        """],
+        'sqlite': ["""
+            CREATE TABLE IF NOT EXISTS {table} (
+                VisitorID INTEGER PRIMARY KEY AUTOINCREMENT,
+                GuestFirstName TEXT,
+                GuestLastName TEXT,
+                VisitorType TEXT,
+                Branch TEXT,
+                DepartmentVisited TEXT,
+                VendorName TEXT,
+                BadgeNumber TEXT,
+                HostEmployeeName TEXT,
+                Comments TEXT,
+                CheckInTime TIMESTAMP,
+                CheckOutTime TIMESTAMP,
+                Status TEXT,
+                ColleagueFirstName TEXT,
+                ColleagueLastName TEXT,
+                AdvanceCheckInTime TIMESTAMP,
+                SubmissionTime TIMESTAMP,
+                IsAdvanceCheckIn BOOLEAN,
+                SubmitterIPAddress TEXT
+            )
+        """],
+    }),
+    (2, "Indexes for checked-in, pending and check-in time queries", {
+        'sqlserver': [
+            # Desk snapshot / visitor count: Status = 'CheckedIn' ORDER BY CheckInTime DESC
+            f"""
+            CREATE NONCLUSTERED INDEX IX_{{name}}_CheckedIn ON {{table}} (CheckInTime DESC)
+            INCLUDE ({_LIST_COLUMNS}, Status)
+            WHERE Status = 'CheckedIn'
+            """,
+            # Badge reservation: BadgeNumber = ? AND Status = 'CheckedIn'
+            """
+            CREATE NONCLUSTERED INDEX IX_{name}_CheckedInBadge ON {table} (BadgeNumber)
+            WHERE Status = 'CheckedIn'
+            """,
+            # Pending list: Status = 'Pending' ORDER BY AdvanceCheckInTime
+            f"""
+            CREATE NONCLUSTERED INDEX IX_{{name}}_Pending ON {{table}} (AdvanceCheckInTime)
+            INCLUDE ({_PENDING_COLUMNS}, Status)
+            WHERE Status = 'Pending'
+            """,
+            # History pages and date-range exports: CheckInTime range, newest first
+            f"""
+            CREATE NONCLUSTERED INDEX IX_{{name}}_CheckInTime ON {{table}} (CheckInTime DESC, VisitorID DESC)
+            INCLUDE ({_LIST_COLUMNS}, Status)
+            """,
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS IX_{name}_CheckedIn ON {table} (CheckInTime DESC) WHERE Status = 'CheckedIn'",
+            "CREATE INDEX IF NOT EXISTS IX_{name}_CheckedInBadge ON {table} (BadgeNumber) WHERE Status = 'CheckedIn'",
+            "CREATE INDEX IF NOT EXISTS IX_{name}_Pending ON {table} (AdvanceCheckInTime) WHERE Status = 'Pending'",
+            "CREATE INDEX IF NOT EXISTS IX_{name}_CheckInTime ON {table} (CheckInTime DESC, VisitorID DESC)",
+        ],
+    }),
+    (3, "Record why a visitor was checked out", {
+        'sqlserver': ["""
+            IF COL_LENGTH(N'{table}', 'CheckOutReason') IS NULL
+            ALTER TABLE {table} ADD CheckOutReason NVARCHAR(50)
+        """],
+        'sqlite': ["ALTER TABLE {table} ADD COLUMN CheckOutReason TEXT"],
+    }),
+    (4, "Index for returning-visitor lookups by name", {
+        'sqlserver': [
+            # get_last_visit: GuestLastName = ? AND GuestFirstName = ? ORDER BY VisitorID DESC
+            """
+            CREATE NONCLUSTERED INDEX IX_{name}_GuestName ON {table} (GuestLastName, GuestFirstName, VisitorID DESC)
+            INCLUDE (VisitorType, Branch, DepartmentVisited, VendorName, HostEmployeeName, CheckInTime)
+            """,
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS IX_{name}_GuestName ON {table} "
+            "(GuestLastName COLLATE NOCASE, GuestFirstName COLLATE NOCASE, VisitorID DESC)",
+        ],
+    }),
+    (5, "Hourly and daily visit rollups", {
+        # Grain is 'H' (PeriodStart on the hour) or 'D' (at midnight); see rollups.py
+        'sqlserver': [
+            """
+            IF OBJECT_ID(N'{visit_rollup}', N'U') IS NULL
+            CREATE TABLE {visit_rollup} (
+                Grain CHAR(1) NOT NULL,
+                PeriodStart DATETIME NOT NULL,
+                Branch NVARCHAR(100) NOT NULL,
+                DepartmentVisited NVARCHAR(100) NOT NULL,
+                VisitorType NVARCHAR(50) NOT NULL,
+                CheckIns INT NOT NULL,
+                CompletedVisits INT NOT NULL,
+                DwellSeconds BIGINT NOT NULL,
+                CONSTRAINT PK_{name}_VisitRollup PRIMARY KEY (Grain, PeriodStart, Branch, DepartmentVisited, VisitorType)
+            )
+            """,
+            """
+            IF OBJECT_ID(N'{occupancy_rollup}', N'U') IS NULL
+            CREATE TABLE {occupancy_rollup} (
+                Grain CHAR(1) NOT NULL,
+                PeriodStart DATETIME NOT NULL,
+                Branch NVARCHAR(100) NOT NULL,
+                PeakOccupancy INT NOT NULL,
+                CONSTRAINT PK_{name}_OccupancyRollup PRIMARY KEY (Grain, PeriodStart, Branch)
+            )
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS {visit_rollup} (
+                Grain TEXT NOT NULL,
+                PeriodStart TIMESTAMP NOT NULL,
+                Branch TEXT NOT NULL,
+                DepartmentVisited TEXT NOT NULL,
+                VisitorType TEXT NOT NULL,
+                CheckIns INTEGER NOT NULL,
+                CompletedVisits INTEGER NOT NULL,
+                DwellSeconds INTEGER NOT NULL,
+                PRIMARY KEY (Grain, PeriodStart, Branch, DepartmentVisited, VisitorType)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS {occupancy_rollup} (
+                Grain TEXT NOT NULL,
+                PeriodStart TIMESTAMP NOT NULL,
+                Branch TEXT NOT NULL,
+                PeakOccupancy INTEGER NOT NULL,
+                PRIMARY KEY (Grain, PeriodStart, Branch)
+            )
+            """,
+        ],
+    }),
+    (6, "Archive table for closed visits", {
+        # Same columns as the visitor table, keeping each visit's VisitorID; see archive.py.
+        # Page compression keeps years of history small (SQL Server 2016 SP1 or later).
+        'sqlserver': [
+            """
+            IF OBJECT_ID(N'{archive}', N'U') IS NULL
+            CREATE TABLE {archive} (
+                VisitorID INT NOT NULL,
+                GuestFirstName NVARCHAR(100),
+                GuestLastName NVARCHAR(100),
+                VisitorType NVARCHAR(50),
+                Branch NVARCHAR(100),
+                DepartmentVisited NVARCHAR(100),
+                VendorName NVARCHAR(200),
+                BadgeNumber NVARCHAR(20),
+                HostEmployeeName NVARCHAR(200),
+                Comments NVARCHAR(MAX),
+                CheckInTime DATETIME,
+                CheckOutTime DATETIME,
+                Status NVARCHAR(20),
+                ColleagueFirstName NVARCHAR(100),
+                ColleagueLastName NVARCHAR(100),
+                AdvanceCheckInTime DATETIME,
+                SubmissionTime DATETIME,
+                IsAdvanceCheckIn BIT,
+                SubmitterIPAddress NVARCHAR(45),
+                CheckOutReason NVARCHAR(50),
+                CONSTRAINT PK_{name}_Archive PRIMARY KEY (VisitorID)
+            ) WITH (DATA_COMPRESSION = PAGE)
+            """,
+            # Date-range exports across both tiers
+            """
+            CREATE NONCLUSTERED INDEX IX_{name}_ArchiveCheckInTime ON {archive} (CheckInTime DESC, VisitorID DESC)
+            WITH (DATA_COMPRESSION = PAGE)
+            """,
+        ],
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS {archive} (
+                VisitorID INTEGER PRIMARY KEY,
+                GuestFirstName TEXT,
+                GuestLastName TEXT,
+                VisitorType TEXT,
+                Branch TEXT,
+                DepartmentVisited TEXT,
+                VendorName TEXT,
+                BadgeNumber TEXT,
+                HostEmployeeName TEXT,
+                Comments TEXT,
+                CheckInTime TIMESTAMP,
+                CheckOutTime TIMESTAMP,
+                Status TEXT,
+                ColleagueFirstName TEXT,
+                ColleagueLastName TEXT,
+                AdvanceCheckInTime TIMESTAMP,
+                SubmissionTime TIMESTAMP,
+                IsAdvanceCheckIn BOOLEAN,
+                SubmitterIPAddress TEXT,
+                CheckOutReason TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS IX_{name}_ArchiveCheckInTime ON {archive} (CheckInTime DESC, VisitorID DESC)",
+        ],
+    }),
+    (7, "Index for returning-visitor lookups in the archive", {
+        'sqlserver': [
+            # get_last_visit falls back to the archive for guests not seen since ARCHIVE_AFTER_DAYS
+            """
+            CREATE NONCLUSTERED INDEX IX_{name}_ArchiveGuestName ON {archive} (GuestLastName, GuestFirstName, VisitorID DESC)
+            INCLUDE (VisitorType, Branch, DepartmentVisited, VendorName, HostEmployeeName, CheckInTime)
+            WITH (DATA_COMPRESSION = PAGE)
+            """,
+        ],
+        'sqlite': [
+            "CREATE INDEX IF NOT EXISTS IX_{name}_ArchiveGuestName ON {archive} "
+            "(GuestLastName COLLATE NOCASE, GuestFirstName COLLATE NOCASE, VisitorID DESC)",
+        ],
+    }),
+]
+
+# Representative shapes of the queries in database.py, for `plans`
+HOT_QUERIES = [
+    ("get_desk_snapshot / checked in",
+     "SELECT VisitorID, BadgeNumber, CheckInTime FROM {table} WHERE Status = 'CheckedIn' ORDER BY CheckInTime DESC", ()),
+    ("get_current_visitor_count",
+     "SELECT COUNT(*) FROM {table} WHERE Status = 'CheckedIn'", ()),
+    ("add_visitor badge check",
+     "SELECT 1 FROM {table} WHERE BadgeNumber = ? AND Status = 'CheckedIn'", ('56863',)),
+    ("get_pending_visitors",
+     "SELECT VisitorID, GuestLastName, AdvanceCheckInTime FROM {table} WHERE Status = 'Pending' ORDER BY AdvanceCheckInTime ASC", ()),
+    ("get_visitor_page",
+     "SELECT VisitorID, GuestLastName, CheckInTime FROM {table} WHERE Status != 'Pending' "
+     "AND (CheckInTime < ? OR (CheckInTime = ? AND VisitorID < ?)) ORDER BY CheckInTime DESC, VisitorID DESC",
+     ('2030-01-01', '2030-01-01', 0)),
+    ("get_visitors_by_date_range",
+     "SELECT VisitorID, GuestLastName, CheckInTime FROM {table} WHERE CheckInTime BETWEEN ? AND ? ORDER BY CheckInTime DESC",
+     ('2025-01-01', '2025-02-01')),
+    ("checkout_stale_visitors",
+     "SELECT VisitorID FROM {table} WHERE Status = 'CheckedIn' AND Branch = ? AND CheckInTime < ?",
+     ('Kiln Creek', '2025-01-01')),
+    ("get_visitor_by_id",
+     "SELECT VisitorID, GuestLastName, Status FROM {table} WHERE VisitorID = ?", (1,)),
+    ("get_last_visit",
+     "SELECT VisitorID, VisitorType, HostEmployeeName FROM {table} "
+     "WHERE GuestLastName{nocase} = ? AND GuestFirstName{nocase} = ? ORDER BY VisitorID DESC",
+     ('Lee', 'Ann')),
+    ("archive_closed_visitors",
+     "SELECT VisitorID FROM {table} WHERE CheckInTime < ? AND Status = 'CheckedOut' ORDER BY CheckInTime, VisitorID",
+     ('2025-01-01',)),
+    ("get_last_visit / archive",
+     "SELECT VisitorID, VisitorType, HostEmployeeName FROM {archive} "
+     "WHERE GuestLastName{nocase} = ? AND GuestFirstName{nocase} = ? ORDER BY VisitorID DESC",
+     ('Lee', 'Ann')),
+    ("get_visitors_by_date_range / archive",
+     "SELECT VisitorID, GuestLastName, CheckInTime FROM {archive} WHERE CheckInTime BETWEEN ? AND ? ORDER BY CheckInTime DESC",
+     ('2025-01-01', '2025-02-01')),
+    ("get_visit_rollups",
+     "SELECT PeriodStart, Branch, CheckIns FROM {visit_rollup} WHERE Grain = ? AND PeriodStart >= ? AND PeriodStart < ?",
+     ('D', '2025-01-01', '2025-02-01')),
+]
+
+
+def companion_table(table, suffix):
+    """'dbo.VisitorInteractions' -> 'dbo.VisitorInteractions<suffix>', keeping any [brackets].
+
+    None (DB_TABLE not set) stays None; create_connection reports the missing setting.
+    """
+    if table is None:
+        return None
+    if table.endswith(']'):
+        return table[:-1] + suffix + ']'
+    return table + suffix
+
+def _format(statement, table, **extra):
+    return statement.format(
+        table=table, name=table.split('.')[-1].strip('[]'),
+        visit_rollup=companion_table(table, VISIT_ROLLUP_SUFFIX),
+        occupancy_rollup=companion_table(table, OCCUPANCY_ROLLUP_SUFFIX),
+        archive=companion_table(table, ARCHIVE_SUFFIX),
+        **extra)
+
+def _ensure_version_table(cursor, backend):
+    if backend.name == 'sqlserver':
+        cursor.execute(f"""
+            IF OBJECT_ID(N'{VERSION_TABLE}', N'U') IS NULL
+            CREATE TABLE {VERSION_TABLE} (
+                Version INT NOT NULL PRIMARY KEY,
+                Description NVARCHAR(200),
+                AppliedAt DATETIME NOT NULL DEFAULT GETDATE()
+            )
+        """)
+    else:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+                Version INTEGER NOT NULL PRIMARY KEY,
+                Description TEXT,
+                AppliedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+def _lock(cursor, backend):
+    """Serialises concurrent upgrades (several workers or admins) until commit."""
+    if backend.name == 'sqlserver':
+        cursor.execute("EXEC sp_getapplock @Resource = 'visitor_tracker_migrations', "
+                       "@LockMode = 'Exclusive', @LockOwner = 'Transaction'")
+    else:
+        cursor.execute("BEGIN IMMEDIATE")
+
+def applied_versions(cursor):
+    cursor.execute(f"SELECT Version FROM {VERSION_TABLE}")
+    return {row[0] for row in cursor.fetchall()}
+
+def upgrade(conn, backend, table):
+    """Applies every pending migration, each in its own transaction. Returns the versions applied."""
+    cursor = conn.cursor()
+    applied = []
+    try:
+        _ensure_version_table(cursor, backend)
+        conn.commit()
+        for version, description, steps in MIGRATIONS:
+            _lock(cursor, backend)
+            if version in applied_versions(cursor):
+                conn.commit()
+                continue
+            logger.info("Applying migration %s: %s", version, description)
+            for statement in steps[backend.name]:
+                cursor.execute(_format(statement, table))
+            cursor.execute(f"INSERT INTO {VERSION_TABLE} (Version, Description) VALUES (?, ?)", (version, description))
+            conn.commit()
+            applied.append(version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return applied
+
+def status(conn, backend):
+    """Returns [(version, description, applied?)]."""
+    cursor = conn.cursor()
+    try:
+        _ensure_version_table(cursor, backend)
+        conn.commit()
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    return [(version, description, version in done) for version, description, _ in MIGRATIONS]
+
+
+def _sqlserver_plan(cursor, sql, params):
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        cursor.execute(sql, params) if params else cursor.execute(sql)
+        plan_xml = cursor.fetchone()[0]
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+    root = ET.fromstring(plan_xml)
+    steps = []
+    for element in root.iter():
+        if element.tag.endswith('}RelOp'):
+            operator = element.get('PhysicalOp')
+            index = next((child.get('Index') for child in element.iter()
+                          if child.tag.endswith('}Object') and child.get('Index')), None)
+            steps.append(f"{operator} {index}" if index else operator)
+    return steps
+
+def _sqlite_plan(cursor, sql, params):
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[3] for row in cursor.fetchall()]
+
+def explain(conn, backend, table):
+    """Returns [(query name, plan steps, scans the whole table?)] for HOT_QUERIES."""
+    cursor = conn.cursor()
+    results = []
+    try:
+        for name, sql, params in HOT_QUERIES:
+            sql = _format(sql, table, nocase=backend.nocase)
+            if backend.name == 'sqlserver':
+                steps = _sqlserver_plan(cursor, sql, params)
+                # Scanning a filtered index only reads matching rows, so only whole-table scans count
+                scans = any(step.startswith(('Table Scan', 'Clustered Index Scan')) for step in steps)
+            else:
+                steps = _sqlite_plan(cursor, sql, params)
+                scans = any(step.startswith('SCAN') and 'USING' not in step for step in steps)
+            results.append((name, steps, scans))
+    finally:
+        cursor.close()
+    return results
+
+
+def main(argv):
+    import database  # imported here so the app can import this module without a cycle
+    import log_config
+
+    log_config.configure_logging(default_format='text')
+
+    command = argv[1] if len(argv) > 1 else 'status'
+    conn = database.create_connection()
+    if not conn:
+        print("Database connection failed")
+        return 1
+    try:
+        if command == 'upgrade':
+            applied = upgrade(conn, database.backend, database.DB_TABLE)
+            print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+        elif command == 'status':
+            for version, description, done in status(conn, database.backend):
+                print(f"{version:>3}  {'applied' if done else 'PENDING'}  {description}")
+        elif command == 'plans':
+            for name, steps, scans in explain(conn, database.backend, database.DB_TABLE):
+                print(f"{name}: {'FULL TABLE SCAN' if scans else 'uses index'}")
+                for step in steps:
+                    print(f"    {step}")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
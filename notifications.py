@@ -1,26 +1,54 @@
 # still need webhook created, don't have access/permission
 import requests
 import os
+import json
+import time
+import uuid
+import heapq
+import queue
 import logging
+import threading
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from datetime import datetime
 
+import metrics
+
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 TEAMS_WEBHOOK_URL = os.getenv('TEAMS_WEBHOOK_URL', 'YOUR_PLACEHOLDER_WEBHOOK_URL_HERE')
 
-def send_teams_notification(visitor_data):
-    """Sends a notification card to a Teams channel via webhook."""
+# Background delivery settings
+NOTIFICATION_SPOOL_DIR = os.getenv(
+    'NOTIFICATION_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'notification_spool'))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '8'))
+NOTIFICATION_RETRY_BASE = float(os.getenv('NOTIFICATION_RETRY_BASE', '2'))  # seconds; doubles on each retry
+NOTIFICATION_RETRY_MAX = float(os.getenv('NOTIFICATION_RETRY_MAX', '300'))  # cap on the delay between retries
+NOTIFICATION_TIMEOUT = float(os.getenv('NOTIFICATION_TIMEOUT', '10'))
 
-    if not TEAMS_WEBHOOK_URL or TEAMS_WEBHOOK_URL == 'YOUR_PLACEHOLDER_WEBHOOK_URL_HERE':
-        logging.warning("TEAMS_WEBHOOK_URL not configured or is placeholder. Skipping notification.")
-        print("--- Skipping Teams Notification (Webhook URL not set) ---") # Add console message for clarity during testing
-        return False # Indicate skipped/failed
+# One session per process so webhook calls reuse TLS connections
+_session = None
+_session_pid = None
 
-    # Create the Adaptive Card payload
-    card_payload = {
+def _get_session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        _session_pid = os.getpid()
+    return _session
+
+def webhook_configured():
+    return bool(TEAMS_WEBHOOK_URL) and TEAMS_WEBHOOK_URL != 'YOUR_PLACEHOLDER_WEBHOOK_URL_HERE'
+
+def build_card_payload(visitor_data, arrived_at=None):
+    """Builds the Adaptive Card message for a visitor check-in."""
+    arrived_at = arrived_at or datetime.now()
+    return {
         "type": "message",
         "attachments": [
             {
@@ -50,10 +78,10 @@ def send_teams_notification(visitor_data):
                                 { "title": "Type:", "value": visitor_data.get('VisitorType', 'N/A') },
                                 { "title": "Branch:", "value": visitor_data.get('Branch', 'N/A') },
                                 { "title": "Badge:", "value": visitor_data.get('BadgeNumber', 'N/A') },
-                                { "title": "Time:", "value": datetime.now().strftime('%Y-%m-%d %H:%M:%S') }
+                                { "title": "Time:", "value": arrived_at.strftime('%Y-%m-%d %H:%M:%S') }
                             ]
                         }
-                        # Add comments if they exist 
+                        # Add comments if they exist
                     ] + ([
                         {
                             "type": "TextBlock",
@@ -73,26 +101,253 @@ def send_teams_notification(visitor_data):
         ]
     }
 
+def _post_card(card_payload):
+    """Posts a card to the webhook; raises requests exceptions on failure."""
     headers = {'Content-Type': 'application/json'}
+    with metrics.NOTIFICATION_LATENCY.time():
+        response = _get_session().post(TEAMS_WEBHOOK_URL, headers=headers, json=card_payload, timeout=NOTIFICATION_TIMEOUT)
+    response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+    return response
+
+def send_teams_notification(visitor_data):
+    """Sends a notification card to a Teams channel via webhook."""
+
+    if not webhook_configured():
+        logger.warning("TEAMS_WEBHOOK_URL not configured or is placeholder. Skipping notification.")
+        return False # Indicate skipped/failed
+
+    # Create the Adaptive Card payload
+    card_payload = build_card_payload(visitor_data)
 
     try:
-        logging.info(f"Sending Teams notification for {visitor_data.get('GuestLastName')}")
-        response = requests.post(TEAMS_WEBHOOK_URL, headers=headers, json=card_payload, timeout=10)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        logging.info(f"Teams notification sent successfully (Status code: {response.status_code}).")
-        print(f"--- Teams notification sent successfully for {visitor_data.get('GuestLastName')} ---")
+        logger.info("Sending Teams notification for %s", visitor_data.get('GuestLastName'))
+        response = _post_card(card_payload)
+        metrics.NOTIFICATIONS.labels('sent').inc()
+        logger.info("Teams notification sent successfully (Status code: %s).", response.status_code)
         return True
     except requests.exceptions.Timeout:
-        logging.error("Failed to send Teams notification: Request timed out.")
-        print("--- Failed to send Teams notification: Request timed out. ---")
+        logger.error("Failed to send Teams notification: Request timed out.")
+        metrics.NOTIFICATIONS.labels('failed').inc()
         return False
     except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send Teams notification: {e}")
-        print(f"--- Failed to send Teams notification: {e} ---") # Print error for debugging
+        logger.error("Failed to send Teams notification: %s", e)
         # also can inspect e.response.text for more details from Teams if available
         # logging.error(f"Response text: {e.response.text if e.response else 'N/A'}")
+        metrics.NOTIFICATIONS.labels('failed').inc()
         return False
     except Exception as e:
-         logging.error(f"An unexpected error occurred sending Teams notification: {e}")
-         print(f"--- An unexpected error occurred sending Teams notification: {e} ---")
-         return False
\ No newline at end of file
+         logger.error("An unexpected error occurred sending Teams notification: %s", e)
+         metrics.NOTIFICATIONS.labels('failed').inc()
+         return False
+
+
+class NotificationDispatcher:
+    """Delivers queued notifications from a background thread.
+
+    Every notification is written to the spool directory before it is queued
+    and deleted only once Teams accepts it, so nothing is lost if the worker
+    restarts. A file is claimed by renaming it to `<name>.<pid>.inflight`, which
+    keeps several gunicorn workers from sending the same spooled notification.
+    Failed sends are retried with exponential backoff; after `max_attempts` the
+    file is moved to `failed/` for someone to look at. A sent file that cannot
+    be deleted is moved to `sent/` instead.
+    """
+
+    RECOVER_INTERVAL = 60  # seconds between scans for notifications left behind by other processes
+
+    def __init__(self, spool_dir, max_attempts=8, retry_base=2, retry_max=300):
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Starts the delivery thread for this process (no-op if already running)."""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(os.path.join(self.spool_dir, 'failed'), exist_ok=True)
+            os.makedirs(os.path.join(self.spool_dir, 'sent'), exist_ok=True)
+            self._queue = queue.Queue()
+            self._retries = []  # heap of (due_time, sequence, path, attempts)
+            self._sequence = 0
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='notification-dispatcher', daemon=True).start()
+
+    def enqueue(self, card_payload, label=''):
+        """Spools a card for delivery and returns immediately. Returns False if it could not be spooled."""
+        self.start()
+        name = f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+        path = os.path.join(self.spool_dir, name)
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'label': label, 'payload': card_payload}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error("Could not spool Teams notification for %s: %s", label, e)
+            return False
+        self._queue.put(path)
+        return True
+
+    def _claim(self, path):
+        """Atomically takes ownership of a spooled file; returns the new path or None."""
+        claimed = f"{path}.{os.getpid()}.inflight"
+        try:
+            os.rename(path, claimed)
+            return claimed
+        except FileNotFoundError:
+            return None  # another worker got it first
+        except OSError as e:
+            # Left in the spool; _recover() offers it again on a later scan
+            logger.error("Could not claim spooled notification %s: %s", path, e)
+            return None
+
+    def _recover(self):
+        """Picks up spooled files left by restarted or dead processes."""
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError as e:
+            logger.error("Could not scan notification spool %s: %s", self.spool_dir, e)
+            return
+        cutoff = time.time() - self.RECOVER_INTERVAL
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith('.inflight'):
+                # <name>.json.<pid>.inflight whose owner is gone goes back in the spool
+                original, pid = name[:-len('.inflight')].rsplit('.', 1)
+                if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                    try:
+                        os.rename(path, os.path.join(self.spool_dir, original))
+                    except OSError:
+                        pass
+            elif name.endswith('.json'):
+                # Fresh files belong to the worker that wrote them
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        self._queue.put(path)
+                except OSError:
+                    pass
+
+    def _run(self):
+        self._recover()
+        next_recover = time.monotonic() + self.RECOVER_INTERVAL
+        while True:
+            try:
+                next_recover = self._run_once(next_recover)
+            except Exception as e:
+                # Keep delivering; whatever failed is retried or recovered later
+                logger.error("Notification dispatcher error: %s", e, exc_info=True)
+                time.sleep(1)
+
+    def _run_once(self, next_recover):
+        """One pass of the delivery loop; returns when the next recovery scan is due."""
+        now = time.monotonic()
+        if now >= next_recover:
+            self._recover()
+            next_recover = now + self.RECOVER_INTERVAL
+        # Wait for new work, but wake up for the next retry or recovery scan
+        wake_at = min(next_recover, self._retries[0][0]) if self._retries else next_recover
+        try:
+            path = self._queue.get(timeout=max(0.0, wake_at - time.monotonic()))
+            claimed = self._claim(path)
+            if claimed:
+                self._deliver(claimed, attempts=0)
+        except queue.Empty:
+            pass
+        while self._retries and self._retries[0][0] <= time.monotonic():
+            _, _, claimed, attempts = heapq.heappop(self._retries)
+            self._deliver(claimed, attempts)
+        return next_recover
+
+    def _deliver(self, path, attempts):
+        try:
+            with open(path) as f:
+                item = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Discarding unreadable spooled notification %s: %s", path, e)
+            self._move_to_failed(path)
+            return
+
+        label = item.get('label', '')
+        attempts += 1
+        try:
+            logger.info("Sending Teams notification for %s (attempt %s)", label, attempts)
+            response = _post_card(item['payload'])
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            permanent = status is not None and 400 <= status < 500 and status != 429
+            logger.error("Failed to send Teams notification for %s: %s", label, e)
+        except Exception as e:
+            permanent = False
+            logger.error("An unexpected error occurred sending Teams notification for %s: %s", label, e)
+        else:
+            metrics.NOTIFICATIONS.labels('sent').inc()
+            logger.info("Teams notification sent successfully (Status code: %s).", response.status_code)
+            self._remove_sent(path)  # never resent, even if this fails
+            return
+
+        if permanent or attempts >= self.max_attempts:
+            logger.error("Giving up on Teams notification for %s after %s attempt(s)", label, attempts)
+            metrics.NOTIFICATIONS.labels('failed').inc()
+            self._move_to_failed(path)
+            return
+        metrics.NOTIFICATIONS.labels('retry').inc()
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        self._sequence += 1
+        heapq.heappush(self._retries, (time.monotonic() + delay, self._sequence, path, attempts))
+
+    def _remove_sent(self, path):
+        """Deletes a delivered file, or moves it to sent/ so it is not picked up again."""
+        try:
+            os.remove(path)
+            return
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error("Could not remove sent notification %s: %s", path, e)
+        name = os.path.basename(path).split('.json')[0] + '.json'
+        try:
+            os.replace(path, os.path.join(self.spool_dir, 'sent', name))
+        except OSError as e:
+            logger.error("Could not move sent notification %s to sent/; it may be sent again after a restart: %s", path, e)
+
+    def _move_to_failed(self, path):
+        name = os.path.basename(path).split('.json')[0] + '.json'
+        try:
+            os.replace(path, os.path.join(self.spool_dir, 'failed', name))
+        except OSError as e:
+            logger.error("Could not move notification %s to failed/: %s", path, e)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+dispatcher = NotificationDispatcher(
+    NOTIFICATION_SPOOL_DIR,
+    max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+    retry_base=NOTIFICATION_RETRY_BASE,
+    retry_max=NOTIFICATION_RETRY_MAX,
+)
+
+def queue_teams_notification(visitor_data):
+    """Queues a check-in card for background delivery. Returns False if it was skipped."""
+    if not webhook_configured():
+        logger.warning("TEAMS_WEBHOOK_URL not configured or is placeholder. Skipping notification.")
+        return False
+    card_payload = build_card_payload(visitor_data)
+    return dispatcher.enqueue(card_payload, label=visitor_data.get('GuestLastName') or '')
+
+def start_dispatcher():
+    """Starts background delivery (and recovery of spooled notifications) if a webhook is configured."""
+    if webhook_configured():
+        dispatcher.start()
@@ -0,0 +1,88 @@
+# profiles.py
+"""Returning-visitor profiles for pre-filling the check-in form.
+
+A profile is what a guest gave on their most recent visit (type, host,
+department, branch and vendor), keyed by the guest's name and, optionally,
+vendor. Lookups go through a size-bounded LRU cache per worker, so regular
+contractors and vendors cost a dictionary hit rather than a query. New
+check-ins and pre-registrations from any worker replace the cached profile
+as they arrive on the event log.
+"""
+import os
+import logging
+from datetime import datetime
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1000'))  # guests remembered per worker
+
+# Columns copied from the last visit into the form
+PROFILE_FIELDS = (
+    'GuestFirstName', 'GuestLastName', 'VisitorType', 'HostEmployeeName',
+    'DepartmentVisited', 'Branch', 'VendorName',
+)
+
+
+def _normalize(value):
+    return ' '.join((value or '').split()).casefold()
+
+def profile_key(first_name, last_name, vendor_name=None):
+    """Cache key: case- and whitespace-insensitive name, plus vendor ('' for any vendor)."""
+    return _normalize(first_name), _normalize(last_name), _normalize(vendor_name)
+
+
+def _profile(visit):
+    profile = {field: visit.get(field) for field in PROFILE_FIELDS}
+    last_seen = visit.get('CheckInTime') or visit.get('AdvanceCheckInTime')
+    profile['LastVisit'] = last_seen.isoformat() if isinstance(last_seen, datetime) else last_seen
+    return profile
+
+
+class ProfileCache:
+    """Last-visit lookups for one worker.
+
+    `loader(first, last, vendor)` returns (last visit or None, error), see
+    database.get_last_visit; `bus` is the events.EventBus carrying every
+    worker's writes. "Never visited" is cached too, until that guest's first
+    check-in arrives on the bus.
+    """
+
+    def __init__(self, loader, bus, size=PROFILE_CACHE_SIZE):
+        self._loader = loader
+        self._bus = bus
+        self._cache = cache.LRUCache(size)
+        self._pid = None
+
+    def lookup(self, first_name, last_name, vendor_name=None):
+        """Returns (profile dict or None, error)."""
+        if self._pid != os.getpid():
+            self._cache.clear()  # a forked worker has not seen the parent's events
+            self._bus.add_listener(self.on_event)
+            self._pid = os.getpid()
+        key = profile_key(first_name, last_name, vendor_name)
+        if not key[0] or not key[1]:
+            return None, None
+        hit, profile = self._cache.get(key)
+        if hit:
+            return profile, None
+        visit, error = self._loader(first_name.strip(), last_name.strip(), (vendor_name or '').strip() or None)
+        if error:
+            return None, error
+        profile = _profile(visit) if visit else None
+        self._cache.set(key, profile)
+        return profile, None
+
+    def on_event(self, event):
+        """Event bus listener: the latest check-in becomes the guest's profile."""
+        if event.get('event') not in ('checkin', 'preregister'):
+            return
+        data = event.get('data') or {}
+        if not data.get('GuestFirstName') or not data.get('GuestLastName'):
+            return
+        profile = _profile(data)
+        self._cache.set(profile_key(data['GuestFirstName'], data['GuestLastName']), profile)
+        if data.get('VendorName'):
+            self._cache.set(profile_key(data['GuestFirstName'], data['GuestLastName'], data['VendorName']), profile)
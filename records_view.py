@@ -0,0 +1,120 @@
+# records_view.py
+"""View model for records.html.
+
+build() sorts the desk snapshot into the page's tables once and formats
+every value in Python, so the template no longer re-filters the rows per
+tab or calls strftime per cell. Each table row is rendered from a macro in
+_record_rows.html and kept in a small LRU cache keyed by VisitorID and the
+row's displayed values (its version): a row that has not changed since the
+last request is not rendered again.
+"""
+import os
+
+from flask import get_template_attribute
+
+import cache
+
+
+# Rendered rows kept per worker; a full page is a few hundred rows
+ROW_CACHE_SIZE = int(os.getenv('ROW_CACHE_SIZE', '2000'))
+
+TIMESTAMP_FORMAT = '%m/%d/%Y %I:%M %p'
+TIME_FORMAT = '%I:%M %p'
+
+# Status -> (badge class, label), as in statusBadges in records.html
+STATUS_BADGES = {
+    'CheckedIn': ('bg-success', 'Checked In'),
+    'CheckedOut': ('bg-secondary', 'Checked Out'),
+    'Pending': ('bg-info', 'Pending'),
+}
+
+
+def format_timestamp(value, fmt=TIMESTAMP_FORMAT):
+    return value.strftime(fmt) if value else 'N/A'
+
+
+class RowCache:
+    """LRU cache of rendered table rows."""
+
+    def __init__(self, size):
+        self._rows = cache.LRUCache(size)
+
+    def render(self, macro, row):
+        """Returns the macro's HTML for `row`, rendering it only if this version is not cached."""
+        key = (macro, row['VisitorID'], tuple(row.values()))
+        hit, html = self._rows.get(key)
+        if not hit:
+            html = self._render(macro, row)
+            self._rows.set(key, html)
+        return html
+
+    @staticmethod
+    def _render(macro, row):
+        return get_template_attribute('_record_rows.html', macro)(row)
+
+    def clear(self):
+        self._rows.clear()
+
+
+row_cache = RowCache(ROW_CACHE_SIZE)
+
+
+def _visitor_fields(visitor):
+    return {
+        'VisitorID': visitor['VisitorID'],
+        'GuestFirstName': visitor['GuestFirstName'],
+        'GuestLastName': visitor['GuestLastName'],
+        'VisitorType': visitor['VisitorType'],
+        'HostEmployeeName': visitor['HostEmployeeName'],
+        'DepartmentVisited': visitor['DepartmentVisited'],
+        'Branch': visitor['Branch'],
+    }
+
+def current_row(visitor):
+    row = _visitor_fields(visitor)
+    row['BadgeNumber'] = visitor['BadgeNumber']
+    row['CheckInTime'] = format_timestamp(visitor['CheckInTime'])
+    return row
+
+def expected_row(visitor, now):
+    row = _visitor_fields(visitor)
+    row['ExpectedTime'] = format_timestamp(visitor['AdvanceCheckInTime'], TIME_FORMAT)
+    row['late'] = visitor['AdvanceCheckInTime'] < now
+    return row
+
+def recent_row(visitor):
+    row = _visitor_fields(visitor)
+    row['BadgeNumber'] = visitor['BadgeNumber']
+    row['CheckInTime'] = format_timestamp(visitor['CheckInTime'])
+    row['CheckOutTime'] = format_timestamp(visitor['CheckOutTime'])
+    row['Status'] = visitor['Status']
+    row['badge_class'], row['status_label'] = STATUS_BADGES.get(visitor['Status'], ('bg-warning', visitor['Status']))
+    return row
+
+def pending_row(visitor):
+    row = _visitor_fields(visitor)
+    row['ExpectedTime'] = format_timestamp(visitor['AdvanceCheckInTime'])
+    row['RegisteredBy'] = f"{visitor['ColleagueFirstName'] or ''} {visitor['ColleagueLastName'] or ''}"
+    return row
+
+
+def build(snapshot, now):
+    """Returns the records page's rows as lists of rendered HTML.
+
+    'current' holds the checked-in visitors followed by the pending visitors
+    expected today, 'recent' the first page of history and 'pending' every
+    pending visitor; 'pending_count' is for the tab badge.
+    """
+    today = now.date()
+    current = [current_row(visitor) for visitor in snapshot['checked_in'] if visitor['Status'] == 'CheckedIn']
+    expected = [
+        expected_row(visitor, now) for visitor in snapshot['pending']
+        if visitor['AdvanceCheckInTime'] and visitor['AdvanceCheckInTime'].date() == today
+    ]
+    return {
+        'current': [row_cache.render('current_row', row) for row in current]
+                   + [row_cache.render('expected_row', row) for row in expected],
+        'recent': [row_cache.render('recent_row', recent_row(visitor)) for visitor in snapshot['recent']],
+        'pending': [row_cache.render('pending_row', pending_row(visitor)) for visitor in snapshot['pending']],
+        'pending_count': len(snapshot['pending']),
+    }
@@ -0,0 +1,245 @@
+# rollups.py
+"""Hourly and daily visit rollups for the visit reports.
+
+Usage:
+    python rollups.py backfill                          # rebuild every day since the first visit
+    python rollups.py backfill 2025-01-01 [2025-03-31]  # rebuild a range of days
+
+Two small tables next to the visitor table hold, per hour and per day:
+    visit rollup      check-ins, completed visits and total time on site, by
+                      branch, department and visitor type (a visit counts in
+                      the period it started)
+    occupancy rollup  the most visitors checked in at once, by branch
+
+database.py updates both inside the check-in and check-out transactions
+(RollupWriter), so reports never scan the visitor table. `backfill`
+recomputes whole days from the visitor table and its archive (see
+archive.py), one transaction per day: use it after deploying, or to repair
+days edited directly in the database.
+Check-ins made while today is being backfilled may be counted twice; run
+it again in a quiet moment to correct that.
+"""
+import os
+import sys
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, date, time, timedelta
+
+import log_config
+import migrations
+import visitor_record
+
+logger = logging.getLogger(__name__)
+
+
+# Backfill: visits longer than this are not counted towards later days' occupancy
+ROLLUP_MAX_VISIT_HOURS = float(os.getenv('ROLLUP_MAX_VISIT_HOURS', '24'))
+
+HOURLY, DAILY = 'H', 'D'
+GRAINS = {'hour': HOURLY, 'day': DAILY}
+
+VISIT_KEYS = ('Grain', 'PeriodStart', 'Branch', 'DepartmentVisited', 'VisitorType')
+VISIT_SUMS = ('CheckIns', 'CompletedVisits', 'DwellSeconds')
+OCCUPANCY_KEYS = ('Grain', 'PeriodStart', 'Branch')
+OCCUPANCY_MAXES = ('PeakOccupancy',)
+
+# Report grouping names -> visit rollup columns
+GROUP_COLUMNS = {'branch': 'Branch', 'department': 'DepartmentVisited', 'visitor_type': 'VisitorType'}
+
+
+def periods(moment):
+    """The (grain, period start) buckets a moment falls in."""
+    hour = moment.replace(minute=0, second=0, microsecond=0)
+    return (HOURLY, hour), (DAILY, hour.replace(hour=0))
+
+def _dimensions(visit):
+    return (visit.get('Branch') or '', visit.get('DepartmentVisited') or '', visit.get('VisitorType') or '')
+
+def _dwell_seconds(visit):
+    return max(0, int((visit['CheckOutTime'] - visit['CheckInTime']).total_seconds()))
+
+
+class RollupWriter:
+    """Applies check-ins and check-outs to the rollup tables on the caller's cursor (and transaction)."""
+
+    def __init__(self, backend, table):
+        self.backend = backend
+        self.table = table
+        self.visit_table = migrations.companion_table(table, migrations.VISIT_ROLLUP_SUFFIX)
+        self.occupancy_table = migrations.companion_table(table, migrations.OCCUPANCY_ROLLUP_SUFFIX)
+        self.archive_table = migrations.companion_table(table, migrations.ARCHIVE_SUFFIX)
+        self._visit_upsert = backend.upsert_sql(self.visit_table, VISIT_KEYS, sums=VISIT_SUMS)
+        self._occupancy_upsert = backend.upsert_sql(self.occupancy_table, OCCUPANCY_KEYS, maxes=OCCUPANCY_MAXES)
+
+    def _occupancy(self, cursor):
+        """Visitors checked in right now, by branch (as seen inside the current transaction)."""
+        cursor.execute(f"SELECT Branch, COUNT(*) FROM {self.table} WHERE Status = 'CheckedIn' GROUP BY Branch")
+        return {branch or '': count for branch, count in cursor.fetchall()}
+
+    def _write(self, cursor, visits, peaks):
+        if visits:
+            self.backend.executemany(cursor, self._visit_upsert, [key + tuple(sums) for key, sums in visits.items()])
+        if peaks:
+            self.backend.executemany(cursor, self._occupancy_upsert, [key + (peak,) for key, peak in peaks.items()])
+
+    def checkins(self, cursor, visitors):
+        """Counts newly checked-in visitors (rows with Branch, DepartmentVisited, VisitorType, CheckInTime)."""
+        visitors = [visitor for visitor in visitors if visitor.get('CheckInTime')]
+        if not visitors:
+            return
+        visits = defaultdict(lambda: [0, 0, 0])
+        latest = {}  # branch -> last check-in time, when occupancy peaked
+        for visitor in visitors:
+            for grain, start in periods(visitor['CheckInTime']):
+                visits[(grain, start) + _dimensions(visitor)][0] += 1
+            branch = _dimensions(visitor)[0]
+            latest[branch] = max(latest.get(branch, visitor['CheckInTime']), visitor['CheckInTime'])
+        occupancy = self._occupancy(cursor)
+        peaks = {}
+        for branch, moment in latest.items():
+            for grain, start in periods(moment):
+                peaks[(grain, start, branch)] = occupancy.get(branch, 0)
+        self._write(cursor, visits, peaks)
+
+    def checkouts(self, cursor, visitors):
+        """Counts completed visits (rows with the dimensions plus CheckInTime and CheckOutTime)."""
+        visitors = [visitor for visitor in visitors if visitor.get('CheckInTime') and visitor.get('CheckOutTime')]
+        if not visitors:
+            return
+        visits = defaultdict(lambda: [0, 0, 0])
+        leaving = Counter()
+        earliest = {}  # branch -> first check-out time; occupancy was highest just before it
+        for visitor in visitors:
+            for grain, start in periods(visitor['CheckInTime']):
+                sums = visits[(grain, start) + _dimensions(visitor)]
+                sums[1] += 1
+                sums[2] += _dwell_seconds(visitor)
+            branch = _dimensions(visitor)[0]
+            leaving[branch] += 1
+            earliest[branch] = min(earliest.get(branch, visitor['CheckOutTime']), visitor['CheckOutTime'])
+        occupancy = self._occupancy(cursor)
+        peaks = {}
+        for branch, moment in earliest.items():
+            for grain, start in periods(moment):
+                peaks[(grain, start, branch)] = occupancy.get(branch, 0) + leaving[branch]
+        self._write(cursor, visits, peaks)
+
+    def rebuild_day(self, cursor, day):
+        """Recomputes one day's hourly and daily rows from the visitor and archive tables. Returns the day's check-ins."""
+        start = datetime.combine(day, time())
+        end = start + timedelta(days=1)
+        cursor.execute(f"DELETE FROM {self.visit_table} WHERE PeriodStart >= ? AND PeriodStart < ?", (start, end))
+        cursor.execute(f"DELETE FROM {self.occupancy_table} WHERE PeriodStart >= ? AND PeriodStart < ?", (start, end))
+        columns = "Branch, DepartmentVisited, VisitorType, CheckInTime, CheckOutTime"
+        window = (start - timedelta(hours=ROLLUP_MAX_VISIT_HOURS), end)
+        cursor.execute(f"""
+            SELECT {columns} FROM {self.table} WHERE CheckInTime >= ? AND CheckInTime < ?
+            UNION ALL
+            SELECT {columns} FROM {self.archive_table} WHERE CheckInTime >= ? AND CheckInTime < ?
+        """, window * 2)
+        rows = visitor_record.from_rows(visitor_record.columns_of(cursor), cursor.fetchall())
+
+        visits = defaultdict(lambda: [0, 0, 0])
+        changes = []  # (moment, +1 arriving / -1 leaving, branch)
+        for visit in rows:
+            branch = _dimensions(visit)[0]
+            if visit['CheckInTime'] >= start:
+                for grain, period in periods(visit['CheckInTime']):
+                    sums = visits[(grain, period) + _dimensions(visit)]
+                    sums[0] += 1
+                    if visit['CheckOutTime']:
+                        sums[1] += 1
+                        sums[2] += _dwell_seconds(visit)
+            changes.append((visit['CheckInTime'], 1, branch))
+            if visit['CheckOutTime']:
+                changes.append((visit['CheckOutTime'], -1, branch))
+
+        # Replay arrivals and departures in order (arrivals first within the same
+        # instant, as the write path sees them); the peak of a period is the
+        # highest count seen at any change inside it
+        present = Counter()
+        peaks = {}
+        for moment, change, branch in sorted(changes, key=lambda item: (item[0], -item[1])):
+            if moment >= end:
+                break
+            before = present[branch]
+            present[branch] += change
+            if moment >= start:
+                for grain, period in periods(moment):
+                    key = (grain, period, branch)
+                    peaks[key] = max(peaks.get(key, 0), before, present[branch])
+
+        # The day's rows were deleted above, so the upserts only insert
+        self._write(cursor, visits, peaks)
+        return sum(sums[0] for key, sums in visits.items() if key[0] == DAILY)
+
+
+def _average_minutes(dwell_seconds, completed):
+    return round(dwell_seconds / completed / 60, 1) if completed else None
+
+def summarize(rollups, group_by=('branch',)):
+    """Turns database.get_visit_rollups() rows into the report served by /api/reports/visits.
+
+    Returns totals, one entry per period (with peak occupancy across
+    branches) and a breakdown by the `group_by` names in GROUP_COLUMNS.
+    """
+    group_columns = [GROUP_COLUMNS[name] for name in group_by]
+    totals = [0, 0, 0]
+    by_period = defaultdict(lambda: [0, 0, 0])
+    by_group = defaultdict(lambda: [0, 0, 0])
+    for row in rollups['visits']:
+        values = (row['CheckIns'], row['CompletedVisits'], row['DwellSeconds'])
+        for sums in (totals, by_period[row['PeriodStart']], by_group[tuple(row[column] for column in group_columns)]):
+            for i, value in enumerate(values):
+                sums[i] += value
+
+    # Branches peak independently; a period's figure is the sum of each branch's peak
+    peak_by_period = Counter()
+    peak_by_branch = Counter()
+    for row in rollups['occupancy']:
+        peak_by_period[row['PeriodStart']] += row['PeakOccupancy']
+        peak_by_branch[row['Branch']] = max(peak_by_branch[row['Branch']], row['PeakOccupancy'])
+
+    def figures(sums):
+        return {
+            'check_ins': sums[0],
+            'completed_visits': sums[1],
+            'average_minutes': _average_minutes(sums[2], sums[1]),
+        }
+
+    return {
+        'totals': dict(figures(totals), peak_occupancy=max(peak_by_period.values(), default=0)),
+        'periods': [
+            dict(figures(by_period[period]), period=period.isoformat(), peak_occupancy=peak_by_period[period])
+            for period in sorted(set(by_period) | set(peak_by_period))
+        ],
+        'breakdown': sorted(
+            (dict(figures(sums), **dict(zip(group_by, key))) for key, sums in by_group.items()),
+            key=lambda entry: entry['check_ins'], reverse=True),
+        'peak_by_branch': dict(peak_by_branch),
+    }
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] != 'backfill' or len(argv) > 4:
+        print(__doc__)
+        return 2
+    import database  # imported here so the report helpers work without a database
+
+    try:
+        first = date.fromisoformat(argv[2]) if len(argv) > 2 else None
+        last = date.fromisoformat(argv[3]) if len(argv) > 3 else date.today()
+    except ValueError as e:
+        print(f"Invalid date: {e}")
+        return 2
+    days, error = database.backfill_rollups(first, last)
+    if error:
+        print(f"Backfill failed: {error}")
+        return 1
+    print(f"Rebuilt rollups for {days} day(s).")
+    return 0
+
+
+if __name__ == '__main__':
+    log_config.configure_logging(default_format='text')
+    sys.exit(main(sys.argv))
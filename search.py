@@ -0,0 +1,250 @@
+# search.py
+"""In-memory prefix search over visitor names, hosts and vendors.
+
+Each worker keeps an index of every visitor who is checked in or pending,
+plus everyone who checked in within SEARCH_INDEX_DAYS. It is loaded from
+the database on a background thread and then follows the shared event log
+(see events.EventBus.add_listener), so check-ins handled by any worker show
+up within EVENTS_POLL_INTERVAL. Lookups are a binary search over the sorted
+words, never a LIKE scan against the database.
+"""
+import os
+import re
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_INDEX_DAYS = int(os.getenv('SEARCH_INDEX_DAYS', '365'))  # checked-out visitors kept this long
+SEARCH_REBUILD_SECONDS = float(os.getenv('SEARCH_REBUILD_SECONDS', '900'))  # picks up writes made outside the app
+SEARCH_RETRY_SECONDS = 30  # after a failed load
+SEARCH_MAX_RESULTS = 50
+
+# Columns kept per visitor and returned by /api/search
+ENTRY_FIELDS = (
+    'VisitorID', 'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch', 'DepartmentVisited',
+    'VendorName', 'BadgeNumber', 'HostEmployeeName', 'CheckInTime', 'AdvanceCheckInTime', 'Status',
+)
+
+# Checked-in visitors first, then expected ones, then history
+_STATUS_RANK = {'CheckedIn': 0, 'Pending': 1}
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text):
+    """Lower-cased words of `text` ('O'Neil-Smith' -> ['o', 'neil', 'smith'])."""
+    return _WORD.findall(text.casefold()) if text else []
+
+
+class PrefixIndex:
+    """Maps words to sets of keys; finds every key with a word starting with a prefix."""
+
+    def __init__(self):
+        self._keys = {}  # word -> set of keys
+        self._words = []  # sorted, for bisect
+
+    def add(self, key, text):
+        for word in words(text):
+            keys = self._keys.get(word)
+            if keys is None:
+                keys = self._keys[word] = set()
+                bisect.insort(self._words, word)
+            keys.add(key)
+
+    def add_many(self, pairs):
+        """Adds (key, text) pairs, sorting the words once instead of per insert."""
+        for key, text in pairs:
+            for word in words(text):
+                self._keys.setdefault(word, set()).add(key)
+        self._words = sorted(self._keys)
+
+    def remove(self, key, text):
+        for word in words(text):
+            keys = self._keys.get(word)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._keys[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+
+    def find(self, prefix):
+        """Returns the set of keys with a word starting with `prefix`."""
+        start = bisect.bisect_left(self._words, prefix)
+        end = bisect.bisect_left(self._words, prefix + '\U0010ffff', start)
+        found = set()
+        for word in self._words[start:end]:
+            found |= self._keys[word]
+        return found
+
+
+def _entry(visitor):
+    entry = {}
+    for field in ENTRY_FIELDS:
+        value = visitor.get(field)
+        entry[field] = value.isoformat() if isinstance(value, datetime) else value
+    return entry
+
+def _full_name(entry):
+    return f"{entry['GuestFirstName'] or ''} {entry['GuestLastName'] or ''}"
+
+
+class _Snapshot:
+    """One complete set of entries and the prefix indexes over them."""
+
+    def __init__(self, entries=()):
+        self.entries = {entry['VisitorID']: entry for entry in entries}  # VisitorID -> entry
+        self.names = PrefixIndex()
+        self.hosts = PrefixIndex()
+        self.vendors = PrefixIndex()
+        self.names.add_many((key, _full_name(entry)) for key, entry in self.entries.items())
+        self.hosts.add_many((key, entry['HostEmployeeName']) for key, entry in self.entries.items())
+        self.vendors.add_many((key, entry['VendorName']) for key, entry in self.entries.items())
+
+    def add(self, entry):
+        visitor_id = entry['VisitorID']
+        self.entries[visitor_id] = entry
+        self.names.add(visitor_id, _full_name(entry))
+        self.hosts.add(visitor_id, entry['HostEmployeeName'])
+        self.vendors.add(visitor_id, entry['VendorName'])
+
+    def remove(self, visitor_id):
+        entry = self.entries.pop(visitor_id, None)
+        if entry is not None:
+            self.names.remove(visitor_id, _full_name(entry))
+            self.hosts.remove(visitor_id, entry['HostEmployeeName'])
+            self.vendors.remove(visitor_id, entry['VendorName'])
+
+    def apply(self, name, data):
+        """Applies one visitor change from the event log; applying it twice is harmless."""
+        if name == 'checkout':
+            # Checkout events carry the changed columns only
+            for visitor in data.get('visitors', ()):
+                entry = self.entries.get(visitor.get('VisitorID'))
+                if entry is not None:
+                    entry.update({field: visitor[field] for field in ENTRY_FIELDS if field in visitor})
+        elif name == 'archive':
+            for visitor in data.get('visitors', ()):
+                self.remove(visitor.get('VisitorID'))
+        elif name in ('checkin', 'preregister') and data.get('VisitorID') is not None:
+            previous = self.entries.get(data['VisitorID'], {})
+            self.remove(data['VisitorID'])
+            self.add({field: data.get(field, previous.get(field)) for field in ENTRY_FIELDS})
+
+
+class SearchIndex:
+    """Visitor, host and vendor lookups for one worker.
+
+    `loader(since)` returns (visitor rows, error), see database.get_search_rows;
+    `bus` is the events.EventBus that delivers writes from every worker.
+
+    A background thread started by start() loads the rows into a new snapshot
+    and swaps it in whole, every `rebuild_seconds` or after a bulk import.
+    Searches never touch the database; until the first load they find nothing.
+    """
+
+    def __init__(self, loader, bus, rebuild_seconds=SEARCH_REBUILD_SECONDS):
+        self._loader = loader
+        self._bus = bus
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()
+        self._reload = threading.Event()
+        self._pid = None
+        self._snapshot = _Snapshot()
+        self._pending = None  # events seen while a rebuild is loading, replayed onto it
+
+    def start(self):
+        """Starts this worker's rebuild thread (no-op if already running)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._snapshot = _Snapshot()
+            self._pending = None
+        # Follow the event log before loading so no write falls in between
+        self._bus.add_listener(self.on_event)
+        self._reload.set()
+        threading.Thread(target=self._run, name='search-index', daemon=True).start()
+
+    def _run(self):
+        loaded = False
+        while True:
+            # Retry a failed load sooner than the regular reload
+            self._reload.wait(self.rebuild_seconds if loaded else min(self.rebuild_seconds, SEARCH_RETRY_SECONDS))
+            self._reload.clear()
+            try:
+                loaded = self.rebuild()
+            except Exception as e:
+                logger.error("Error rebuilding the search index: %s", e, exc_info=True)
+                loaded = False
+
+    def rebuild(self):
+        """Reloads every entry from the database into a new snapshot; returns True on success."""
+        with self._lock:
+            self._pending = []
+        rows, error = self._loader(datetime.now() - timedelta(days=SEARCH_INDEX_DAYS))
+        if error:
+            with self._lock:
+                self._pending = None
+            logger.error("Error loading the search index: %s", error)
+            return False
+        snapshot = _Snapshot(_entry(row) for row in rows)
+        with self._lock:
+            for name, data in self._pending:
+                snapshot.apply(name, data)
+            self._pending = None
+            self._snapshot = snapshot
+        logger.info("Search index loaded with %s visitors", len(rows))
+        return True
+
+    def on_event(self, event):
+        """Event bus listener: applies one visitor change."""
+        name, data = event.get('event'), event.get('data') or {}
+        if name == 'import':
+            self._reload.set()  # only a row count; reload in the background
+            return
+        with self._lock:
+            self._snapshot.apply(name, data)
+            if self._pending is not None:
+                self._pending.append((name, data))
+
+    def _match(self, index, terms):
+        """Keys matching every term as a prefix of some word."""
+        matched = None
+        for term in terms:
+            found = index.find(term)
+            matched = found if matched is None else matched & found
+            if not matched:
+                break
+        return matched or set()
+
+    def search(self, query, limit=10):
+        """Returns {'visitors': [...], 'hosts': [...], 'vendors': [...]} for a typeahead query.
+
+        Every word of the query must prefix-match a word of the visitor's name,
+        host or vendor; visitors are ordered checked in, pending, then most recent.
+        """
+        terms = words(query)
+        limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+        if not terms:
+            return {'visitors': [], 'hosts': [], 'vendors': []}
+        self.start()  # after a fork; otherwise a no-op
+        with self._lock:
+            snapshot = self._snapshot
+            by_host = self._match(snapshot.hosts, terms)
+            by_vendor = self._match(snapshot.vendors, terms)
+            matched = self._match(snapshot.names, terms) | by_host | by_vendor
+            visitors = [dict(snapshot.entries[key]) for key in matched]
+            hosts = {snapshot.entries[key]['HostEmployeeName'] for key in by_host}
+            vendors = {snapshot.entries[key]['VendorName'] for key in by_vendor}
+        visitors.sort(key=lambda entry: entry['CheckInTime'] or entry['AdvanceCheckInTime'] or '', reverse=True)
+        visitors.sort(key=lambda entry: _STATUS_RANK.get(entry['Status'], 2))
+        return {
+            'visitors': visitors[:limit],
+            'hosts': sorted(hosts, key=str.casefold)[:limit],
+            'vendors': sorted(vendors, key=str.casefold)[:limit],
+        }
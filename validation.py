@@ -0,0 +1,29 @@
+# validation.py
+from datetime import datetime
+
+
+# Required fields for each way a visitor can be entered
+IMMEDIATE_REQUIRED_FIELDS = [
+    'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch',
+    'DepartmentVisited', 'BadgeNumber', 'HostEmployeeName'
+]
+ADVANCED_REQUIRED_FIELDS = [
+    'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch',
+    'DepartmentVisited', 'HostEmployeeName', 'ColleagueFirstName',
+    'ColleagueLastName', 'AdvanceCheckInTime'
+]
+VENDOR_REQUIRED_FIELDS = [
+    'GuestFirstName', 'GuestLastName', 'VisitorType', 'Branch',
+    'DepartmentVisited', 'HostEmployeeName', 'VendorName', 'AdvanceCheckInTime'
+]
+
+
+def missing_fields(visitor_details, required_fields):
+    """Returns the required fields that are empty or absent."""
+    return [field for field in required_fields if not visitor_details.get(field)]
+
+def parse_advance_time(value):
+    """Parses an expected check-in time as sent by the forms (ISO 8601); raises ValueError."""
+    if not isinstance(value, str):
+        raise ValueError(f"expected an ISO 8601 date and time, got {value!r}")
+    return datetime.fromisoformat(value.strip().replace('Z', '+00:00'))